@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""Times the scalar, batch, Monte Carlo and fitting paths of dipole_error at catalog sizes from 1 to
+10^7, and compares the throughput with a saved baseline.
+
+Each benchmark is run at sizes 1, 10, ..., up to --max-size (or its own cap: the scalar functions
+are called once per row, so they stop at SCALAR_MAX_SIZE, and the resampling paths, whose cost is
+rows times realizations, at RESAMPLE_MAX_SIZE). A timing is the best of several runs; results are
+rows per second. The output is JSON with the machine and library versions next to the results.
+
+With --baseline, every (benchmark, size) present in both files is compared; throughput that fell
+by more than --tolerance is reported as a regression and the exit status is 1. Comparisons are only
+meaningful between runs on the same machine.
+
+Usage:
+    $ python benchmark.py --output baseline.json
+    $ python benchmark.py --baseline baseline.json --output current.json
+    $ python benchmark.py --only evaluate_models fit_dipole --max-size 10000000
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+import uncertainties
+
+import dipole_error
+import dipole_fit
+import dipole_null
+import dipole_resample
+import dipole_scan
+
+SCALAR_MAX_SIZE = 10 ** 4
+RESAMPLE_MAX_SIZE = 10 ** 5
+# Realizations of the Monte Carlo and resampling benchmarks.
+N_REALIZATIONS = 100
+# A timing repeats until it has run REPEAT times or for MIN_SECONDS.
+REPEAT = 5
+MIN_SECONDS = 0.5
+
+# ===========
+# = Inputs =
+# ===========
+
+def _catalog(size, seed=0):
+    """Random sightlines (radians), redshifts, distances and measurements."""
+    state = np.random.RandomState(seed)
+    right_ascension = state.uniform(0.0, 2.0 * np.pi, size)
+    declination = np.arcsin(state.uniform(-1.0, 1.0, size))
+    z_redshift = state.uniform(0.2, 4.0, size)
+    errors = state.uniform(1e-6, 3e-6, size)
+    values = 1e-5 * dipole_error._unit_vector(right_ascension, declination).dot([-0.1, -0.4, -0.9]) + \
+             state.normal(0.0, errors)
+    return right_ascension, declination, z_redshift, 3.0 * z_redshift, values, errors
+
+def _sexagesimal(right_ascension, declination):
+    hours = np.degrees(right_ascension) / 15.0
+    degrees = np.degrees(declination)
+    ra = ["%02d %02d %06.3f" % (h, (h * 60) % 60, (h * 3600) % 60) for h in hours.tolist()]
+    dec = ["%s%02d %02d %05.2f" % ("-" if d < 0 else "+", abs(d), (abs(d) * 60) % 60, (abs(d) * 3600) % 60) \
+           for d in degrees.tolist()]
+    return np.array(ra), np.array(dec)
+
+# ===============
+# = Benchmarks =
+# ===============
+# Each benchmark takes a size and returns the function to time (inputs are built outside it).
+
+def _scalar(function, *terms):
+    def setup(size):
+        right_ascension, declination, z_redshift, radial_distance = _catalog(size)[:4]
+        columns = [right_ascension, declination] + [{'z': z_redshift, 'r': radial_distance}[t] for t in terms]
+        rows = zip(*[column.tolist() for column in columns])
+        def run():
+            for row in rows:
+                function(*row)
+        return run
+    return setup
+
+def _statistical_difference(size):
+    state = np.random.RandomState(1)
+    pairs = [(uncertainties.ufloat(a, 2e-6), uncertainties.ufloat(b, 3e-6)) \
+             for a, b in zip(state.normal(0, 1e-5, size).tolist(), state.normal(0, 1e-5, size).tolist())]
+    def run():
+        for one, two in pairs:
+            dipole_error.statistical_difference_systematic(one, two, 1.65e-6)
+    return run
+
+def _array(name):
+    def setup(size):
+        right_ascension, declination, z_redshift, radial_distance = _catalog(size)[:4]
+        if name == "dipole_monopole_array":
+            return lambda: dipole_error.dipole_monopole_array(right_ascension, declination)
+        if name == "z_dipole_monopole_array":
+            return lambda: dipole_error.z_dipole_monopole_array(right_ascension, declination, z_redshift=z_redshift)
+        return lambda: dipole_error.r_dipole_monopole_array(right_ascension, declination, \
+                                                            radial_distance=radial_distance)
+    return setup
+
+def _statistical_difference_array(size):
+    state = np.random.RandomState(1)
+    one, two = state.normal(0, 1e-5, size), state.normal(0, 1e-5, size)
+    return lambda: dipole_error.statistical_difference_systematic_array(one, 2e-6, two, 3e-6, 1.65e-6)
+
+def _evaluate_models(text):
+    def setup(size):
+        right_ascension, declination, z_redshift, radial_distance = _catalog(size)[:4]
+        if text:
+            right_ascension, declination = _sexagesimal(right_ascension, declination)
+        return lambda: dipole_error.evaluate_models(right_ascension, declination, z_redshift, radial_distance)
+    return setup
+
+def _monte_carlo(size):
+    right_ascension, declination = _catalog(size)[:2]
+    model = dipole_error.DipoleModel()
+    return lambda: dipole_error.monte_carlo(model, right_ascension, declination, n_samples=N_REALIZATIONS, seed=1)
+
+def _fit(name):
+    def setup(size):
+        # a fit needs more sightlines than its 4 parameters
+        right_ascension, declination, z_redshift, _, values, errors = _catalog(max(size, 8))
+        if name == "fit_dipole":
+            return lambda: dipole_fit.fit_dipole(right_ascension, declination, values, errors)
+        if name == "fit_z_dipole":
+            return lambda: dipole_fit.fit_dipole(right_ascension, declination, values, errors, z_redshift, 0.46)
+        if name == "jackknife":
+            return lambda: dipole_resample.jackknife(right_ascension, declination, values, errors)
+        if name == "bootstrap":
+            return lambda: dipole_resample.bootstrap(right_ascension, declination, values, errors, \
+                                                     n_resamples=N_REALIZATIONS, seed=1)
+        if name == "null_test":
+            return lambda: dipole_null.null_test(right_ascension, declination, values, errors, \
+                                                 n_realizations=N_REALIZATIONS, seed=1)
+        return lambda: dipole_scan.direction_scan(right_ascension, declination, values, errors)
+    return setup
+
+# name: (setup, largest size)
+BENCHMARKS = [
+    ("dipole_monopole", (_scalar(dipole_error.dipole_monopole), SCALAR_MAX_SIZE)),
+    ("z_dipole_monopole", (_scalar(lambda a, d, z: dipole_error.z_dipole_monopole(a, d, z_redshift=z), 'z'), \
+                           SCALAR_MAX_SIZE)),
+    ("r_dipole_monopole", (_scalar(lambda a, d, r: dipole_error.r_dipole_monopole(a, d, radial_distance=r), 'r'), \
+                           SCALAR_MAX_SIZE)),
+    ("statistical_difference_systematic", (_statistical_difference, SCALAR_MAX_SIZE)),
+    ("dipole_monopole_array", (_array("dipole_monopole_array"), None)),
+    ("z_dipole_monopole_array", (_array("z_dipole_monopole_array"), None)),
+    ("r_dipole_monopole_array", (_array("r_dipole_monopole_array"), None)),
+    ("statistical_difference_systematic_array", (_statistical_difference_array, None)),
+    ("evaluate_models", (_evaluate_models(False), None)),
+    ("evaluate_models_sexagesimal", (_evaluate_models(True), None)),
+    ("monte_carlo", (_monte_carlo, RESAMPLE_MAX_SIZE)),
+    ("fit_dipole", (_fit("fit_dipole"), None)),
+    ("fit_z_dipole", (_fit("fit_z_dipole"), None)),
+    ("jackknife", (_fit("jackknife"), None)),
+    ("bootstrap", (_fit("bootstrap"), RESAMPLE_MAX_SIZE)),
+    ("null_test", (_fit("null_test"), RESAMPLE_MAX_SIZE)),
+    ("direction_scan", (_fit("direction_scan"), None)),
+]
+
+def time_function(function, repeat=REPEAT, min_seconds=MIN_SECONDS):
+    """Best time of one call, over up to repeat calls (at least one, and fewer once min_seconds
+    have passed)."""
+    best = np.inf
+    started = timeit.default_timer()
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        function()
+        best = min(best, timeit.default_timer() - start)
+        if timeit.default_timer() - started > min_seconds:
+            break
+    return best
+
+def import_time():
+    """Seconds a fresh interpreter takes to import dipole_error."""
+    script = "import timeit; start = timeit.default_timer(); import dipole_error; print timeit.default_timer() - start"
+    return min(float(subprocess.check_output([sys.executable, "-c", script], \
+                                             cwd=os.path.dirname(os.path.abspath(dipole_error.__file__)))) \
+               for _ in range(REPEAT))
+
+def sizes(max_size):
+    return [10 ** exponent for exponent in range(int(np.log10(max_size) + 1e-9) + 1)]
+
+def run(max_size=10 ** 6, only=None, log=None):
+    """Runs the benchmarks; returns a list of result dicts."""
+    results = [dict(name="import", size=1, seconds=import_time(), rows_per_second=None)]
+    for name, (setup, cap) in BENCHMARKS:
+        if only and name not in only:
+            continue
+        for size in sizes(max_size if cap is None else min(max_size, cap)):
+            seconds = time_function(setup(size))
+            results.append(dict(name=name, size=size, seconds=seconds, rows_per_second=size / max(seconds, 1e-9)))
+            if log is not None:
+                print >> log, "%-40s %9d %12.6f s %14.0f rows/s" % (name, size, seconds, results[-1]["rows_per_second"])
+    return results
+
+# ==============
+# = Reporting =
+# ==============
+
+def metadata():
+    """The machine and software a run was made on."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=open(os.devnull, "w"), \
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(date=datetime.datetime.utcnow().isoformat() + "Z", host=socket.gethostname(), \
+                platform=platform.platform(), machine=platform.machine(), processor=platform.processor(), \
+                cpu_count=multiprocessing.cpu_count(), python=platform.python_version(), \
+                numpy=np.__version__, uncertainties=uncertainties.__version__, commit=commit)
+
+def compare(results, baseline, tolerance=0.2):
+    """Throughput ratios of results to a baseline run.
+
+    :param tolerance: fraction of the baseline throughput that may be lost before a regression is flagged.
+    :returns: (name, size, ratio, regressed) for every benchmark in both runs.
+    :rtype: list of tuple
+    """
+    reference = dict(((entry["name"], entry["size"]), entry) for entry in baseline["results"])
+    comparison = []
+    for entry in results:
+        old = reference.get((entry["name"], entry["size"]))
+        if old is None:
+            continue
+        # rows per second, or 1 / seconds for the import time
+        ratio = old["seconds"] / max(entry["seconds"], 1e-12)
+        comparison.append((entry["name"], entry["size"], ratio, ratio < 1.0 - tolerance))
+    return comparison
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dipole_error and compare with a baseline.")
+    parser.add_argument("--output", default="-", help="JSON file for the results (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, \
+                        help="flag throughput losses larger than this fraction (default: 0.2)")
+    parser.add_argument("--max-size", type=int, default=10 ** 6, help="largest catalog size (default: 10^6)")
+    parser.add_argument("--only", nargs="+", default=None, choices=[name for name, _ in BENCHMARKS], \
+                        help="benchmarks to run (default: all)")
+    args = parser.parse_args(argv)
+    report = dict(metadata=metadata(), results=run(args.max_size, args.only, sys.stderr))
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print
+    else:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=1, sort_keys=True)
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    if baseline["metadata"].get("host") != report["metadata"]["host"]:
+        print >> sys.stderr, "benchmark: the baseline is from another machine (%s)" % baseline["metadata"].get("host")
+    regressions = 0
+    for name, size, ratio, regressed in compare(report["results"], baseline, args.tolerance):
+        print >> sys.stderr, "%-40s %9d %6.2fx%s" % (name, size, ratio, "  REGRESSION" if regressed else "")
+        regressions += regressed
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
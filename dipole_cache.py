@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""On-disk cache of model predictions, for catalogs that are evaluated again and again.
+
+An entry is keyed on a hash of the model (its class, name, parameter values and covariance), of
+the position arrays and of the sightline terms, so a changed parameter or a changed catalog simply
+misses. Entries are .npy files holding the predicted values and errors stacked into one
+(2,) + shape array; a hit is returned memory-mapped, without reading or recomputing anything.
+
+The cache is bounded by max_bytes: after every write the least recently used entries (by file
+modification time, which a hit refreshes) are removed. Several processes can share a directory:
+entries are written to a temporary file and renamed into place, so readers only ever see complete
+files, and writes and evictions hold an exclusive flock on the directory's lock file. An entry
+removed while another process has it mapped stays readable there (POSIX semantics).
+
+Examples:
+
+>>> cache = dipole_cache.PredictionCache(max_bytes=2 ** 32)
+>>> values, errors = cache.evaluate(dipole_error.DipoleModel(), right_ascension, declination)
+>>> predictions = cache.evaluate_models(right_ascension, declination, z_redshift, radial_distance)
+"""
+import collections
+import fcntl
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import dipole_error
+
+# Directory of the cache, and its default size bound in bytes.
+PREDICTION_CACHE = os.path.join(os.environ.get("DIPOLE_ERROR_CACHE", \
+                                               os.path.join(os.path.expanduser("~"), ".cache", "dipole_error")), \
+                                "predictions")
+MAX_CACHE_BYTES = 2 ** 30
+# Changes whenever the stored format (or the way predictions are computed) changes.
+CACHE_VERSION = 1
+
+def array_digest(array):
+    """Hash of the type, shape and content of an array (MD5, which reads several times faster
+    than SHA-1; the inputs are not adversarial)."""
+    array = np.asarray(array)
+    if array.dtype.kind == "O":
+        # the buffer of an object array holds pointers: hash the elements, as fixed-width strings
+        # (e.g. sexagesimal positions) where possible
+        elements = array.tolist()
+        array = np.array(elements)
+        if array.dtype.kind == "O":
+            return hashlib.md5(repr(("O", np.shape(elements), elements))).hexdigest()
+    array = np.ascontiguousarray(array)
+    digest = hashlib.md5(repr((array.dtype.str, array.shape)))
+    digest.update(array.data)
+    return digest.hexdigest()
+
+def _model_key(model, name, digests):
+    digest = hashlib.sha1(repr((CACHE_VERSION, type(model).__name__, name, tuple(digests))))
+    digest.update(np.ascontiguousarray(model.values).tostring())
+    digest.update(np.ascontiguousarray(model.covariance).tostring())
+    return digest.hexdigest()
+
+def prediction_key(model, right_ascension, declination, sightline_terms=(), name=None):
+    """Content hash of a model evaluation.
+
+    :param name: name of the model (default: its class name).
+    :returns: hexadecimal SHA-1.
+    :rtype: str
+    """
+    return _model_key(model, name, [array_digest(x) for x in (right_ascension, declination) + tuple(sightline_terms)])
+
+class PredictionCache(object):
+    """Content-addressed store of (values, errors) arrays with LRU eviction.
+
+    Arguments:
+    :param directory: directory of the cache (default: PREDICTION_CACHE).
+    :type directory: string
+    :param max_bytes: size bound of the entries.
+    :type max_bytes: int
+
+    Attributes:
+    hits, misses -- lookups of this object that found, or did not find, an entry.
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_CACHE_BYTES):
+        self.directory = PREDICTION_CACHE if directory is None else directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another process created it first
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def _lock(self):
+        handle = open(os.path.join(self.directory, ".lock"), "a")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def get(self, key):
+        """The memory-mapped (values, errors) of an entry, or None."""
+        path = self._path(key)
+        try:
+            stored = np.load(path, mmap_mode="r")
+            os.utime(path, None)
+        except (IOError, OSError):
+            # missing, or evicted by another process in the meantime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return stored[0], stored[1]
+
+    def put(self, key, values, errors):
+        """Stores an entry, evicts old ones and returns the stored (values, errors)."""
+        stored = np.stack(np.broadcast_arrays(np.asarray(values, dtype=np.float64), \
+                                              np.asarray(errors, dtype=np.float64)))
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as output:
+                np.save(output, stored)
+            lock = self._lock()
+            try:
+                os.rename(temporary, self._path(key))
+                self._evict(keep=key)
+            finally:
+                lock.close()
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return stored[0], stored[1]
+
+    def _entries(self):
+        """(modification time, size, path) of the entries, oldest first."""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".npy"):
+                path = os.path.join(self.directory, filename)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+        return sorted(entries)
+
+    def _evict(self, keep=None):
+        """Removes least recently used entries until the cache fits in max_bytes (lock held)."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == self._path(keep):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        """Removes all entries."""
+        lock = self._lock()
+        try:
+            for _, _, path in self._entries():
+                os.remove(path)
+        finally:
+            lock.close()
+
+    def evaluate(self, model, right_ascension, declination, *sightline_terms, **kwargs):
+        """model.evaluate() through the cache (positions in radians or sexagesimal strings).
+
+        :param name: name of the model in the key (keyword only; default: its class name).
+        :returns: predicted values and their 1-sigma errors (memory-mapped on a hit).
+        :rtype: tuple of numpy.ndarray
+        """
+        key = prediction_key(model, right_ascension, declination, sightline_terms, kwargs.get("name"))
+        stored = self.get(key)
+        if stored is not None:
+            return stored
+        right_ascension, declination = dipole_error._radians(right_ascension, declination)
+        return self.put(key, *model.evaluate(right_ascension, declination, *sightline_terms))
+
+    def evaluate_models(self, \
+                        right_ascension, \
+                        declination, \
+                        z_redshift=dipole_error.REDSHIFT, \
+                        radial_distance=dipole_error.RADIAL_DISTANCE, \
+                        models=dipole_error.MODEL_NAMES, \
+                        covariances=None):
+        """:func:`dipole_error.evaluate_models` through the cache; the models that miss are evaluated
+        together, sharing the separations as there.
+
+        :rtype: numpy.ndarray (structured)
+        """
+        if isinstance(models, dict) and covariances:
+            raise dipole_error.DipoleError("covariances are for published models; give model objects their " \
+                                           "covariance= instead")
+        if not isinstance(models, dict):
+            published = dipole_error.published_models(covariances)
+            unknown = [name for name in models if name not in published]
+            if unknown:
+                raise dipole_error.DipoleError("unknown models %s (choose from %s)" % \
+                                               (", ".join(unknown), ", ".join(dipole_error.MODEL_NAMES)))
+            models = collections.OrderedDict((name, published[name]) for name in models)
+        # every input array is hashed once, whichever models use it
+        digests = [array_digest(x) for x in (right_ascension, declination)]
+        terms = {'z_redshift': array_digest(z_redshift), 'radial_distance': array_digest(radial_distance)}
+        keys = collections.OrderedDict((name, _model_key(model, name, \
+                                                         digests + [terms[term] for term in model.sightline_names])) \
+                                       for name, model in models.items())
+        columns = dict((name, self.get(key)) for name, key in keys.items())
+        missing = collections.OrderedDict((name, model) for name, model in models.items() if columns[name] is None)
+        if missing:
+            computed = dipole_error.evaluate_models(right_ascension, declination, z_redshift, radial_distance, missing)
+            for name in missing:
+                columns[name] = self.put(keys[name], computed[name], computed[name + "_err"])
+        shape = np.broadcast(*[column[0] for column in columns.values()]).shape
+        result = np.empty(shape, dtype=[(field, np.float64) for name in models for field in (name, name + "_err")])
+        for name in models:
+            result[name], result[name + "_err"] = columns[name]
+        return result
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""Streams a QSO absorber table through the King et al. (2012) models.
+
+Input is a CSV or whitespace separated table with the columns
+
+    name  RA  DEC  z  da/a  stat  sys  [r]
+
+RA is in hours and DEC in degrees, as sexagesimal strings ("22h20m06.757", "22:20:06.757", or
+"22 20 06.757" in a CSV file) or decimal numbers; stat and sys are the statistical and systematic
+errors on da/a, and the optional r is the radial distance in GLyr used by the r-dipole model.
+With --distance, missing r are computed from z (see dipole_distance). With --covariance
+MODEL=FILE a model's errors come from the full parameter covariance matrix in FILE (a square
+text table in the order of the model's parameter_names), so correlated parameters are propagated.
+Blank lines and lines starting with "#" are skipped, as is a header line.
+
+The output is a CSV table with the predictions and 1-sigma errors of the dipole (eq. 15), z-dipole
+(eq. 18) and r-dipole (eq. 19) models, and the range of sigma separating the measurement from
+one of the predictions (as statistical_difference_systematic). Rows are read and written in
+chunks, so memory use does not depend on the size of the table.
+
+Usage:
+    $ python dipole_catalog.py absorbers.txt predictions.csv
+    $ cat absorbers.csv | python dipole_catalog.py --compare z_dipole > predictions.csv
+    $ python dipole_catalog.py --covariance dipole=dipole_covariance.txt absorbers.txt predictions.csv
+"""
+import argparse
+import csv
+import itertools
+import re
+import sys
+
+import numpy as np
+
+import dipole_distance
+import dipole_error
+
+CHUNK_ROWS = 2 ** 16
+
+COMPARE_MODELS = ("dipole", "z_dipole", "r_dipole")
+
+OUTPUT_COLUMNS = ("name", "z", "da_a", "stat", "sys", \
+                  "dipole", "dipole_err", "z_dipole", "z_dipole_err", "r_dipole", "r_dipole_err", \
+                  "sigma_min", "sigma_max")
+
+class CatalogError(dipole_error.DipoleError):
+    pass
+
+# ===========
+# = Reading =
+# ===========
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+def _rows(lines, delimiter=None):
+    """Splits the data lines of a table into fields; a header line is dropped.
+
+    The delimiter is "," if the first data line contains one, and whitespace otherwise.
+    """
+    lines = (line for line in lines if line.strip() and not line.lstrip().startswith("#"))
+    first = next(lines, None)
+    if first is None:
+        return iter(())
+    if delimiter is None:
+        delimiter = "," if "," in first else " "
+    lines = itertools.chain([first], lines)
+    if delimiter == " ":
+        rows = (line.split() for line in lines)
+    else:
+        rows = ([field.strip() for field in row] for row in csv.reader(lines, delimiter=delimiter))
+    first = next(rows)
+    if len(first) > 3 and not _is_number(first[3]):
+        first = None
+    return itertools.chain([first] if first is not None else [], rows)
+
+def read_chunks(lines, chunk_rows=CHUNK_ROWS, delimiter=None):
+    """Reads a QSO absorber table in chunks of up to chunk_rows rows.
+
+    Arguments:
+    :param lines: lines of the table (e.g. an open file).
+    :type lines: iterable of str
+    :param chunk_rows: number of rows per chunk.
+    :type chunk_rows: int
+    :param delimiter: field delimiter, or None to detect "," or whitespace.
+    :returns: for each chunk a dict of columns: name, ra, dec (in radians), z, da_a, stat, sys and
+        r (NaN where no radial distance is given).
+    :rtype: generator of dict
+    """
+    rows = _rows(lines, delimiter)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        widths = set(len(row) for row in chunk)
+        if not widths <= set([7, 8]):
+            bad = [row for row in chunk if len(row) not in (7, 8)][0]
+            raise CatalogError("expected 7 or 8 columns (name RA DEC z da/a stat sys [r]), got: %r" % (bad,))
+        if len(widths) > 1:
+            chunk = [row if len(row) == 8 else row + ["nan"] for row in chunk]
+        columns = zip(*chunk)
+        # absorbers of the same QSO share a position: parse each distinct one once
+        ra, dec, inverse = dipole_error._group_sightlines(np.array(columns[1]), np.array(columns[2]))
+        alpha, delta = dipole_error.parse_positions(ra, dec)
+        if inverse is not None:
+            alpha, delta = alpha[inverse], delta[inverse]
+        try:
+            numbers = np.array(columns[3:], dtype=np.float64)
+        except ValueError:
+            raise CatalogError("non-numeric z, da/a, stat, sys or r in rows %r..." % (chunk[0],))
+        if len(numbers) == 4:
+            numbers = np.vstack([numbers, np.full(len(chunk), np.nan)])
+        yield dict(name=columns[0], ra=alpha, dec=delta, z=numbers[0], da_a=numbers[1], \
+                   stat=numbers[2], sys=numbers[3], r=numbers[4])
+
+# ==============
+# = Predicting =
+# ==============
+
+def predict(chunk, compare="dipole", distance=None, covariances=None):
+    """Predictions of the three models for one chunk from read_chunks.
+
+    :param compare: model ("dipole", "z_dipole" or "r_dipole") the measurement is compared with.
+    :param distance: kind of dipole_distance distance ("light_travel" or "comoving") that missing r
+        are computed from z with; None leaves them NaN.
+    :param covariances: full parameter covariance matrices by model name (see
+        :func:`dipole_error.published_models`).
+    :returns: dict with the columns of OUTPUT_COLUMNS.
+    :rtype: dict
+    """
+    result = dict((key, chunk[key]) for key in ("name", "z", "da_a", "stat", "sys"))
+    radial_distance = chunk["r"]
+    missing = np.isnan(radial_distance)
+    if distance is not None and missing.any():
+        radial_distance = radial_distance.copy()
+        radial_distance[missing] = dipole_distance.radial_distance(chunk["z"][missing], kind=distance)
+    predictions = dipole_error.evaluate_models(chunk["ra"], chunk["dec"], z_redshift=chunk["z"], \
+                                               radial_distance=radial_distance, covariances=covariances)
+    for name in predictions.dtype.names:
+        result[name] = predictions[name]
+    result["sigma_min"], result["sigma_max"], _ = dipole_error.statistical_difference_systematic_array( \
+        result[compare], result[compare + "_err"], chunk["da_a"], chunk["stat"], chunk["sys"])
+    return result
+
+# ===========
+# = Writing =
+# ===========
+
+_NEEDS_QUOTES = re.compile(r'[,"\r\n]')
+
+def _csv_field(text):
+    """A text field quoted as csv.writer quotes it (only when it holds a comma, quote or newline)."""
+    text = str(text)
+    if _NEEDS_QUOTES.search(text):
+        return '"%s"' % text.replace('"', '""')
+    return text
+
+def format_rows(result, precision=6):
+    """Formats a predict() result as CSV lines."""
+    number = "%%.%dg" % precision
+    line = ",".join(["%s"] + [number] * (len(OUTPUT_COLUMNS) - 1)) + "\n"
+    # Python floats format much faster than NumPy scalars.
+    numbers = np.column_stack([result[key] for key in OUTPUT_COLUMNS[1:]]).tolist()
+    return [line % ((_csv_field(name),) + tuple(row)) for name, row in itertools.izip(result["name"], numbers)]
+
+def process(lines, output, compare="dipole", chunk_rows=CHUNK_ROWS, delimiter=None, precision=6, distance=None, \
+            covariances=None):
+    """Reads a table from lines, writes the predictions to output chunk by chunk.
+
+    :returns: number of rows processed.
+    :rtype: int
+    """
+    if compare not in COMPARE_MODELS:
+        raise CatalogError("compare must be one of %s" % ", ".join(COMPARE_MODELS))
+    output.write(",".join(OUTPUT_COLUMNS) + "\n")
+    n_rows = 0
+    for chunk in read_chunks(lines, chunk_rows, delimiter):
+        output.writelines(format_rows(predict(chunk, compare, distance, covariances), precision))
+        n_rows += len(chunk["name"])
+    return n_rows
+
+def read_covariances(options):
+    """Covariance matrices from MODEL=FILE options.
+
+    :rtype: dict of name: numpy.ndarray
+    """
+    covariances = {}
+    for option in options or []:
+        name, separator, filename = option.partition("=")
+        if not separator or name not in COMPARE_MODELS:
+            raise CatalogError("--covariance takes MODEL=FILE with MODEL one of %s" % ", ".join(COMPARE_MODELS))
+        try:
+            covariances[name] = np.atleast_2d(np.loadtxt(filename, ndmin=2))
+        except (IOError, ValueError), error:
+            raise CatalogError("cannot read covariance of %s from %s: %s" % (name, filename, error))
+    return covariances
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict da/a for a QSO absorber table with the " \
+                                     "King et al. (2012) dipole models.")
+    parser.add_argument("input", nargs="?", default="-", help="input table (default: stdin)")
+    parser.add_argument("output", nargs="?", default="-", help="output CSV file (default: stdout)")
+    parser.add_argument("--compare", choices=COMPARE_MODELS, default="dipole", \
+                        help="model the measurements are compared with (default: dipole)")
+    parser.add_argument("--delimiter", default=None, \
+                        help="input field delimiter (default: ',' if present, else whitespace)")
+    parser.add_argument("--distance", choices=dipole_distance.DISTANCE_KINDS, default=None, \
+                        help="compute missing r from z with this distance (default: leave them out)")
+    parser.add_argument("--covariance", action="append", metavar="MODEL=FILE", \
+                        help="full parameter covariance matrix of a model (repeatable)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per chunk")
+    parser.add_argument("--precision", type=int, default=6, help="significant digits in the output")
+    args = parser.parse_args(argv)
+    try:
+        covariances = read_covariances(args.covariance)
+    except CatalogError, error:
+        print >> sys.stderr, "dipole_catalog:", error
+        return 1
+    source = sys.stdin if args.input == "-" else open(args.input, "rb")
+    target = sys.stdout if args.output == "-" else open(args.output, "wb", 2 ** 20)
+    try:
+        process(source, target, args.compare, args.chunk_rows, args.delimiter, args.precision, args.distance, \
+                covariances)
+    except (dipole_error.DipoleError, dipole_error.NegativeError), error:
+        print >> sys.stderr, "dipole_catalog:", error
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Radial distances of absorbers from their redshifts, for the r-dependent dipole (eq. 19).
+
+King et al. (2012) give r as the light-travel distance in GLyr for a flat cosmology with
+H0 = 71 km/s/Mpc, Omega_m = 0.27 and Omega_Lambda = 0.73 (DEFAULT_COSMOLOGY); with it z = 1.6919
+gives r = 9.757 GLyr. For a cosmology (H0, Omega_m, Omega_Lambda) with E(z) = H(z) / H0,
+
+    light-travel distance  D_T(z) = c / H0 int_0^z dz' / ((1 + z') E(z'))
+    comoving distance      D_C(z) = c / H0 int_0^z dz' / E(z')
+
+(the comoving distance along the line of sight; radiation is neglected).
+
+The integral is computed once per cosmology on a fine grid uniform in ln(1 + z), with Simpson's
+rule on every interval, and saved as a .npy file in DISTANCE_CACHE (or $DIPOLE_ERROR_CACHE), so
+later sessions only load it. Distances are then a cubic Hermite interpolation on the grid (using
+the integrand as the slope at the nodes), and dD/dz is the integrand itself; both take arrays of
+any size in one vectorized call.
+
+Examples:
+
+>>> distances = dipole_distance.radial_distance(z_redshift)                   # GLyr, light travel
+>>> slopes = dipole_distance.radial_distance_derivative(z_redshift)           # GLyr per unit z
+>>> dipole_distance.r_dipole_monopole_redshift_array(right_ascension, declination, z_redshift)
+>>> table = dipole_distance.distance_table(dipole_distance.Cosmology(70.0, 0.3, 0.7), kind="comoving")
+"""
+import collections
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import dipole_error
+
+# Speed of light in km/s, and GLyr per Mpc.
+SPEED_OF_LIGHT = 299792.458
+GLYR_PER_MPC = 3.26156e-3
+# Largest redshift of the tables, and their number of intervals.
+Z_MAX = 20.0
+GRID_INTERVALS = 2 ** 14
+DISTANCE_KINDS = ("light_travel", "comoving")
+# Directory of the saved tables (empty: no files are written).
+DISTANCE_CACHE = os.environ.get("DIPOLE_ERROR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "dipole_error"))
+
+class Cosmology(collections.namedtuple("Cosmology", "hubble_constant omega_matter omega_lambda")):
+    """Hubble constant (km/s/Mpc) and density parameters; Omega_k = 1 - Omega_m - Omega_Lambda."""
+
+    def hubble_distance(self):
+        """c / H0 in GLyr."""
+        return SPEED_OF_LIGHT / self.hubble_constant * GLYR_PER_MPC
+
+    def efunc(self, z_redshift):
+        """E(z) = H(z) / H0."""
+        one_plus_z = 1.0 + np.asarray(z_redshift, dtype=np.float64)
+        omega_curvature = 1.0 - self.omega_matter - self.omega_lambda
+        return np.sqrt(self.omega_matter * one_plus_z ** 3 + omega_curvature * one_plus_z ** 2 + self.omega_lambda)
+
+DEFAULT_COSMOLOGY = Cosmology(71.0, 0.27, 0.73)
+
+def _integrand(cosmology, kind, z_redshift):
+    """dD/dz in GLyr."""
+    if kind not in DISTANCE_KINDS:
+        raise dipole_error.DipoleError("kind must be one of %s" % ", ".join(DISTANCE_KINDS))
+    slope = cosmology.hubble_distance() / cosmology.efunc(z_redshift)
+    if kind == "light_travel":
+        slope /= 1.0 + np.asarray(z_redshift, dtype=np.float64)
+    return slope
+
+class DistanceTable(object):
+    """Distances on a grid uniform in ln(1 + z), interpolated to any redshifts up to z_max.
+
+    Arguments:
+    :param cosmology: the cosmology.
+    :type cosmology: Cosmology
+    :param kind: "light_travel" or "comoving".
+    :param z_max: largest redshift of the table.
+    :param intervals: number of grid intervals.
+    :param distances: the tabulated distances (computed if None).
+    """
+
+    def __init__(self, cosmology=DEFAULT_COSMOLOGY, kind="light_travel", z_max=Z_MAX, intervals=GRID_INTERVALS, \
+                 distances=None):
+        self.cosmology = Cosmology(*cosmology)
+        self.kind = kind
+        self.z_max = float(z_max)
+        self.step = np.log1p(self.z_max) / intervals
+        nodes = np.expm1(self.step * np.arange(intervals + 1))
+        # dD/du = (1 + z) dD/dz with u = ln(1 + z)
+        self.slopes = (1.0 + nodes) * _integrand(self.cosmology, kind, nodes)
+        if distances is None:
+            middles = np.expm1(self.step * (np.arange(intervals) + 0.5))
+            middle_slopes = (1.0 + middles) * _integrand(self.cosmology, kind, middles)
+            pieces = self.step / 6.0 * (self.slopes[:-1] + 4.0 * middle_slopes + self.slopes[1:])
+            distances = np.concatenate(([0.0], np.cumsum(pieces)))
+        self.distances = np.asarray(distances, dtype=np.float64)
+
+    def _check(self, z_redshift):
+        z_redshift = np.asarray(z_redshift, dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            negative, beyond = np.any(z_redshift < 0), np.any(z_redshift > self.z_max)
+        if negative:
+            raise dipole_error.NegativeError("redshifts must not be negative")
+        if beyond:
+            raise dipole_error.DipoleError("redshifts above %g need a table with a larger z_max" % self.z_max)
+        return z_redshift
+
+    def __call__(self, z_redshift):
+        """Distances in GLyr of redshifts (NaN stays NaN)."""
+        z_redshift = self._check(z_redshift)
+        position = np.log1p(z_redshift) / self.step
+        index = np.clip(np.nan_to_num(np.floor(position)).astype(np.intp), 0, len(self.distances) - 2)
+        t = position - index
+        t2 = t * t
+        t3 = t2 * t
+        # cubic Hermite basis on [index, index + 1]
+        return (2 * t3 - 3 * t2 + 1) * self.distances[index] + (t3 - 2 * t2 + t) * self.step * self.slopes[index] + \
+               (3 * t2 - 2 * t3) * self.distances[index + 1] + (t3 - t2) * self.step * self.slopes[index + 1]
+
+    def derivative(self, z_redshift):
+        """dD/dz in GLyr of redshifts."""
+        return _integrand(self.cosmology, self.kind, self._check(z_redshift))
+
+# =================
+# = Table caching =
+# =================
+
+_TABLES = {}
+
+def _cache_file(cosmology, kind, z_max, directory):
+    key = repr((tuple(float(x) for x in cosmology), kind, float(z_max), GRID_INTERVALS))
+    return os.path.join(directory, "distance_%s.npy" % hashlib.sha1(key).hexdigest()[:16])
+
+def _save(table, filename):
+    """Writes the table through a temporary file, so other processes never read a partial one."""
+    directory = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as output:
+            np.save(output, table.distances)
+        os.rename(temporary, filename)
+    except (IOError, OSError):
+        # a read-only cache directory only costs recomputing the table
+        pass
+
+def distance_table(cosmology=DEFAULT_COSMOLOGY, kind="light_travel", z_max=Z_MAX, directory=None):
+    """The distance table of a cosmology, built once per process and saved to disk.
+
+    Arguments:
+    :param cosmology: the cosmology.
+    :type cosmology: Cosmology or (H0, Omega_m, Omega_Lambda)
+    :param kind: "light_travel" or "comoving".
+    :param z_max: largest redshift of the table.
+    :param directory: directory of the saved tables (default: DISTANCE_CACHE; "" for no files).
+    :rtype: DistanceTable
+    """
+    if kind not in DISTANCE_KINDS:
+        raise dipole_error.DipoleError("kind must be one of %s" % ", ".join(DISTANCE_KINDS))
+    cosmology = Cosmology(*cosmology)
+    key = (tuple(cosmology), kind, float(z_max))
+    if key in _TABLES:
+        return _TABLES[key]
+    directory = DISTANCE_CACHE if directory is None else directory
+    table = None
+    if directory:
+        filename = _cache_file(cosmology, kind, z_max, directory)
+        if os.path.exists(filename):
+            distances = np.load(filename)
+            if distances.shape == (GRID_INTERVALS + 1,):
+                table = DistanceTable(cosmology, kind, z_max, distances=distances)
+    if table is None:
+        table = DistanceTable(cosmology, kind, z_max)
+        if directory:
+            _save(table, filename)
+    _TABLES[key] = table
+    return table
+
+def radial_distance(z_redshift, cosmology=DEFAULT_COSMOLOGY, kind="light_travel"):
+    """Distances in GLyr of redshifts (see distance_table)."""
+    return distance_table(cosmology, kind)(z_redshift)
+
+def radial_distance_derivative(z_redshift, cosmology=DEFAULT_COSMOLOGY, kind="light_travel"):
+    """dD/dz in GLyr of redshifts, e.g. to propagate redshift errors."""
+    return distance_table(cosmology, kind).derivative(z_redshift)
+
+def r_dipole_monopole_redshift_array(right_ascension, \
+                                     declination, \
+                                     z_redshift, \
+                                     dipole_ra=dipole_error.R_DIPOLE_RA, \
+                                     dipole_dec=dipole_error.R_DIPOLE_DEC, \
+                                     amplitude=dipole_error.R_DIPOLE_AMPLITUDE, \
+                                     monopole=dipole_error.R_DIPOLE_MONOPOLE, \
+                                     cosmology=DEFAULT_COSMOLOGY, \
+                                     kind="light_travel", \
+                                     subset=None, \
+                                     covariance=None):
+    """:func:`dipole_error.r_dipole_monopole_array` with the radial distances computed from redshifts.
+
+    :param z_redshift: redshifts of the absorbers.
+    :param cosmology: the cosmology of the distances.
+    :param kind: "light_travel" (as King et al. 2012) or "comoving".
+    :param covariance: full covariance matrix of the parameters (see :class:`dipole_error.RDipoleModel`).
+    :returns: predicted values and their 1-sigma errors.
+    :rtype: tuple of numpy.ndarray
+    """
+    right_ascension, declination, z_redshift = dipole_error._subset(subset, right_ascension, declination, z_redshift)
+    return dipole_error.r_dipole_monopole_array(right_ascension, declination, dipole_ra, dipole_dec, amplitude, \
+                                                radial_distance(z_redshift, cosmology, kind), monopole, \
+                                                covariance=covariance)
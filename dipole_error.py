@@ -15,7 +15,9 @@ Error: +(22)/-(20)
 We take the average, and so +/- 21. It should be noted that when it's "close" to symmetric, this average approach 
 should be fairly "close" to the right answer. In all of the cases included, the error have been "close" to symmetric.
 
-If that is not acceptable, be warned that 
+If that is not acceptable, the upper and lower errors can be given separately (see DIPOLE_ASYMMETRIC_ERRORS and 
+Z_DIPOLE_ASYMMETRIC_ERRORS). Those parameters are then drawn from split normal distributions by monte_carlo(), 
+which returns asymmetric intervals per sightline.
 
 
 References 
@@ -27,14 +29,10 @@ Monthly Notices of the Royal Astronomical Society, 422, 3370-3414. (2012)
 
 Dependencies
 ================
-Requires the use of two very handy python packages: angles and uncertainties.
+Requires the use of two very handy python packages: angles and uncertainties. Only the wrap_* 
+helpers use angles, and it is imported when one of them is first called, so that importing this 
+module stays cheap (see test/test1.py, ImportTest).
 """
-try:
-    import angles
-except:
-    print """python package ''angles'' is required. Try running: 
-    $ sudo pip install -U angles"""
-    raise ImportError
 try:
     import uncertainties
 except:
@@ -43,6 +41,8 @@ except:
     raise ImportError
 from uncertainties import umath
 import numpy as np
+import collections
+import re
 
 # Define exceptions
 class DipoleError(Exception): 
@@ -61,9 +61,150 @@ RADIAL_DISTANCE = 1.3 # GLyr
 # =====================================================================
 # = Wrap angles package functions with uncertainties package wrappers =
 # =====================================================================
-wrap_radian_RA = uncertainties.wrap(angles.h2r)
-wrap_radian_DEC = uncertainties.wrap(angles.d2r)
-wrap_sep = uncertainties.wrap(angles.sep)
+# The partial derivatives are given in closed form, so uncertainties.wrap never falls back on
+# its numerical (finite difference) derivatives.
+
+def sep_jacobian(a1, b1, a2, b2):
+    """Returns the partial derivatives of angles.sep(a1, b1, a2, b2) with respect to each argument.
+
+    Works on numbers or NumPy arrays (all in radians). Where the separation is exactly 0 or pi the
+    derivative is undefined and 0.0 is returned.
+
+    Arguments:
+    :param a1: longitude-like angle of the first point.
+    :param b1: latitude-like angle of the first point.
+    :param a2: longitude-like angle of the second point.
+    :param b2: latitude-like angle of the second point.
+    :returns: d(sep)/d(a1), d(sep)/d(b1), d(sep)/d(a2), d(sep)/d(b2)
+    :rtype: tuple
+    """
+    sin_b1, cos_b1 = np.sin(b1), np.cos(b1)
+    sin_b2, cos_b2 = np.sin(b2), np.cos(b2)
+    sin_da, cos_da = np.sin(a1 - a2), np.cos(a1 - a2)
+    d_cos_d_a1 = -cos_b1 * cos_b2 * sin_da
+    d_cos_d_b1 = cos_b1 * sin_b2 - sin_b1 * cos_b2 * cos_da
+    d_cos_d_b2 = sin_b1 * cos_b2 - cos_b1 * sin_b2 * cos_da
+    # sin(theta) is the length of the cross product of the two unit vectors.
+    sin_theta = np.sqrt((cos_b2 * sin_da) ** 2 + (cos_b1 * sin_b2 - sin_b1 * cos_b2 * cos_da) ** 2)
+    scale = -1.0 / np.where(sin_theta > 0, sin_theta, np.inf)
+    return scale * d_cos_d_a1, scale * d_cos_d_b1, -scale * d_cos_d_a1, scale * d_cos_d_b2
+
+def _partial(jacobian, index):
+    """Derivative function (for uncertainties.wrap) picking one entry of a jacobian."""
+    def derivative(*args):
+        return jacobian(*args)[index]
+    return derivative
+
+def _angles():
+    """The angles package, imported on first use."""
+    try:
+        import angles
+    except ImportError:
+        print """python package ''angles'' is required. Try running: 
+    $ sudo pip install -U angles"""
+        raise ImportError
+    return angles
+
+class _LazyWrap(object):
+    """uncertainties.wrap(function, derivatives), built on the first call from build(), which 
+    returns (function, derivatives)."""
+
+    def __init__(self, build):
+        self._build = build
+        self._wrapped = None
+
+    def __call__(self, *args, **kwargs):
+        if self._wrapped is None:
+            self._wrapped = uncertainties.wrap(*self._build())
+        return self._wrapped(*args, **kwargs)
+
+wrap_radian_RA = _LazyWrap(lambda: (_angles().h2r, [lambda hours: np.pi / 12.0]))
+wrap_radian_DEC = _LazyWrap(lambda: (_angles().d2r, [lambda degrees: np.pi / 180.0]))
+wrap_sep = _LazyWrap(lambda: (_angles().sep, [_partial(sep_jacobian, i) for i in range(4)]))
+
+# =====================
+# = Parsing positions =
+# =====================
+# Positions come as sexagesimal strings, RA in hours ("22h20m06.757", "22 20 06.757" or
+# "22:20:06.757") and DEC in degrees ("-28d03m23.34" or "-28 03 23.34"), or as numbers that are
+# already in radians. Whole columns are parsed in one pass, and single positions go through a
+# small LRU cache since many absorbers share the same QSO sightline.
+
+_SEXAGESIMAL_SEPARATORS = re.compile(r"[hHdDmMsS:'\"]")
+POSITION_CACHE_SIZE = 4096
+
+_THREE_FIELDS = re.compile(r"^[ \t]*[-+]?[\d.]+[ \t]+[\d.]+[ \t]+[\d.]+[ \t]*$", re.M)
+
+def _sexagesimal(values):
+    """Converts a sequence of sexagesimal strings to decimal hours/degrees (float64 array)."""
+    values = [str(value) for value in values]
+    text = _SEXAGESIMAL_SEPARATORS.sub(" ", "\n".join(values))
+    fields = np.fromstring(text, sep=" ") if text.strip() else np.zeros(0)
+    if fields.size != 3 * len(values) or len(_THREE_FIELDS.findall(text)) != len(values):
+        # Not every row is "d m s": parse row by row, allowing "d m" or "d".
+        rows = [line.split() for line in text.split("\n")]
+        for value, row in zip(values, rows):
+            if len(rows) != len(values) or not 0 < len(row) <= 3:
+                raise DipoleError("cannot parse sexagesimal position: %r" % value)
+        try:
+            fields = np.array([row + ["0"] * (3 - len(row)) for row in rows], dtype=np.float64)
+        except ValueError:
+            raise DipoleError("cannot parse sexagesimal positions: %r" % values[:10])
+    fields = fields.reshape(len(values), 3)
+    magnitude = np.abs(fields[:, 0]) + fields[:, 1] / 60.0 + fields[:, 2] / 3600.0
+    # signbit also catches "-00 30 00"
+    return np.where(np.signbit(fields[:, 0]), -magnitude, magnitude)
+
+def _is_text(values):
+    """True for a string, or an array/sequence of strings."""
+    if isinstance(values, basestring):
+        return True
+    values = np.asarray(values)
+    return values.dtype.kind in "SU" or (values.dtype.kind == "O" and values.size > 0 \
+                                          and isinstance(values.flat[0], basestring))
+
+def parse_positions(right_ascension, declination):
+    """Converts columns of RA (hours) and DEC (degrees) sexagesimal strings to radians.
+    
+    Arguments:
+    :param right_ascension: RA strings, e.g. "22h20m06.757" or "22 20 06.757".
+    :type right_ascension: sequence of str
+    :param declination: DEC strings, e.g. "-28d03m23.34" or "-28 03 23.34".
+    :type declination: sequence of str
+    :returns: RA and DEC in radians.
+    :rtype: tuple of numpy.ndarray
+    """
+    right_ascension = np.asarray(right_ascension)
+    declination = np.asarray(declination)
+    alpha = _sexagesimal(right_ascension.ravel()) * (np.pi / 12.0)
+    delta = _sexagesimal(declination.ravel()) * (np.pi / 180.0)
+    return alpha.reshape(right_ascension.shape), delta.reshape(declination.shape)
+
+_POSITION_CACHE = collections.OrderedDict()
+
+def position_radians(right_ascension, declination):
+    """Returns (RA, DEC) in radians for one position, given as strings or as numbers in radians.
+    
+    Parsed strings are kept in an LRU cache of POSITION_CACHE_SIZE entries.
+    """
+    if not isinstance(right_ascension, basestring) and not isinstance(declination, basestring):
+        return float(right_ascension), float(declination)
+    key = (right_ascension, declination)
+    try:
+        position = _POSITION_CACHE.pop(key)
+    except KeyError:
+        alpha, delta = parse_positions([right_ascension], [declination])
+        position = (float(alpha[0]), float(delta[0]))
+        if len(_POSITION_CACHE) >= POSITION_CACHE_SIZE:
+            _POSITION_CACHE.popitem(last=False)
+    _POSITION_CACHE[key] = position
+    return position
+
+def _radians(right_ascension, declination):
+    """Positions for the array functions: strings are parsed, numbers are taken to be radians."""
+    if _is_text(right_ascension) or _is_text(declination):
+        return parse_positions(right_ascension, declination)
+    return right_ascension, declination
 
 # ============================
 # = dipole and monopole term =
@@ -75,9 +216,14 @@ DIP_DEC = -61.0
 DIP_DEC_ERR = 10.0
 DIP_AMPLITUDE = 0.97e-5
 DIP_AMPLITUDE_ERR = 0.21e-5 # average of asymmetric errors
+DIP_AMPLITUDE_ERR_UPPER = 0.22e-5
+DIP_AMPLITUDE_ERR_LOWER = 0.20e-5
 DIP_MONOPOLE = -0.178e-5
 DIP_MONOPOLE_ERR  = 0.084e-5
 
+# (lower, upper) errors for split normal sampling
+DIPOLE_ASYMMETRIC_ERRORS = {'amplitude': (DIP_AMPLITUDE_ERR_LOWER, DIP_AMPLITUDE_ERR_UPPER)}
+
 # Values and errors combined for uncertainties package.
 DIPOLE_AMPLITUDE = uncertainties.ufloat(DIP_AMPLITUDE, DIP_AMPLITUDE_ERR)
 MONOPOLE = uncertainties.ufloat(DIP_MONOPOLE, DIP_MONOPOLE_ERR)
@@ -103,22 +249,38 @@ def basic_dipole_monopole(amplitude=DIP_AMPLITUDE, \
     """
     return amplitude * umath.cos(theta) + monopole
 
-wrap_dipole_monopole = uncertainties.wrap(basic_dipole_monopole)
+def dipole_monopole_jacobian(amplitude=DIP_AMPLITUDE, \
+                             theta=THETA, \
+                             monopole=DIP_MONOPOLE, \
+                             *args, \
+                             **kwargs):
+    """Returns the partial derivatives of :func:`basic_dipole_monopole` (numbers or NumPy arrays).
+    
+    :returns: derivatives with respect to amplitude, theta and monopole.
+    :rtype: tuple
+    """
+    return np.cos(theta), -amplitude * np.sin(theta), np.ones_like(theta)
+
+wrap_dipole_monopole = _LazyWrap(lambda: (basic_dipole_monopole, \
+                                           [_partial(dipole_monopole_jacobian, i) for i in range(3)]))
 
 def dipole_monopole(right_ascension=QSO_RA, \
                     declination=QSO_DEC, \
                     dipole_ra=DIPOLE_RA, \
                     dipole_dec=DIPOLE_DEC, \
                     amplitude=DIPOLE_AMPLITUDE, \
-                    monopole=MONOPOLE):
+                    monopole=MONOPOLE, \
+                    covariance=None):
     """Takes a position on the sky (in RA and DEC), and returns the predicted value of the dipole.
     This equation propogates the relevant errors through the dipole equation, returns value and error estimate.
     
     Arguments:
-    :param right_ascension:right ascension of point in sky under consideration. Has to be in the format: "11h03m25.29"
-    :type right_ascension: number
-    :param declination: declination of point in sky under consideration. Has to be in the format: "-26d45m15.8""
-    :type declination: number
+    :param right_ascension:right ascension of point in sky under consideration. Either a string in the format: 
+        "11h03m25.29" (or "11 03 25.29"), or a number in radians.
+    :type right_ascension: string or number
+    :param declination: declination of point in sky under consideration. Either a string in the format: 
+        "-26d45m15.8" (or "-26 45 15.8"), or a number in radians.
+    :type declination: string or number
     :param dipole_ra: RA of dipole (optional with uncertainty via uncertainties.ufloat((value, error)) ).
     :type dipole_ra: uncertainties.AffineScalarFunc
     :param dipole_dec: DEC of dipole (optional with uncertainty via uncertainties.ufloat((value, error)) ).
@@ -127,6 +289,9 @@ def dipole_monopole(right_ascension=QSO_RA, \
     :type amplitude: uncertainties.AffineScalarFunc
     :param monopole: Monopole term (optional with uncertainty via uncertainties.ufloat((value, error)) ).
     :type monopole: uncertainties.AffineScalarFunc
+    :param covariance: full covariance matrix of the parameters (see :class:`DipoleModel`); it
+        replaces their errors, with the correlations it gives.
+    :type covariance: numpy.ndarray
     :returns: value of predicted dipole (and error) at right_ascension and declination away from dipole 
         that is located at dipole_ra, dipole_dec.
     :rtype: number
@@ -178,15 +343,9 @@ def dipole_monopole(right_ascension=QSO_RA, \
     >>> # Output: 3.2473977827498827e-06+/-1.7321859627814845e-06
     
     """
-# MTM 2015-02-09: Modified input for angles version 2
-#    pos1 = angles.AngularPosition(alpha=right_ascension, delta=declination)
-    pos1 = angles.AngularPosition.from_hd(hd=right_ascension+" "+declination)
-    return wrap_dipole_monopole(amplitude, \
-                                wrap_sep(wrap_radian_RA(dipole_ra), \
-                                         wrap_radian_DEC(dipole_dec), \
-                                         pos1.alpha.r, \
-                                         pos1.delta.r), \
-                                monopole)
+    alpha, delta = position_radians(right_ascension, declination)
+    model = _model_for(DipoleModel, (dipole_ra, dipole_dec, amplitude, monopole), covariance)
+    return model.ufloat(alpha, delta)
 
 # ======================
 # = z-dependent dipole =
@@ -199,17 +358,37 @@ Z_DIP_DEC = -62.0
 Z_DIP_DEC_ERR = 10.0
 Z_DIP_PREFACTOR = 0.81e-5
 Z_DIP_PREFACTOR_ERR = 0.27e-5 # average of .26 and .28
+Z_DIP_PREFACTOR_ERR_UPPER = 0.28e-5
+Z_DIP_PREFACTOR_ERR_LOWER = 0.26e-5
 Z_DIP_MONOPOLE = -0.184e-5
 Z_DIP_MONOPOLE_ERR = 0.085e-5
 Z_DIP_BETA = 0.46
 Z_DIP_BETA_ERR = 0.49
 
+# (lower, upper) errors for split normal sampling
+Z_DIPOLE_ASYMMETRIC_ERRORS = {'prefactor': (Z_DIP_PREFACTOR_ERR_LOWER, Z_DIP_PREFACTOR_ERR_UPPER)}
+
 Z_DIPOLE_RA = uncertainties.ufloat(Z_DIP_RA, Z_DIP_RA_ERR)
 Z_DIPOLE_DEC = uncertainties.ufloat(Z_DIP_DEC, Z_DIP_DEC_ERR)
 Z_DIPOLE_PREFACTOR = uncertainties.ufloat(Z_DIP_PREFACTOR, Z_DIP_PREFACTOR_ERR)
 Z_DIPOLE_MONOPOLE = uncertainties.ufloat(Z_DIP_MONOPOLE, Z_DIP_MONOPOLE_ERR)
 Z_DIPOLE_BETA = uncertainties.ufloat(Z_DIP_BETA, Z_DIP_BETA_ERR)
 
+def _positive_redshift(z_redshift):
+    """Redshifts for the z-dipole, whose z ** beta and log(z) need z > 0.
+    
+    A single redshift that is not positive raises ValueError; in arrays such redshifts become NaN,
+    so that their predictions and errors are NaN (without NumPy warnings).
+    """
+    if np.ndim(z_redshift) == 0:
+        if not uncertainties.nominal_value(z_redshift) > 0:
+            raise ValueError("z_redshift must be positive, not %s" % (z_redshift,))
+        return z_redshift
+    z_redshift = np.asarray(z_redshift, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        positive = z_redshift > 0
+    return z_redshift if positive.all() else np.where(positive, z_redshift, np.nan)
+
 def basic_z_dipole_monopole(prefactor=Z_DIP_PREFACTOR, \
                             z_redshift=REDSHIFT, \
                             beta=Z_DIP_BETA, \
@@ -223,8 +402,8 @@ def basic_z_dipole_monopole(prefactor=Z_DIP_PREFACTOR, \
     :type prefactor: number
     :param z_redshift: Redshift of absorber in sky.
     :type z_redshift: number
-    :param beta: power law exponent.
-    :type beta: number
+    :param beta: power law exponent (optional with uncertainty via uncertainties.ufloat((value, error)) ).
+    :type beta: uncertainties.AffineScalarFunc
     :param theta: angle in radians between the dipole and a positions on the sky.
     :type theta: number
     :param monopole: monopole term.
@@ -232,25 +411,54 @@ def basic_z_dipole_monopole(prefactor=Z_DIP_PREFACTOR, \
     :returns: value of predicted dipole at a theta radians away from dipole.
     :rtype: number
     """
+    z_redshift = _positive_redshift(z_redshift)
     return prefactor * z_redshift ** beta * umath.cos(theta) + monopole
 
-wrap_z_dipole_monopole = uncertainties.wrap(basic_z_dipole_monopole)
+def z_dipole_monopole_jacobian(prefactor=Z_DIP_PREFACTOR, \
+                               z_redshift=REDSHIFT, \
+                               beta=Z_DIP_BETA, \
+                               theta=THETA, \
+                               monopole=Z_DIP_MONOPOLE,\
+                               *args,\
+                               **kwargs):
+    """Returns the partial derivatives of :func:`basic_z_dipole_monopole` (numbers or NumPy arrays).
+    
+    :returns: derivatives with respect to prefactor, z_redshift, beta, theta and monopole.
+    :rtype: tuple
+    """
+    z_redshift = _positive_redshift(z_redshift)
+    z_power = np.power(z_redshift, beta)
+    cos_theta = np.cos(theta)
+    return (z_power * cos_theta, \
+            prefactor * beta * np.power(z_redshift, beta - 1.0) * cos_theta, \
+            prefactor * z_power * np.log(z_redshift) * cos_theta, \
+            -prefactor * z_power * np.sin(theta), \
+            np.ones_like(cos_theta))
+
+wrap_z_dipole_monopole = _LazyWrap(lambda: (basic_z_dipole_monopole, \
+                                             [_partial(z_dipole_monopole_jacobian, i) for i in range(5)]))
 
 def z_dipole_monopole(right_ascension=QSO_RA, \
                       declination=QSO_DEC, \
                       dipole_ra=Z_DIPOLE_RA, \
                       dipole_dec=Z_DIPOLE_DEC, \
-                      prefactor=Z_DIP_PREFACTOR, \
+                      prefactor=Z_DIPOLE_PREFACTOR, \
                       z_redshift=REDSHIFT, \
-                      beta=Z_DIP_BETA, \
-                      monopole=Z_DIP_MONOPOLE):
+                      beta=Z_DIPOLE_BETA, \
+                      monopole=Z_DIPOLE_MONOPOLE, \
+                      covariance=None):
     """Returns the predicted value of alpha from the z_dipole equation.
     
+    By default the published errors of every parameter (dipole RA and DEC, prefactor, beta and
+    monopole) are propagated, as by :class:`ZDipoleModel`. Plain numbers hold parameters fixed:
+    Z_DIP_PREFACTOR, Z_DIP_BETA and Z_DIP_MONOPOLE give the earlier defaults, which propagated only
+    the errors of the dipole RA and DEC.
+    
     Arguments:
-    :param right_ascension:right ascension of point in sky under consideration. 
-    :type right_ascension: number
-    :param declination: declination of point in sky under consideration.
-    :type declination: number
+    :param right_ascension:right ascension of point in sky under consideration (string, or number in radians).
+    :type right_ascension: string or number
+    :param declination: declination of point in sky under consideration (string, or number in radians).
+    :type declination: string or number
     :param dipole_ra: RA of dipole (optional with uncertainty via uncertainties.ufloat((value, error)) ).
     :type dipole_ra: uncertainties.AffineScalarFunc
     :param dipole_dec: DEC of dipole (optional with uncertainty via uncertainties.ufloat((value, error)) ).
@@ -259,25 +467,20 @@ def z_dipole_monopole(right_ascension=QSO_RA, \
     :type prefactor: uncertainties.AffineScalarFunc
     :param z_redshift: Redshift of absorber in sky.
     :type z_redshift: number
-    :param beta: power law exponent.
-    :type beta: number
+    :param beta: power law exponent (optional with uncertainty via uncertainties.ufloat((value, error)) ).
+    :type beta: uncertainties.AffineScalarFunc
     :param monopole: Monopole term (optional with uncertainty via uncertainties.ufloat((value, error)) ).
     :type monopole: uncertainties.AffineScalarFunc
+    :param covariance: full covariance matrix of the parameters (see :class:`ZDipoleModel`); it
+        replaces their errors, with the correlations it gives.
+    :type covariance: numpy.ndarray
     :returns: value of predicted dipole (and error) at right_ascension and declination away from dipole 
         that is located at dipole_ra, dipole_dec.
     :rtype: number
     """
-# MTM 2015-02-09: Modified input for angles version 2
-#    pos1 = angles.AngularPosition(alpha=right_ascension, delta=declination)
-    pos1 = angles.AngularPosition.from_hd(hd=right_ascension+" "+declination)
-    return wrap_z_dipole_monopole(prefactor, \
-                                  z_redshift, \
-                                  beta, \
-                                  wrap_sep(wrap_radian_RA(dipole_ra), \
-                                           wrap_radian_DEC(dipole_dec), \
-                                           pos1.alpha.r, \
-                                           pos1.delta.r), \
-                                  monopole)
+    alpha, delta = position_radians(right_ascension, declination)
+    model = _model_for(ZDipoleModel, (dipole_ra, dipole_dec, prefactor, beta, monopole), covariance)
+    return model.ufloat(alpha, delta, z_redshift)
 
 # ======================
 # = r-dependent dipole =
@@ -289,7 +492,7 @@ R_DIP_RA_ERR = 1.0
 R_DIP_DEC = -62.0
 R_DIP_DEC_ERR = 10.0
 R_DIP_AMPLITUDE = 1.1e-6 # in GLyr 
-R_DIP_AMPLITUDE_ERR = 0.2e-6 # average of asymmetric errors
+R_DIP_AMPLITUDE_ERR = 0.2e-6 # average of asymmetric errors (the split is not recorded here)
 R_DIP_MONOPOLE = -0.187e-5
 R_DIP_MONOPOLE_ERR  = 0.084e-5
 
@@ -319,7 +522,25 @@ def basic_r_dipole_monopole(amplitude=R_DIPOLE_AMPLITUDE,\
     """
     return amplitude * radial_distance * umath.cos(theta) + monopole
 
-wrap_r_dipole_monopole = uncertainties.wrap(basic_r_dipole_monopole)
+def r_dipole_monopole_jacobian(amplitude=R_DIP_AMPLITUDE,\
+                               radial_distance=RADIAL_DISTANCE,\
+                               theta=THETA,\
+                               monopole=R_DIP_MONOPOLE,\
+                               *args,\
+                               **kwargs):
+    """Returns the partial derivatives of :func:`basic_r_dipole_monopole` (numbers or NumPy arrays).
+    
+    :returns: derivatives with respect to amplitude, radial_distance, theta and monopole.
+    :rtype: tuple
+    """
+    cos_theta = np.cos(theta)
+    return (radial_distance * cos_theta, \
+            amplitude * cos_theta, \
+            -amplitude * radial_distance * np.sin(theta), \
+            np.ones_like(cos_theta))
+
+wrap_r_dipole_monopole = _LazyWrap(lambda: (basic_r_dipole_monopole, \
+                                             [_partial(r_dipole_monopole_jacobian, i) for i in range(4)]))
 
 def r_dipole_monopole(right_ascension=QSO_RA, \
                       declination=QSO_DEC, \
@@ -327,14 +548,15 @@ def r_dipole_monopole(right_ascension=QSO_RA, \
                       dipole_dec=R_DIPOLE_DEC, \
                       amplitude=R_DIPOLE_AMPLITUDE, \
                       radial_distance=RADIAL_DISTANCE, \
-                      monopole=R_DIPOLE_MONOPOLE):
+                      monopole=R_DIPOLE_MONOPOLE, \
+                      covariance=None):
     """docstring for r_dipole_monopole
     
     Arguments:
-    :param right_ascension:right ascension of point in sky under consideration. 
-    :type right_ascension: number
-    :param declination: declination of point in sky under consideration.
-    :type declination: number
+    :param right_ascension:right ascension of point in sky under consideration (string, or number in radians).
+    :type right_ascension: string or number
+    :param declination: declination of point in sky under consideration (string, or number in radians).
+    :type declination: string or number
     :param dipole_ra: RA of dipole (optional with uncertainty via uncertainties.ufloat((value, error)) ).
     :type dipole_ra: uncertainties.AffineScalarFunc
     :param dipole_dec: DEC of dipole (optional with uncertainty via uncertainties.ufloat((value, error)) ).
@@ -345,18 +567,614 @@ def r_dipole_monopole(right_ascension=QSO_RA, \
     :type radial_distance: uncertainties.AffineScalarFunc
     :param monopole: Monopole term (optional with uncertainty via uncertainties.ufloat((value, error)) ).
     :type monopole: uncertainties.AffineScalarFunc
+    :param covariance: full covariance matrix of the parameters (see :class:`RDipoleModel`); it
+        replaces their errors, with the correlations it gives.
+    :type covariance: numpy.ndarray
     returns
     """
-# MTM 2015-02-09: Modified input for angles version 2
-#    pos1 = angles.AngularPosition(alpha=right_ascension, delta=declination)
-    pos1 = angles.AngularPosition.from_hd(hd=right_ascension+" "+declination)
-    return wrap_r_dipole_monopole(amplitude, \
-                                  radial_distance, \
-                                  wrap_sep(wrap_radian_RA(dipole_ra), \
-                                           wrap_radian_DEC(dipole_dec), \
-                                           pos1.alpha.r, \
-                                           pos1.delta.r), \
-                                  monopole)
+    alpha, delta = position_radians(right_ascension, declination)
+    model = _model_for(RDipoleModel, (dipole_ra, dipole_dec, amplitude, monopole), covariance)
+    return model.ufloat(alpha, delta, radial_distance)
+
+# ======================
+# = Precompiled models =
+# ======================
+# A model object is built once from a parameter set (numbers or ufloats). It stores the nominal
+# parameter values, their covariance matrix, the dipole unit vector and its derivatives with
+# respect to the dipole RA (hours) and DEC (degrees). Evaluating a sightline is then a dot product
+# with its unit vector plus the quadratic form J C J^T for the error. C is the covariance of the
+# ufloats, or a full matrix given as covariance=; either way it is one dense (n, n) matrix, so
+# correlated parameters cost no more than independent ones.
+
+def _unit_vector(alpha, delta):
+    """Returns the cartesian unit vector(s) of positions given in radians; the last axis is x, y, z."""
+    alpha = np.asarray(alpha, dtype=np.float64)
+    delta = np.asarray(delta, dtype=np.float64)
+    cos_delta = np.cos(delta)
+    return np.stack((cos_delta * np.cos(alpha), cos_delta * np.sin(alpha), np.sin(delta)), axis=-1)
+
+def _parameter_covariance(parameters):
+    """Covariance matrix of a list of parameters; plain numbers have no variance."""
+    covariance = np.zeros((len(parameters), len(parameters)))
+    uncertain = [i for i, parameter in enumerate(parameters) \
+                 if isinstance(parameter, uncertainties.AffineScalarFunc)]
+    if uncertain:
+        covariance[np.ix_(uncertain, uncertain)] = \
+            uncertainties.covariance_matrix([parameters[i] for i in uncertain])
+    return covariance
+
+def _checked_covariance(covariance, n_parameters):
+    """A full parameter covariance matrix as float64, after checking its shape and symmetry."""
+    covariance = np.array(covariance, dtype=np.float64)
+    if covariance.shape != (n_parameters, n_parameters):
+        raise DipoleError("covariance must be a %d x %d matrix, not %s" % (n_parameters, n_parameters, covariance.shape))
+    if not np.all(np.isfinite(covariance)):
+        raise DipoleError("covariance must be finite")
+    if not np.allclose(covariance, covariance.T, rtol=1e-8, atol=0.0):
+        raise DipoleError("covariance must be symmetric")
+    variances = np.diag(covariance)
+    if np.any(variances < 0):
+        raise NegativeError("covariance has negative variances")
+    covariance = 0.5 * (covariance + covariance.T)
+    # checked as a correlation matrix, since the parameters differ by many orders of magnitude
+    uncertain = variances > 0
+    if np.any(covariance[~uncertain]) or np.any(covariance[:, ~uncertain]):
+        raise NegativeError("covariance is not positive semi-definite")
+    scale = np.sqrt(variances[uncertain])
+    correlation = covariance[np.ix_(uncertain, uncertain)] / np.outer(scale, scale)
+    if len(scale) and np.linalg.eigvalsh(correlation)[0] < -1e-8:
+        raise NegativeError("covariance is not positive semi-definite")
+    return covariance
+
+def correlation_covariance(errors, correlation):
+    """Covariance matrix of parameters with these 1-sigma errors and correlation coefficients.
+    
+    :param errors: 1-sigma errors of the parameters, in the order of the model's parameter_names.
+    :param correlation: correlation matrix (ones on the diagonal).
+    :rtype: numpy.ndarray
+    """
+    errors = np.asarray(errors, dtype=np.float64)
+    correlation = np.asarray(correlation, dtype=np.float64)
+    if np.any(errors < 0):
+        raise NegativeError("errors must not be negative")
+    if correlation.shape != (len(errors), len(errors)) or np.any(np.abs(correlation) > 1):
+        raise DipoleError("correlation must be a %d x %d matrix of coefficients in [-1, 1]" % (len(errors), len(errors)))
+    return correlation * np.outer(errors, errors)
+
+def _quadratic_form(jacobian, covariance):
+    """J C J^T for every row of the jacobian (..., n_parameters)."""
+    # a matrix product and a row-wise dot are several times faster than the three-operand einsum
+    return np.einsum('...i,...i->...', jacobian.dot(covariance), jacobian)
+
+def _linear_ufloat(nominal, variables, derivatives):
+    """Builds nominal + sum(derivative * (variable - variable.nominal_value)).
+
+    This is the first-order expansion uncertainties.wrap would return, so correlations with the
+    input ufloats are kept. If nothing is uncertain a float is returned.
+    """
+    result = nominal
+    for variable, derivative in zip(variables, derivatives):
+        if isinstance(variable, uncertainties.AffineScalarFunc):
+            result = result + derivative * (variable - variable.nominal_value)
+    return result
+
+def _subset_rows(kwargs, right_ascension, declination, sightline_terms):
+    """Positions and sightline terms restricted to the subset= keyword of a model method."""
+    subset = kwargs.pop('subset', None)
+    if kwargs:
+        raise TypeError("unexpected keyword arguments: %s" % ", ".join(sorted(kwargs)))
+    rows = _subset(subset, right_ascension, declination, *sightline_terms)
+    return rows[0], rows[1], rows[2:]
+
+class DipoleModel(object):
+    """Dipole and monopole model, eq. 15 in King et al. 2012, with everything that only depends on
+    the parameters precomputed.
+    
+    Arguments:
+    :param dipole_ra: RA of dipole in hours (number or uncertainties.ufloat).
+    :param dipole_dec: DEC of dipole in degrees (number or uncertainties.ufloat).
+    :param amplitude: Amplitude term of dipole (number or uncertainties.ufloat).
+    :param monopole: Monopole term (number or uncertainties.ufloat).
+    :param asymmetric_errors: (lower, upper) errors by parameter name, e.g. DIPOLE_ASYMMETRIC_ERRORS.
+        These parameters are drawn from split normal distributions by :func:`monte_carlo`, 
+        independently of the other parameters.
+    :type asymmetric_errors: dict
+    :param covariance: full covariance matrix of the parameters, in the order of parameter_names
+        (default: the covariance of the ufloats given). It replaces their errors, so correlated
+        parameters need no uncertainties.correlated_values.
+    :type covariance: numpy.ndarray
+    
+    Examples:
+    
+    >>> model = dipole_error.DipoleModel()
+    >>> nominal, error = model.evaluate(right_ascension_array, declination_array)
+    >>> model = dipole_error.DipoleModel(asymmetric_errors=dipole_error.DIPOLE_ASYMMETRIC_ERRORS)
+    >>> nominal, lower, upper = model.evaluate_asymmetric(right_ascension_array, declination_array)
+    >>> errors = [1.0, 10.0, 0.21e-5, 0.084e-5]
+    >>> correlation = np.eye(4); correlation[2, 3] = correlation[3, 2] = -0.5
+    >>> model = dipole_error.DipoleModel(covariance=dipole_error.correlation_covariance(errors, correlation))
+    """
+    parameter_names = ('dipole_ra', 'dipole_dec', 'amplitude', 'monopole')
+    sightline_names = ()
+
+    def __init__(self, \
+                 dipole_ra=DIPOLE_RA, \
+                 dipole_dec=DIPOLE_DEC, \
+                 amplitude=DIPOLE_AMPLITUDE, \
+                 monopole=MONOPOLE, \
+                 asymmetric_errors=None, \
+                 covariance=None):
+        self._setup((dipole_ra, dipole_dec, amplitude, monopole), asymmetric_errors, covariance)
+
+    def _setup(self, parameters, asymmetric_errors=None, covariance=None):
+        self.values = np.array([uncertainties.nominal_value(p) for p in parameters], dtype=np.float64)
+        if covariance is None:
+            self.parameters = tuple(parameters)
+            self.covariance = _parameter_covariance(self.parameters)
+        else:
+            # The matrix replaces the errors of the parameters; the ufloats built from it carry the
+            # same correlations, so ufloat() and uarray() agree with evaluate().
+            self.covariance = _checked_covariance(covariance, len(self.values))
+            self.parameters = tuple(uncertainties.correlated_values(self.values, self.covariance))
+        self.asymmetric_errors = dict(asymmetric_errors or {})
+        for name, (lower, upper) in self.asymmetric_errors.items():
+            if name not in self.parameter_names:
+                raise DipoleError("%s has no parameter %r" % (type(self).__name__, name))
+            if lower < 0 or upper < 0:
+                raise NegativeError("asymmetric errors of %r are negative" % name)
+        # Asymmetric parameters are independent of the others, and their own variance is left out.
+        self._asymmetric_index = np.array([self.parameter_names.index(name) \
+                                           for name in sorted(self.asymmetric_errors)], dtype=int)
+        self._asymmetric_lower = np.array([self.asymmetric_errors[name][0] for name in sorted(self.asymmetric_errors)])
+        self._asymmetric_upper = np.array([self.asymmetric_errors[name][1] for name in sorted(self.asymmetric_errors)])
+        self._symmetric_covariance = self.covariance.copy()
+        self._symmetric_covariance[self._asymmetric_index, :] = 0.0
+        self._symmetric_covariance[:, self._asymmetric_index] = 0.0
+        # as angles.h2r and angles.d2r
+        alpha = np.radians(self.values[0] * 15.0)
+        delta = np.radians(self.values[1])
+        sin_alpha, cos_alpha = np.sin(alpha), np.cos(alpha)
+        sin_delta, cos_delta = np.sin(delta), np.cos(delta)
+        self.direction = np.array([cos_delta * cos_alpha, cos_delta * sin_alpha, sin_delta])
+        self.direction_derivatives = np.array([
+            [-cos_delta * sin_alpha, cos_delta * cos_alpha, 0.0],
+            [-sin_delta * cos_alpha, -sin_delta * sin_alpha, cos_delta]]) \
+            * np.array([[np.pi / 12.0], [np.pi / 180.0]])
+        # columns: cos(theta), d cos(theta)/d dipole_ra, d cos(theta)/d dipole_dec
+        self._projection = np.vstack((self.direction, self.direction_derivatives)).T
+
+    def _project(self, right_ascension, declination):
+        """cos(theta) and its derivatives with respect to the dipole RA and DEC."""
+        return self._project_vectors(_unit_vector(right_ascension, declination))
+
+    def _project_vectors(self, unit_vectors):
+        """cos(theta) and its derivatives for sightline unit vectors (..., 3)."""
+        projected = unit_vectors.dot(self._projection)
+        return np.clip(projected[..., 0], -1.0, 1.0), projected[..., 1], projected[..., 2]
+
+    def _model(self, cos_theta, d_ra, d_dec):
+        """Returns the model value, its derivatives with respect to each parameter, and with
+        respect to each sightline term."""
+        amplitude = self.values[2]
+        return (amplitude * cos_theta + self.values[3], \
+                [amplitude * d_ra, amplitude * d_dec, cos_theta, np.ones_like(cos_theta)], \
+                [])
+
+    def jacobian(self, right_ascension, declination, *sightline_terms):
+        """Returns the nominal values and the jacobian (..., n_parameters) at positions in radians."""
+        return self._jacobian(self._project(right_ascension, declination), sightline_terms)
+
+    def _jacobian(self, projected, sightline_terms):
+        nominal, columns, _ = self._model(*(tuple(projected) + \
+                                            tuple(np.asarray(x, dtype=np.float64) for x in sightline_terms)))
+        return nominal, np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+    def evaluate(self, right_ascension, declination, *sightline_terms, **kwargs):
+        """Returns the predicted values and their 1-sigma errors at positions in radians.
+        
+        The sightline terms (z_redshift for :class:`ZDipoleModel`, radial_distance for
+        :class:`RDipoleModel`) are arrays that broadcast against the positions. With the keyword
+        subset= (indices or a boolean mask) only those rows are evaluated.
+        """
+        right_ascension, declination, sightline_terms = \
+            _subset_rows(kwargs, right_ascension, declination, sightline_terms)
+        return self._evaluate(self._project(right_ascension, declination), sightline_terms)
+
+    def _evaluate(self, projected, sightline_terms):
+        """evaluate() from the output of _project."""
+        nominal, jacobian = self._jacobian(projected, sightline_terms)
+        variance = _quadratic_form(jacobian, self.covariance)
+        return nominal, np.sqrt(np.maximum(variance, 0.0))
+
+    def evaluate_asymmetric(self, right_ascension, declination, *sightline_terms, **kwargs):
+        """Linear propagation with the asymmetric errors: returns the predicted values and their 
+        lower and upper 1-sigma errors.
+        
+        Each asymmetric parameter contributes its upper error to the upper side of the prediction 
+        when the prediction increases with it, and its lower error otherwise. Takes subset= as
+        evaluate() does.
+        """
+        right_ascension, declination, sightline_terms = \
+            _subset_rows(kwargs, right_ascension, declination, sightline_terms)
+        nominal, jacobian = self.jacobian(right_ascension, declination, *sightline_terms)
+        variance = _quadratic_form(jacobian, self._symmetric_covariance)
+        derivatives = jacobian[..., self._asymmetric_index]
+        increasing = derivatives > 0
+        upper = np.where(increasing, self._asymmetric_upper, self._asymmetric_lower) * derivatives
+        lower = np.where(increasing, self._asymmetric_lower, self._asymmetric_upper) * derivatives
+        return nominal, \
+               np.sqrt(np.maximum(variance + (lower ** 2).sum(axis=-1), 0.0)), \
+               np.sqrt(np.maximum(variance + (upper ** 2).sum(axis=-1), 0.0))
+
+    def ufloat(self, alpha, delta, *sightline_terms):
+        """Returns the prediction at one position (in radians) as a ufloat correlated with the
+        parameters. The sightline terms may themselves be ufloats."""
+        cos_theta, d_ra, d_dec = self._project(alpha, delta)
+        nominal, columns, sightline_columns = \
+            self._model(cos_theta, d_ra, d_dec, *[uncertainties.nominal_value(x) for x in sightline_terms])
+        return _linear_ufloat(float(nominal), \
+                              self.parameters + tuple(sightline_terms), \
+                              [float(x) for x in columns + sightline_columns])
+
+    def uarray(self, right_ascension, declination, *sightline_terms):
+        """Returns the predictions at positions in radians as a :class:`dipole_uarray.UArray`, with
+        derivatives with respect to the variables of the parameters. Sightline terms may be UArrays
+        themselves (e.g. redshifts with errors)."""
+        import dipole_uarray
+        variables, parameter_derivatives = dipole_uarray.variable_derivatives(self.parameters)
+        nominal, columns, sightline_columns = \
+            self._model(*(tuple(self._project(right_ascension, declination)) + \
+                          tuple(np.asarray(getattr(x, 'nominal_values', x), dtype=np.float64) for x in sightline_terms)))
+        jacobian = np.stack(np.broadcast_arrays(*columns), axis=-1)
+        result = dipole_uarray.UArray(nominal, jacobian.dot(parameter_derivatives), variables)
+        for term, column in zip(sightline_terms, sightline_columns):
+            if isinstance(term, dipole_uarray.UArray):
+                result = result + (term - term.nominal_values) * column
+        return result
+
+    def sample(self, parameters, sightlines, *sightline_terms):
+        """Evaluates the model for many parameter draws at once.
+        
+        :param parameters: parameter samples, one row per draw, columns as in parameter_names.
+        :type parameters: numpy.ndarray (n_draws, n_parameters)
+        :param sightlines: unit vectors of the sightlines.
+        :type sightlines: numpy.ndarray (n_sightlines, 3)
+        :returns: model values for every draw and sightline.
+        :rtype: numpy.ndarray (n_draws, n_sightlines)
+        """
+        directions = _unit_vector(parameters[:, 0] * (np.pi / 12.0), parameters[:, 1] * (np.pi / 180.0))
+        return self._sampled(parameters, directions.dot(sightlines.T), \
+                             *[np.asarray(x, dtype=np.float64) for x in sightline_terms])
+
+    def _sampled(self, parameters, cos_theta):
+        return parameters[:, 2:3] * cos_theta + parameters[:, 3:4]
+
+class ZDipoleModel(DipoleModel):
+    """z-dependent dipole model, eq. 18 in King et al. 2012. The sightline term is z_redshift,
+    which must be positive: a single other redshift raises ValueError, and in arrays the
+    predictions of such redshifts are NaN.
+    
+    Arguments:
+    :param dipole_ra: RA of dipole in hours (number or uncertainties.ufloat).
+    :param dipole_dec: DEC of dipole in degrees (number or uncertainties.ufloat).
+    :param prefactor: Prefactor term of dipole (number or uncertainties.ufloat).
+    :param beta: power law exponent (number or uncertainties.ufloat).
+    :param monopole: Monopole term (number or uncertainties.ufloat).
+    :param asymmetric_errors: (lower, upper) errors by parameter name, e.g. Z_DIPOLE_ASYMMETRIC_ERRORS.
+    :type asymmetric_errors: dict
+    :param covariance: full covariance matrix of the parameters (see :class:`DipoleModel`).
+    """
+    parameter_names = ('dipole_ra', 'dipole_dec', 'prefactor', 'beta', 'monopole')
+    sightline_names = ('z_redshift',)
+
+    def __init__(self, \
+                 dipole_ra=Z_DIPOLE_RA, \
+                 dipole_dec=Z_DIPOLE_DEC, \
+                 prefactor=Z_DIPOLE_PREFACTOR, \
+                 beta=Z_DIPOLE_BETA, \
+                 monopole=Z_DIPOLE_MONOPOLE, \
+                 asymmetric_errors=None, \
+                 covariance=None):
+        self._setup((dipole_ra, dipole_dec, prefactor, beta, monopole), asymmetric_errors, covariance)
+
+    def _model(self, cos_theta, d_ra, d_dec, z_redshift=REDSHIFT):
+        z_redshift = _positive_redshift(z_redshift)
+        prefactor, beta = self.values[2], self.values[3]
+        z_power = np.power(z_redshift, beta)
+        scale = prefactor * z_power
+        return (scale * cos_theta + self.values[4], \
+                [scale * d_ra, scale * d_dec, z_power * cos_theta, \
+                 scale * np.log(z_redshift) * cos_theta, np.ones_like(cos_theta)], \
+                [prefactor * beta * np.power(z_redshift, beta - 1.0) * cos_theta])
+
+    def _sampled(self, parameters, cos_theta, z_redshift=REDSHIFT):
+        scale = parameters[:, 2:3] * np.exp(parameters[:, 3:4] * np.log(_positive_redshift(z_redshift)))
+        return scale * cos_theta + parameters[:, 4:5]
+
+class RDipoleModel(DipoleModel):
+    """r-dependent dipole model, eq. 19 in King et al. 2012. The sightline term is radial_distance
+    in GLyr.
+    
+    Arguments:
+    :param dipole_ra: RA of dipole in hours (number or uncertainties.ufloat).
+    :param dipole_dec: DEC of dipole in degrees (number or uncertainties.ufloat).
+    :param amplitude: Amplitude term of dipole (number or uncertainties.ufloat).
+    :param monopole: Monopole term (number or uncertainties.ufloat).
+    :param asymmetric_errors: (lower, upper) errors by parameter name.
+    :type asymmetric_errors: dict
+    :param covariance: full covariance matrix of the parameters (see :class:`DipoleModel`).
+    """
+    sightline_names = ('radial_distance',)
+
+    def __init__(self, \
+                 dipole_ra=R_DIPOLE_RA, \
+                 dipole_dec=R_DIPOLE_DEC, \
+                 amplitude=R_DIPOLE_AMPLITUDE, \
+                 monopole=R_DIPOLE_MONOPOLE, \
+                 asymmetric_errors=None, \
+                 covariance=None):
+        self._setup((dipole_ra, dipole_dec, amplitude, monopole), asymmetric_errors, covariance)
+
+    def _model(self, cos_theta, d_ra, d_dec, radial_distance=RADIAL_DISTANCE):
+        amplitude = self.values[2]
+        scale = amplitude * radial_distance
+        return (scale * cos_theta + self.values[3], \
+                [scale * d_ra, scale * d_dec, radial_distance * cos_theta, np.ones_like(cos_theta)], \
+                [amplitude * cos_theta])
+
+    def _sampled(self, parameters, cos_theta, radial_distance=RADIAL_DISTANCE):
+        return (parameters[:, 2:3] * radial_distance) * cos_theta + parameters[:, 3:4]
+
+_MODEL_CACHE = {}
+
+def _model_for(model_class, parameters, covariance=None):
+    """Returns a model built from these parameters (and covariance matrix), reusing the last one
+    built from the same objects."""
+    key = (model_class, id(covariance)) + tuple(id(p) for p in parameters)
+    state = tuple((uncertainties.nominal_value(p), uncertainties.std_dev(p)) for p in parameters)
+    if covariance is not None:
+        state += (np.asarray(covariance, dtype=np.float64).tostring(),)
+    cached = _MODEL_CACHE.get(key)
+    if cached is not None and cached[1] == state and cached[2][0] is covariance and \
+            all(a is b for a, b in zip(cached[2][1:], parameters)):
+        return cached[0]
+    if len(_MODEL_CACHE) > 32:
+        _MODEL_CACHE.clear()
+    model = model_class(*parameters, covariance=covariance)
+    # the inputs are kept alive with the model, so their ids are not reused
+    _MODEL_CACHE[key] = (model, state, (covariance,) + tuple(parameters))
+    return model
+
+# =============================================
+# = Catalog-scale (vectorized) model functions =
+# =============================================
+# The array versions of the three models take NumPy arrays of positions (RA and DEC in radians,
+# or columns of sexagesimal strings) and return a (nominal value, 1-sigma error) pair of arrays.
+# With subset= (indices or a boolean mask, e.g. from dipole_index) only those rows are parsed
+# and evaluated.
+#
+# Catalogs often list several absorbers per QSO. Rows are grouped by sightline first, so the
+# position parsing and the separation are computed once per QSO and only the redshift- or
+# distance-dependent part of a model per absorber. Sexagesimal strings are fully deduplicated
+# (sorting is much cheaper than parsing); for positions in radians only runs of repeated
+# positions are collapsed, since sorting would cost more than the separations it saves.
+
+def _subset(subset, *arrays):
+    """The rows of arrays in subset; scalars (broadcast to every row) are passed unchanged."""
+    if subset is None:
+        return arrays
+    return tuple(array if np.ndim(array) == 0 else np.asarray(array)[subset] for array in arrays)
+
+def _group_sightlines(right_ascension, declination):
+    """Distinct positions and the index of every row's position among them.
+    
+    :returns: RA and DEC of the distinct sightlines, and inverse (None if every row is distinct)
+        with right_ascension == unique_right_ascension[inverse].
+    :rtype: tuple
+    """
+    right_ascension, declination = np.broadcast_arrays(np.asarray(right_ascension), np.asarray(declination))
+    shape = right_ascension.shape
+    right_ascension, declination = right_ascension.ravel(), declination.ravel()
+    if len(right_ascension) < 2:
+        return right_ascension.reshape(shape), declination.reshape(shape), None
+    # runs of rows on the same sightline
+    starts = np.concatenate(([True], (right_ascension[1:] != right_ascension[:-1]) | \
+                                     (declination[1:] != declination[:-1])))
+    inverse = np.cumsum(starts) - 1
+    right_ascension, declination = right_ascension[starts], declination[starts]
+    if _is_text(right_ascension) and len(right_ascension) > 1:
+        order = np.lexsort((declination, right_ascension))
+        ordered_ra, ordered_dec = right_ascension[order], declination[order]
+        first = np.concatenate(([True], (ordered_ra[1:] != ordered_ra[:-1]) | (ordered_dec[1:] != ordered_dec[:-1])))
+        group = np.empty(len(order), dtype=np.intp)
+        group[order] = np.cumsum(first) - 1
+        inverse = group[inverse]
+        right_ascension, declination = ordered_ra[first], ordered_dec[first]
+    if len(right_ascension) == len(inverse):
+        # nothing to share (the text path may have reordered the rows)
+        return right_ascension[inverse].reshape(shape), declination[inverse].reshape(shape), None
+    return right_ascension, declination, inverse.reshape(shape)
+
+def _projections(models, right_ascension, declination):
+    """cos(theta) and its derivatives for every model, computed once per distinct sightline and
+    dipole direction."""
+    right_ascension, declination, inverse = _group_sightlines(right_ascension, declination)
+    unit_vectors = _unit_vector(*_radians(right_ascension, declination))
+    shared = {}
+    projections = []
+    for model in models:
+        direction = tuple(model.values[:2])
+        if direction not in shared:
+            projected = model._project_vectors(unit_vectors)
+            shared[direction] = projected if inverse is None else tuple(x[inverse] for x in projected)
+        projections.append(shared[direction])
+    return projections
+
+def dipole_monopole_array(right_ascension, \
+                          declination, \
+                          dipole_ra=DIPOLE_RA, \
+                          dipole_dec=DIPOLE_DEC, \
+                          amplitude=DIPOLE_AMPLITUDE, \
+                          monopole=MONOPOLE, \
+                          subset=None, \
+                          covariance=None):
+    """Array version of :func:`dipole_monopole` (eq. 15 in King et al. 2012).
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :type right_ascension: numpy.ndarray
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :type declination: numpy.ndarray
+    :param dipole_ra: RA of dipole in hours (number or uncertainties.ufloat).
+    :param dipole_dec: DEC of dipole in degrees (number or uncertainties.ufloat).
+    :param amplitude: Amplitude term of dipole (number or uncertainties.ufloat).
+    :param monopole: Monopole term (number or uncertainties.ufloat).
+    :param subset: indices or boolean mask of the sightlines to evaluate (default: all).
+    :param covariance: full covariance matrix of the parameters (see :class:`DipoleModel`).
+    :returns: predicted values and their 1-sigma errors.
+    :rtype: tuple of numpy.ndarray
+    """
+    model = _model_for(DipoleModel, (dipole_ra, dipole_dec, amplitude, monopole), covariance)
+    right_ascension, declination = _subset(subset, right_ascension, declination)
+    return model._evaluate(_projections([model], right_ascension, declination)[0], ())
+
+def z_dipole_monopole_array(right_ascension, \
+                            declination, \
+                            dipole_ra=Z_DIPOLE_RA, \
+                            dipole_dec=Z_DIPOLE_DEC, \
+                            prefactor=Z_DIPOLE_PREFACTOR, \
+                            z_redshift=REDSHIFT, \
+                            beta=Z_DIPOLE_BETA, \
+                            monopole=Z_DIPOLE_MONOPOLE, \
+                            subset=None, \
+                            covariance=None):
+    """Array version of :func:`z_dipole_monopole` (eq. 18 in King et al. 2012). As there, the
+    published errors of every parameter are propagated by default.
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :type right_ascension: numpy.ndarray
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :type declination: numpy.ndarray
+    :param dipole_ra: RA of dipole in hours (number or uncertainties.ufloat).
+    :param dipole_dec: DEC of dipole in degrees (number or uncertainties.ufloat).
+    :param prefactor: Prefactor term of dipole (number or uncertainties.ufloat).
+    :param z_redshift: Redshifts of the absorbers.
+    :type z_redshift: numpy.ndarray
+    :param beta: power law exponent (number or uncertainties.ufloat).
+    :param monopole: Monopole term (number or uncertainties.ufloat).
+    :param subset: indices or boolean mask of the sightlines to evaluate (default: all).
+    :param covariance: full covariance matrix of the parameters (see :class:`ZDipoleModel`).
+    :returns: predicted values and their 1-sigma errors.
+    :rtype: tuple of numpy.ndarray
+    """
+    model = _model_for(ZDipoleModel, (dipole_ra, dipole_dec, prefactor, beta, monopole), covariance)
+    right_ascension, declination, z_redshift = _subset(subset, right_ascension, declination, z_redshift)
+    return model._evaluate(_projections([model], right_ascension, declination)[0], (z_redshift,))
+
+def r_dipole_monopole_array(right_ascension, \
+                            declination, \
+                            dipole_ra=R_DIPOLE_RA, \
+                            dipole_dec=R_DIPOLE_DEC, \
+                            amplitude=R_DIPOLE_AMPLITUDE, \
+                            radial_distance=RADIAL_DISTANCE, \
+                            monopole=R_DIPOLE_MONOPOLE, \
+                            subset=None, \
+                            covariance=None):
+    """Array version of :func:`r_dipole_monopole` (eq. 19 in King et al. 2012).
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :type right_ascension: numpy.ndarray
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :type declination: numpy.ndarray
+    :param dipole_ra: RA of dipole in hours (number or uncertainties.ufloat).
+    :param dipole_dec: DEC of dipole in degrees (number or uncertainties.ufloat).
+    :param amplitude: Amplitude term of dipole (number or uncertainties.ufloat).
+    :param radial_distance: Radial distances of the absorbers in GLyr.
+    :type radial_distance: numpy.ndarray
+    :param monopole: Monopole term (number or uncertainties.ufloat).
+    :param subset: indices or boolean mask of the sightlines to evaluate (default: all).
+    :param covariance: full covariance matrix of the parameters (see :class:`RDipoleModel`).
+    :returns: predicted values and their 1-sigma errors.
+    :rtype: tuple of numpy.ndarray
+    """
+    model = _model_for(RDipoleModel, (dipole_ra, dipole_dec, amplitude, monopole), covariance)
+    right_ascension, declination, radial_distance = _subset(subset, right_ascension, declination, radial_distance)
+    return model._evaluate(_projections([model], right_ascension, declination)[0], (radial_distance,))
+
+# ===========================
+# = Several models at once =
+# ===========================
+# The three models are usually evaluated together for every absorber. evaluate_models computes
+# the sightline unit vectors once, and cos(theta) with its derivatives once per distinct dipole
+# direction (the z- and r-dipole fits share theirs), then applies each model to them.
+
+MODEL_NAMES = ('dipole', 'z_dipole', 'r_dipole')
+
+def published_models(covariances=None):
+    """The three models with the published parameters, as the array functions use them by default.
+    
+    :param covariances: full parameter covariance matrices by model name (see :class:`DipoleModel`),
+        for models whose parameters are correlated.
+    :type covariances: dict
+    :rtype: collections.OrderedDict of name: model
+    """
+    covariances = dict(covariances or {})
+    unknown = [name for name in covariances if name not in MODEL_NAMES]
+    if unknown:
+        raise DipoleError("unknown models %s (choose from %s)" % (", ".join(unknown), ", ".join(MODEL_NAMES)))
+    return collections.OrderedDict((
+        ('dipole', _model_for(DipoleModel, (DIPOLE_RA, DIPOLE_DEC, DIPOLE_AMPLITUDE, MONOPOLE), \
+                              covariances.get('dipole'))), 
+        ('z_dipole', _model_for(ZDipoleModel, (Z_DIPOLE_RA, Z_DIPOLE_DEC, Z_DIPOLE_PREFACTOR, Z_DIPOLE_BETA, Z_DIPOLE_MONOPOLE), \
+                                covariances.get('z_dipole'))), 
+        ('r_dipole', _model_for(RDipoleModel, (R_DIPOLE_RA, R_DIPOLE_DEC, R_DIPOLE_AMPLITUDE, R_DIPOLE_MONOPOLE), \
+                                covariances.get('r_dipole')))))
+
+def evaluate_models(right_ascension, \
+                    declination, \
+                    z_redshift=REDSHIFT, \
+                    radial_distance=RADIAL_DISTANCE, \
+                    models=MODEL_NAMES, \
+                    subset=None, \
+                    covariances=None):
+    """Evaluates several models for the same sightlines, sharing the separation computations.
+    
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :type right_ascension: numpy.ndarray
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :type declination: numpy.ndarray
+    :param z_redshift: Redshifts of the absorbers (for models with a z_redshift term).
+    :param radial_distance: Radial distances of the absorbers in GLyr (for models with a radial_distance term).
+    :param models: names of published models (see MODEL_NAMES), or a dict of name: model object.
+    :param subset: indices or boolean mask of the sightlines to evaluate (default: all).
+    :param covariances: full parameter covariance matrices of published models, by name.
+    :type covariances: dict
+    :returns: columnar result with fields <name> and <name>_err for every model, in the order given.
+    :rtype: numpy.ndarray (structured)
+    """
+    if isinstance(models, dict) and covariances:
+        raise DipoleError("covariances are for published models; give model objects their covariance= instead")
+    if not isinstance(models, dict):
+        published = published_models(covariances)
+        unknown = [name for name in models if name not in published]
+        if unknown:
+            raise DipoleError("unknown models %s (choose from %s)" % (", ".join(unknown), ", ".join(MODEL_NAMES)))
+        models = collections.OrderedDict((name, published[name]) for name in models)
+    right_ascension, declination, z_redshift, radial_distance = \
+        _subset(subset, right_ascension, declination, z_redshift, radial_distance)
+    terms = {'z_redshift': z_redshift, 'radial_distance': radial_distance}
+    columns = []
+    for model, projected in zip(models.values(), _projections(models.values(), right_ascension, declination)):
+        columns.extend(model._evaluate(projected, [terms[term] for term in model.sightline_names]))
+    columns = np.broadcast_arrays(*columns)
+    result = np.empty(columns[0].shape, dtype=[(field, np.float64) for name in models \
+                                               for field in (name, name + "_err")])
+    for field, column in zip(result.dtype.names, columns):
+        result[field] = column
+    return result
 
 # ==============================
 # = Significance of difference =
@@ -409,34 +1227,334 @@ def statistical_difference_systematic(measurement_one_and_error, \
                                       systematic_error=0,\
                                        ):
     """Describe the range using statistical difference."""
-    if systematic_error < 0:
+    minimum, maximum, overlap = statistical_difference_systematic_array(measurement_one_and_error.nominal_value, \
+                                                                        measurement_one_and_error.std_dev, \
+                                                                        measurement_two_and_error.nominal_value, \
+                                                                        measurement_two_and_error.std_dev, \
+                                                                        systematic_error)
+    return minimum, maximum
+
+def statistical_difference_array(measurement_one, \
+                                 measurement_one_error, \
+                                 measurement_two, \
+                                 measurement_two_error, \
+                                 subset=None, \
+                                 ):
+    """Array version of :func:`statistical_difference`, on nominal values and 1-sigma errors.
+    
+    :param subset: indices or boolean mask of the rows to compare (default: all).
+    :returns: the separation in units of the combined statistical error.
+    :rtype: numpy.ndarray
+    """
+    measurement_one, measurement_one_error, measurement_two, measurement_two_error = \
+        _subset(subset, measurement_one, measurement_one_error, measurement_two, measurement_two_error)
+    total_statistical_error = np.hypot(measurement_one_error, measurement_two_error)
+    return np.abs(np.subtract(measurement_one, measurement_two)) / total_statistical_error
+
+def statistical_difference_systematic_array(measurement_one, \
+                                            measurement_one_error, \
+                                            measurement_two, \
+                                            measurement_two_error, \
+                                            systematic_error=0, \
+                                            subset=None, \
+                                            ):
+    """Array version of :func:`statistical_difference_systematic`, on nominal values and 1-sigma errors.
+    
+    Shifting measurement_one by up to +/- systematic_error moves it between |difference| - systematic_error
+    (or 0, if the shift can close the gap) and |difference| + systematic_error from measurement_two.
+    
+    Arguments:
+    :param measurement_one: values, e.g. the predictions.
+    :param measurement_one_error: their 1-sigma statistical errors.
+    :param measurement_two: values, e.g. the measurements.
+    :param measurement_two_error: their 1-sigma statistical errors.
+    :param systematic_error: systematic error, a number or one per row.
+    :param subset: indices or boolean mask of the rows to compare (default: all).
+    :returns: minimum and maximum separation in units of the combined statistical error, and 
+        whether the two agree within the systematic error (the minimum is then 0).
+    :rtype: tuple of numpy.ndarray
+    """
+    measurement_one, measurement_one_error, measurement_two, measurement_two_error, systematic_error = \
+        _subset(subset, measurement_one, measurement_one_error, measurement_two, measurement_two_error, \
+                systematic_error)
+    systematic_error = np.asarray(systematic_error, dtype=np.float64)
+    if np.any(systematic_error < 0):
         raise NegativeError('x is less than zero')
+    total_statistical_error = np.hypot(measurement_one_error, measurement_two_error)
+    difference = np.abs(np.subtract(measurement_one, measurement_two))
+    overlap = difference <= systematic_error
+    minimum = np.where(overlap, 0.0, difference - systematic_error)
+    return minimum / total_statistical_error, (difference + systematic_error) / total_statistical_error, overlap
 
-    measurement_one = measurement_one_and_error.nominal_value
-    measurement_two = measurement_two_and_error.nominal_value
-    measurement_one_error = measurement_one_and_error.std_dev
-    measurement_two_error = measurement_two_and_error.std_dev
-    total_statistical_error = np.sqrt(measurement_one_error ** 2 + measurement_two_error ** 2)
-    measurement_prediction_difference = np.abs(measurement_one - measurement_two)
-    extreme_list = np.abs([measurement_one - measurement_two - x for x in [systematic_error, -systematic_error]])
-    minimum = np.min(extreme_list)
-    maximum = np.max(extreme_list)
-    if np.any(measurement_one - systematic_error <= measurement_two <= measurement_one + systematic_error):
-        minimum = 0.0
-    return minimum / total_statistical_error, maximum / total_statistical_error
-
-def report_stat_difference(measurement_one_and_error=dipole_monopole(), \
-                           measurement_two_and_error=uncertainties.ufloat(-1.09e-6, 2.35e-6), \
+def report_stat_difference(measurement_one_and_error=None, \
+                           measurement_two_and_error=None, \
                            systematic_error=1.65e-6,\
                            round_places=5, \
                            ):
-    """Docstring"""
+    """Prints the range of sigma separating two measurements (as statistical_difference_systematic).
+    
+    The defaults compare dipole_monopole() at the default QSO with -1.09e-6 +/- 2.35e-6; they are 
+    evaluated at call time.
+    """
+    if measurement_one_and_error is None:
+        measurement_one_and_error = dipole_monopole()
+    if measurement_two_and_error is None:
+        measurement_two_and_error = uncertainties.ufloat(-1.09e-6, 2.35e-6)
     minimum, maximum = statistical_difference_systematic(measurement_one_and_error, measurement_two_and_error, systematic_error)
     print "Between", round(minimum, round_places), "and", round(maximum, round_places), "sigma away."
     return
 
+def write_stat_difference_report(output, \
+                                 names, \
+                                 minimum, \
+                                 maximum, \
+                                 round_places=5, \
+                                 ):
+    """Batch version of :func:`report_stat_difference`: writes one line per object to output.
+    
+    Arguments:
+    :param output: open file to write to (e.g. sys.stdout).
+    :param names: names of the objects.
+    :param minimum: minimum separations, as from :func:`statistical_difference_systematic_array`.
+    :param maximum: maximum separations.
+    :param round_places: number of decimal places.
+    """
+    line = "%%s: Between %%.%df and %%.%df sigma away.\n" % (round_places, round_places)
+    output.writelines(line % row for row in zip(names, np.asarray(minimum, dtype=np.float64).tolist(), \
+                                                np.asarray(maximum, dtype=np.float64).tolist()))
+
 # ============================
 # = Monte Carlo Verification =
 # ============================
+# The linear propagation above is checked by drawing parameter sets from their (multivariate
+# normal) distribution and evaluating every sightline for every draw. The draws are processed in
+# chunks of about MC_CHUNK_SIZE values, so memory stays bounded however many samples are asked for.
+# Means and standard deviations are accumulated exactly; percentiles are read off a per-sightline
+# histogram whose range is set by the first chunk of draws. Chunk i always draws from a
+# RandomState seeded with (seed, i), so a run is reproducible for a given seed and chunk size.
+# Parameters with asymmetric errors are drawn from split normal distributions.
+
+MC_PERCENTILES = (2.275, 15.865, 50.0, 84.135, 97.725)
+MC_CHUNK_SIZE = 2 ** 20
+MC_HISTOGRAM_SIZE = 2 ** 22
+
+class MonteCarloResult(object):
+    """Monte Carlo predictions for a set of sightlines, next to the linear propagation.
+    
+    Attributes:
+    percentiles -- the percentile levels (in percent).
+    values -- array (n_percentiles, n_sightlines) of the predicted value at each level.
+    mean, std -- Monte Carlo mean and standard deviation per sightline.
+    nominal, error -- linear propagation (as from :meth:`DipoleModel.evaluate`) per sightline.
+    n_samples -- number of parameter draws.
+    seed -- seed of the run.
+    outside -- fraction of draws per sightline that fell outside the histogram range.
+    """
+
+    def __init__(self, percentiles, values, mean, std, nominal, error, n_samples, seed, outside):
+        self.percentiles = tuple(percentiles)
+        self.values = values
+        self.mean = mean
+        self.std = std
+        self.nominal = nominal
+        self.error = error
+        self.n_samples = n_samples
+        self.seed = seed
+        self.outside = outside
+
+    def percentile(self, level):
+        """Returns the predicted values at one of the computed percentile levels."""
+        return self.values[self.percentiles.index(level)]
+
+    def summary(self, round_places=5):
+        """One line per sightline: linear value +/- error, then the Monte Carlo percentiles."""
+        lines = []
+        for i in range(len(self.nominal)):
+            lines.append("%s +/- %s | MC: %s" % (_round_sig(self.nominal[i], round_places), \
+                                                 _round_sig(self.error[i], round_places), \
+                                                 " ".join(str(_round_sig(v, round_places)) for v in self.values[:, i])))
+        return lines
 
-# TODO: monte carlo verification of these calculations
+def _round_sig(value, places):
+    """Rounds to significant figures (the predictions are of order 1e-6)."""
+    return float("%.*g" % (places, value))
+
+def _covariance_factor(covariance):
+    """Returns L with L L^T = covariance. The covariance may be singular (fixed parameters)."""
+    scale = np.sqrt(np.diag(covariance))
+    safe_scale = np.where(scale > 0, scale, 1.0)
+    # Decompose the correlation matrix: the parameters differ by many orders of magnitude.
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance / np.outer(safe_scale, safe_scale))
+    return (scale[:, np.newaxis] * eigenvectors) * np.sqrt(np.clip(eigenvalues, 0.0, None))
+
+def split_normal(mode, lower, upper, size=None, random_state=None):
+    """Draws from split normal distributions: half normals of width ``lower`` below the mode and 
+    ``upper`` above it, weighted so that the density is continuous at the mode.
+    
+    Arguments:
+    :param mode: mode(s) of the distribution.
+    :param lower: standard deviation(s) below the mode.
+    :param upper: standard deviation(s) above the mode.
+    :param size: output shape; mode, lower and upper broadcast along its last axis.
+    :param random_state: numpy.random.RandomState to draw from (the global one if None).
+    :returns: the draws.
+    :rtype: numpy.ndarray
+    """
+    if random_state is None:
+        random_state = np.random.mtrand._rand
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+    magnitude = np.abs(random_state.standard_normal(size))
+    above = random_state.random_sample(size) * (lower + upper) < upper
+    return mode + magnitude * np.where(above, upper, -lower)
+
+def _draw_parameters(model, factor, seed, chunk_index, n_draws):
+    """Parameter draws (n_draws, n_parameters) for one chunk."""
+    state = np.random.RandomState([seed, chunk_index])
+    draws = model.values + state.standard_normal((n_draws, len(model.values))).dot(factor.T)
+    if len(model._asymmetric_index):
+        index = model._asymmetric_index
+        draws[:, index] = split_normal(model.values[index], model._asymmetric_lower, \
+                                       model._asymmetric_upper, (n_draws, len(index)), state)
+    return draws
+
+def _samples_per_chunk(n_sightlines, chunk_size, bins):
+    """Draws per chunk: enough that each histogram update covers more values than bins."""
+    return max(2 * (bins + 2), int(chunk_size) // max(1, n_sightlines))
+
+def _monte_carlo_block(model, draw, sightlines, sightline_terms, n_samples, samples_per_chunk, \
+                       chunk_size, bins, nominal, error):
+    """Accumulates the draws for one block of sightlines.
+    
+    draw(chunk_index, n_draws) returns the parameter draws of a chunk. Returns the sums of the
+    offsets from nominal and of their squares, the histogram counts (with an underflow and an
+    overflow bin) and the histogram range.
+    """
+    n_sightlines = len(sightlines)
+    total = np.zeros(n_sightlines)
+    total_squares = np.zeros(n_sightlines)
+    counts = np.zeros((n_sightlines, bins + 2), dtype=np.int64)
+    low = np.zeros(n_sightlines)
+    width = np.ones(n_sightlines)
+    block_size = max(1, int(chunk_size) // samples_per_chunk)
+    for chunk_index, first in enumerate(range(0, n_samples, samples_per_chunk)):
+        draws = draw(chunk_index, min(samples_per_chunk, n_samples - first))
+        for start in range(0, n_sightlines, block_size):
+            stop = min(start + block_size, n_sightlines)
+            values = model.sample(draws, sightlines[start:stop], *[t[start:stop] for t in sightline_terms])
+            values -= nominal[start:stop]
+            if chunk_index == 0:
+                # The histogram covers the first chunk with a wide margin, and at least +/- 6 sigma.
+                spread = values.max(axis=0) - values.min(axis=0)
+                block_low = np.minimum(values.min(axis=0) - 0.5 * spread, -6.0 * error[start:stop])
+                block_high = np.maximum(values.max(axis=0) + 0.5 * spread, 6.0 * error[start:stop])
+                low[start:stop] = block_low
+                width[start:stop] = np.maximum(block_high - block_low, 1e-300) / bins
+            total[start:stop] += values.sum(axis=0)
+            total_squares[start:stop] += np.einsum('ij,ij->j', values, values)
+            scaled = values - low[start:stop]
+            scaled *= 1.0 / width[start:stop]
+            np.clip(scaled, -1.0, bins, out=scaled)
+            # sightlines without a prediction (NaN, e.g. a redshift that is not positive) underflow
+            undefined = np.isnan(low[start:stop])
+            if undefined.any():
+                scaled[:, undefined] = -1.0
+            # floor, shifted so that the underflow bin is 0
+            index = np.floor(scaled).astype(np.int64) + 1
+            index += np.arange(stop - start, dtype=np.int64) * (bins + 2)
+            counts[start:stop] += np.bincount(index.ravel(), minlength=(stop - start) * (bins + 2)) \
+                .reshape(stop - start, bins + 2)
+    return total, total_squares, counts, low, width
+
+def _histogram_percentiles(counts, low, width, levels):
+    """Interpolated percentiles of per-row histograms (first and last bins are under/overflow)."""
+    bins = counts.shape[1] - 2
+    rows = np.arange(counts.shape[0])
+    cumulative = np.cumsum(counts, axis=1)
+    n_total = cumulative[:, -1].astype(np.float64)
+    result = np.empty((len(levels), counts.shape[0]))
+    for i, level in enumerate(levels):
+        target = level / 100.0 * n_total
+        index = np.minimum((cumulative < target[:, np.newaxis]).sum(axis=1), bins + 1)
+        inside = counts[rows, index]
+        before = cumulative[rows, index] - inside
+        fraction = np.where(inside > 0, (target - before) / np.maximum(inside, 1), 0.5)
+        result[i] = low + np.clip(index - 1 + fraction, 0.0, bins) * width
+    return result
+
+def _monte_carlo_result(levels, parts, nominal, error, n_samples, seed):
+    """Combines the accumulated sums and histograms into a MonteCarloResult."""
+    total, total_squares, counts, low, width = parts
+    mean_offset = total / n_samples
+    variance = (total_squares / n_samples - mean_offset ** 2) * n_samples / max(n_samples - 1, 1)
+    outside = (counts[:, 0] + counts[:, -1]) / float(n_samples)
+    return MonteCarloResult(levels, \
+                            nominal + _histogram_percentiles(counts, low, width, levels), \
+                            nominal + mean_offset, \
+                            np.sqrt(np.maximum(variance, 0.0)), \
+                            nominal, error, n_samples, seed, outside)
+
+def _monte_carlo_setup(model, right_ascension, declination, sightline_terms, seed, chunk_size, bins, subset=None):
+    """Sightline unit vectors, broadcast sightline terms, linear reference, seed and bin count."""
+    rows = _subset(subset, right_ascension, declination, *sightline_terms)
+    right_ascension, declination, sightline_terms = rows[0], rows[1], rows[2:]
+    alpha, delta = _radians(right_ascension, declination)
+    alpha = np.atleast_1d(np.asarray(alpha, dtype=np.float64))
+    delta = np.atleast_1d(np.asarray(delta, dtype=np.float64))
+    sightlines = _unit_vector(alpha, delta)
+    terms = [np.broadcast_to(np.asarray(t, dtype=np.float64), alpha.shape) for t in sightline_terms]
+    nominal, error = model.evaluate(alpha, delta, *terms)
+    if seed is None:
+        seed = np.random.randint(2 ** 31 - 1)
+    if bins is None:
+        bins = int(np.clip(MC_HISTOGRAM_SIZE // len(alpha), 64, 1024))
+    return sightlines, terms, nominal, error, int(seed), _samples_per_chunk(len(alpha), chunk_size, bins), bins
+
+def monte_carlo(model, \
+                right_ascension, \
+                declination, \
+                sightline_terms=(), \
+                n_samples=100000, \
+                seed=None, \
+                percentiles=MC_PERCENTILES, \
+                chunk_size=MC_CHUNK_SIZE, \
+                bins=None, \
+                subset=None):
+    """Monte Carlo predictions of a model for many sightlines.
+    
+    The parameters are drawn from a multivariate normal with the model's nominal values and
+    covariance, so correlated parameters are sampled as such. Parameters listed in the model's
+    asymmetric_errors are drawn independently from split normal distributions instead; the
+    asymmetric interval of each prediction is then read off e.g. the 15.865 and 84.135 percentiles.
+    
+    Arguments:
+    :param model: model to sample (:class:`DipoleModel`, :class:`ZDipoleModel` or :class:`RDipoleModel`).
+    :param right_ascension: right ascensions in radians, or sexagesimal strings.
+    :param declination: declinations in radians, or sexagesimal strings.
+    :param sightline_terms: per sightline terms of the model (z_redshift or radial_distance).
+    :type sightline_terms: tuple
+    :param n_samples: number of parameter draws.
+    :param seed: seed for the random draws (a random one is picked, and recorded, if None).
+    :param percentiles: percentile levels to report (in percent).
+    :param chunk_size: number of values (draws x sightlines) held in memory at once.
+    :param bins: histogram bins per sightline used for the percentiles (automatic if None).
+    :param subset: indices or boolean mask of the sightlines to sample (default: all).
+    :returns: percentiles, mean and standard deviation next to the linear propagation.
+    :rtype: MonteCarloResult
+    
+    Examples:
+    
+    >>> result = dipole_error.monte_carlo(dipole_error.DipoleModel(), ra, dec, n_samples=10**6, seed=1)
+    >>> result = dipole_error.monte_carlo(dipole_error.ZDipoleModel(), ra, dec, (z,), seed=1)
+    >>> result = dipole_error.monte_carlo(dipole_error.RDipoleModel(), ra, dec, (distance,), seed=1)
+    >>> model = dipole_error.DipoleModel(asymmetric_errors=dipole_error.DIPOLE_ASYMMETRIC_ERRORS)
+    >>> result = dipole_error.monte_carlo(model, ra, dec, seed=1)
+    >>> lower, upper = result.nominal - result.percentile(15.865), result.percentile(84.135) - result.nominal
+    """
+    sightlines, terms, nominal, error, seed, samples_per_chunk, bins = \
+        _monte_carlo_setup(model, right_ascension, declination, sightline_terms, seed, chunk_size, bins, subset)
+    factor = _covariance_factor(model._symmetric_covariance)
+    draw = lambda chunk_index, n_draws: _draw_parameters(model, factor, seed, chunk_index, n_draws)
+    parts = _monte_carlo_block(model, draw, sightlines, terms, n_samples, samples_per_chunk, \
+                               chunk_size, bins, nominal, error)
+    return _monte_carlo_result(percentiles, parts, nominal, error, n_samples, seed)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""Fits the dipole and monopole model (eq. 15 in King et al. 2012) to a catalog of measurements.
+
+Written in Cartesian components, A cos(theta) + m = D . n + m, where n is the unit vector of the
+sightline and D = A times the unit vector of the dipole, the model is linear in (D_x, D_y, D_z, m).
+The weighted least-squares fit is then the solution of the 4 x 4 normal equations
+
+    (X^T W X) p = X^T W y,    X = [n_x, n_y, n_z, 1],    W = diag(1 / error^2),
+
+and (X^T W X)^-1 is the covariance of p. The fitted RA, DEC, amplitude and monopole are returned as
+correlated ufloats, which can be passed straight to :func:`dipole_error.dipole_monopole`.
+
+The z-dependent dipole (eq. 18), A z^beta cos(theta) + m, is linear in the same way for a fixed
+beta: the dipole columns of X are multiplied by z^beta.
+
+The sums X^T W X, X^T W y and y^T W y are all the fit needs. A DipoleAccumulator keeps them, so
+measurements can be added (or removed) batch by batch and accumulators built on different
+machines merged, and the fit is a 4 x 4 solve whatever the size of the catalog.
+
+Examples:
+
+>>> fit = dipole_fit.fit_dipole(right_ascension, declination, da_a, da_a_error)
+>>> fit.dipole_ra, fit.dipole_dec, fit.amplitude, fit.monopole
+>>> dipole_error.dipole_monopole(qso_ra, qso_dec, *fit.parameters())
+>>> accumulator = dipole_fit.DipoleAccumulator(beta=0.46)
+>>> accumulator.add(right_ascension, declination, da_a, da_a_error, z_redshift)
+>>> accumulator.fit().model()
+"""
+import numpy as np
+import uncertainties
+from uncertainties import umath
+
+import dipole_error
+
+# Number of sightlines added to the normal equations at once.
+FIT_CHUNK_SIZE = 2 ** 18
+
+def design_matrix(right_ascension, declination, scale=None):
+    """Rows [n_x, n_y, n_z, 1] for positions in radians; the dipole columns are multiplied by
+    scale (z^beta for eq. 18) if given."""
+    unit_vectors = dipole_error._unit_vector(right_ascension, declination)
+    if scale is not None:
+        unit_vectors = unit_vectors * np.asarray(scale, dtype=np.float64)[..., np.newaxis]
+    return np.concatenate((unit_vectors, np.ones(unit_vectors.shape[:-1] + (1,))), axis=-1)
+
+def _fit_columns(right_ascension, declination, values, errors, z_redshift=None, beta=None, subset=None):
+    """Checks and broadcasts the fit inputs; returns RA and DEC in radians, values, errors and the
+    scale of the dipole columns (None for eq. 15)."""
+    if (beta is None) != (z_redshift is None):
+        raise dipole_error.DipoleError("the eq. 18 fit needs both z_redshift and beta")
+    right_ascension, declination, values, errors, z_redshift = \
+        dipole_error._subset(subset, right_ascension, declination, values, errors, z_redshift)
+    right_ascension, declination = dipole_error._radians(right_ascension, declination)
+    columns = [right_ascension, declination, values, errors] + ([] if z_redshift is None else [z_redshift])
+    columns = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in columns])
+    if np.any(columns[3] <= 0):
+        raise dipole_error.NegativeError('errors must be positive')
+    return tuple(columns[:4]) + (None if beta is None else columns[4] ** float(beta),)
+
+def normal_equations(right_ascension, \
+                     declination, \
+                     values, \
+                     errors, \
+                     z_redshift=None, \
+                     beta=None, \
+                     chunk_size=FIT_CHUNK_SIZE, \
+                     subset=None):
+    """Weighted normal equations of the eq. 15 fit, or of eq. 18 if beta is given.
+
+    :param subset: indices or boolean mask of the measurements to use (default: all).
+    :returns: X^T W X (4 x 4), X^T W y (4), y^T W y and the number of measurements.
+    :rtype: tuple
+    """
+    right_ascension, declination, values, errors, scale = \
+        _fit_columns(right_ascension, declination, values, errors, z_redshift, beta, subset)
+    matrix = np.zeros((4, 4))
+    vector = np.zeros(4)
+    weighted_squares = 0.0
+    for start in range(0, len(values), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        design = design_matrix(right_ascension[chunk], declination[chunk], None if scale is None else scale[chunk])
+        weights = errors[chunk] ** -2.0
+        weighted_design = design * weights[:, np.newaxis]
+        matrix += weighted_design.T.dot(design)
+        vector += weighted_design.T.dot(values[chunk])
+        weighted_squares += weights.dot(values[chunk] ** 2)
+    return matrix, vector, weighted_squares, len(values)
+
+def spherical_components(components, reference_ra=None):
+    """Converts fitted (D_x, D_y, D_z, monopole) rows to dipole RA (hours), DEC (degrees), amplitude
+    and monopole arrays. With reference_ra the RAs are taken within 12 hours of it (no wrap at 0h).
+    """
+    components = np.asarray(components, dtype=np.float64)
+    amplitude = np.sqrt((components[..., :3] ** 2).sum(axis=-1))
+    dipole_ra = np.mod(np.arctan2(components[..., 1], components[..., 0]) * (12.0 / np.pi), 24.0)
+    if reference_ra is not None:
+        dipole_ra = np.mod(dipole_ra - reference_ra + 12.0, 24.0) + reference_ra - 12.0
+    dipole_dec = np.degrees(np.arcsin(np.clip(components[..., 2] / np.where(amplitude > 0, amplitude, 1.0), -1.0, 1.0)))
+    return dipole_ra, dipole_dec, amplitude, components[..., 3]
+
+class DipoleFit(object):
+    """Result of a dipole and monopole fit.
+
+    Attributes:
+    components -- best-fit (D_x, D_y, D_z, monopole).
+    covariance -- their 4 x 4 covariance matrix.
+    chi2, n_measurements, dof -- chi-squared of the fit, number of measurements, degrees of freedom.
+    dipole_ra, dipole_dec, amplitude, monopole -- the fit as correlated ufloats, RA in hours and
+        DEC in degrees, as the arguments of :func:`dipole_error.dipole_monopole`.
+    beta -- the fixed power law exponent of an eq. 18 fit (amplitude is then the prefactor), or None.
+    """
+
+    def __init__(self, components, covariance, chi2, n_measurements, beta=None):
+        self.beta = beta
+        self.components = np.asarray(components, dtype=np.float64)
+        self.covariance = np.asarray(covariance, dtype=np.float64)
+        self.chi2 = float(chi2)
+        self.n_measurements = int(n_measurements)
+        self.dof = self.n_measurements - len(self.components)
+        d_x, d_y, d_z, monopole = uncertainties.correlated_values(list(self.components), self.covariance)
+        self.amplitude = umath.sqrt(d_x ** 2 + d_y ** 2 + d_z ** 2)
+        dipole_ra = umath.atan2(d_y, d_x) * (12.0 / np.pi)
+        self.dipole_ra = dipole_ra + 24.0 if dipole_ra.nominal_value < 0 else dipole_ra
+        self.dipole_dec = umath.asin(d_z / self.amplitude) * (180.0 / np.pi)
+        self.monopole = monopole
+
+    @classmethod
+    def from_normal_equations(cls, matrix, vector, weighted_squares, n_measurements, beta=None):
+        """Solves the normal equations (as from :func:`normal_equations`)."""
+        if not np.linalg.cond(matrix) < 1.0 / np.finfo(np.float64).eps:
+            raise dipole_error.DipoleError("the dipole is not constrained by these sightlines")
+        covariance = np.linalg.inv(matrix)
+        components = covariance.dot(vector)
+        # chi2 = y^T W y - p^T X^T W y at the solution
+        chi2 = weighted_squares - components.dot(vector)
+        return cls(components, covariance, max(chi2, 0.0), n_measurements, beta)
+
+    def parameters(self):
+        """The parameters of the fitted model, in the order of its parameter_names: (dipole_ra,
+        dipole_dec, amplitude, monopole), or (dipole_ra, dipole_dec, prefactor, beta, monopole)."""
+        if self.beta is None:
+            return self.dipole_ra, self.dipole_dec, self.amplitude, self.monopole
+        return self.dipole_ra, self.dipole_dec, self.amplitude, self.beta, self.monopole
+
+    def model(self):
+        """The fitted :class:`dipole_error.DipoleModel` (:class:`dipole_error.ZDipoleModel` for eq. 18)."""
+        if self.beta is None:
+            return dipole_error.DipoleModel(*self.parameters())
+        return dipole_error.ZDipoleModel(*self.parameters())
+
+    def __repr__(self):
+        return "DipoleFit(RA=%s h, DEC=%s deg, A=%s, m=%s, chi2/dof=%.4g/%d)" % \
+               (self.dipole_ra, self.dipole_dec, self.amplitude, self.monopole, self.chi2, self.dof)
+
+def fit_dipole(right_ascension, \
+               declination, \
+               values, \
+               errors, \
+               z_redshift=None, \
+               beta=None, \
+               chunk_size=FIT_CHUNK_SIZE, \
+               subset=None):
+    """Weighted least-squares fit of eq. 15, or of eq. 18 with a fixed beta, to measurements of da/a.
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :type right_ascension: numpy.ndarray
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :type declination: numpy.ndarray
+    :param values: measured da/a.
+    :type values: numpy.ndarray
+    :param errors: 1-sigma errors of the measurements (e.g. statistical and systematic in quadrature).
+    :type errors: numpy.ndarray
+    :param z_redshift: redshifts of the absorbers (eq. 18 only).
+    :type z_redshift: numpy.ndarray
+    :param beta: power law exponent of eq. 18, held fixed; None fits eq. 15.
+    :type beta: number
+    :param chunk_size: number of sightlines processed at once.
+    :type chunk_size: int
+    :param subset: indices or boolean mask of the measurements to fit (default: all).
+    :returns: the fit.
+    :rtype: DipoleFit
+    """
+    return DipoleFit.from_normal_equations(*normal_equations(right_ascension, declination, values, errors, \
+                                                             z_redshift, beta, chunk_size, subset), beta=beta)
+
+class DipoleAccumulator(object):
+    """Running normal equations of a dipole fit, for catalogs that grow (or shrink) batch by batch.
+
+    Arguments:
+    :param beta: power law exponent of eq. 18, held fixed; None (the default) fits eq. 15.
+    :type beta: number
+
+    Accumulators with the same beta can be merged with merge() or +, e.g. after building them on
+    separate processes; they pickle as plain arrays.
+    """
+
+    def __init__(self, beta=None):
+        self.beta = beta
+        self.matrix = np.zeros((4, 4))
+        self.vector = np.zeros(4)
+        self.weighted_squares = 0.0
+        self.n_measurements = 0
+
+    def _update(self, sign, right_ascension, declination, values, errors, z_redshift):
+        matrix, vector, weighted_squares, n_measurements = \
+            normal_equations(right_ascension, declination, values, errors, z_redshift, self.beta)
+        self.matrix += sign * matrix
+        self.vector += sign * vector
+        self.weighted_squares += sign * weighted_squares
+        self.n_measurements += sign * n_measurements
+        return self
+
+    def add(self, right_ascension, declination, values, errors, z_redshift=None):
+        """Adds a batch of measurements (arguments as :func:`fit_dipole`)."""
+        return self._update(1, right_ascension, declination, values, errors, z_redshift)
+
+    def remove(self, right_ascension, declination, values, errors, z_redshift=None):
+        """Removes a batch of measurements that was added before."""
+        if self.n_measurements < len(np.atleast_1d(values)):
+            raise dipole_error.DipoleError("cannot remove more measurements than were added")
+        return self._update(-1, right_ascension, declination, values, errors, z_redshift)
+
+    def merge(self, other):
+        """Adds the sums of another accumulator to this one."""
+        if other.beta != self.beta:
+            raise dipole_error.DipoleError("cannot merge fits with beta %r and %r" % (self.beta, other.beta))
+        self.matrix += other.matrix
+        self.vector += other.vector
+        self.weighted_squares += other.weighted_squares
+        self.n_measurements += other.n_measurements
+        return self
+
+    def __add__(self, other):
+        return DipoleAccumulator(self.beta).merge(self).merge(other)
+
+    def fit(self):
+        """The current best fit.
+
+        :rtype: DipoleFit
+        """
+        return DipoleFit.from_normal_equations(self.matrix, self.vector, self.weighted_squares, \
+                                               self.n_measurements, self.beta)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""Spatial index of a sightline catalog for cone, annulus and nearest-neighbour queries.
+
+The sightlines are binned on the equal-area grid of dipole_skymap and stored pixel by pixel
+(compressed sparse rows: the sightlines sorted by pixel and the offset of every pixel). A cone
+query only visits the rings that overlap the cone and, in each ring, the range of RA pixels the
+cone can reach; the exact separations are then computed for those candidates only.
+
+Query results are arrays of sightline indices (in catalog order), which the array functions,
+model methods and Monte Carlo of dipole_error, the dipole_parallel functions and dipole_fit take
+as ``subset=``, so that only those rows are parsed and evaluated.
+
+Examples:
+
+>>> index = dipole_index.SightlineIndex(right_ascension, declination)
+>>> near_axis = index.cone(dipole_ra, dipole_dec, numpy.radians(30), antipodal=True)
+>>> dipole_error.dipole_monopole_array(right_ascension, declination, subset=near_axis)
+>>> neighbours, separations = index.nearest(query_ra, query_dec, k=5)
+"""
+import numpy as np
+
+import dipole_error
+import dipole_skymap
+
+# Average number of sightlines per pixel of the index.
+SIGHTLINES_PER_PIXEL = 4
+# Nearest-neighbour queries are handled in groups of about QUERIES_PER_GROUP, over areas holding
+# at most about SIGHTLINES_PER_GROUP sightlines (so the shared candidate sets stay small).
+QUERIES_PER_GROUP = 16
+SIGHTLINES_PER_GROUP = 1024
+
+def _concatenated_ranges(starts, stops):
+    """np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)]) without the loop."""
+    lengths = stops - starts
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+
+class SightlineIndex(object):
+    """Pixel index over sightlines given in radians (or sexagesimal strings).
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines.
+    :param declination: declinations of the sightlines.
+    :param n_dec: number of rings of the grid (default: about SIGHTLINES_PER_PIXEL per pixel).
+    :type n_dec: int
+    """
+
+    def __init__(self, right_ascension, declination, n_dec=None):
+        right_ascension, declination = dipole_error._radians(right_ascension, declination)
+        right_ascension = np.atleast_1d(np.asarray(right_ascension, dtype=np.float64))
+        declination = np.atleast_1d(np.asarray(declination, dtype=np.float64))
+        self.vectors = dipole_error._unit_vector(right_ascension, declination)
+        if n_dec is None:
+            n_dec, _ = dipole_skymap.grid_shape(max(1, len(self.vectors) // SIGHTLINES_PER_PIXEL))
+        self.n_dec, self.n_ra = n_dec, 2 * n_dec
+        pixels = dipole_skymap.pixel_index(right_ascension, declination, self.n_dec, self.n_ra)
+        self.order = np.argsort(pixels, kind="mergesort")
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(pixels, minlength=self.n_dec * self.n_ra))))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _ring_ranges(self, center, radius):
+        """Rings, and first and last RA pixel in each, that may hold sightlines within radius."""
+        full = np.arange(self.n_dec), np.zeros(self.n_dec, dtype=np.intp), np.full(self.n_dec, self.n_ra - 1)
+        if radius >= np.pi:
+            return full
+        center_dec = np.arcsin(np.clip(center[2], -1.0, 1.0))
+        center_ra = np.mod(np.arctan2(center[1], center[0]), 2.0 * np.pi)
+        low = np.sin(max(center_dec - radius, -np.pi / 2))
+        high = np.sin(min(center_dec + radius, np.pi / 2))
+        first_ring = max(0, int(np.floor((low + 1.0) * self.n_dec / 2.0)))
+        last_ring = min(self.n_dec - 1, int(np.floor((high + 1.0) * self.n_dec / 2.0)))
+        rings = np.arange(first_ring, last_ring + 1)
+        if center_dec + radius >= np.pi / 2 or center_dec - radius <= -np.pi / 2:
+            return rings, full[1][rings], full[2][rings]
+        # widest RA half-width of the cap within each ring: at the ring edges, or where
+        # sin(dec) = sin(center_dec) / cos(radius)
+        lower_edge, upper_edge = 2.0 * rings / self.n_dec - 1.0, 2.0 * (rings + 1) / self.n_dec - 1.0
+        turning = np.sin(center_dec) / np.cos(radius)
+        sin_dec = np.clip(np.vstack((lower_edge, upper_edge, \
+                                     np.where((lower_edge < turning) & (turning < upper_edge), turning, lower_edge))), \
+                          -1.0, 1.0)
+        cos_dec = np.sqrt(1.0 - sin_dec ** 2)
+        argument = (np.cos(radius) - sin_dec * np.sin(center_dec)) / np.maximum(cos_dec * np.cos(center_dec), 1e-300)
+        half_width = np.arccos(np.clip(argument, -1.0, 1.0)).max(axis=0)
+        first = np.floor((center_ra - half_width) * self.n_ra / (2.0 * np.pi)).astype(np.intp)
+        last = np.floor((center_ra + half_width) * self.n_ra / (2.0 * np.pi)).astype(np.intp)
+        whole = np.any(argument <= -1.0, axis=0) | (half_width >= np.pi) | (last - first + 1 >= self.n_ra)
+        first[whole], last[whole] = 0, self.n_ra - 1
+        return rings, first, last
+
+    def _candidates(self, center, radius):
+        """Sightlines in the pixels a cone can reach."""
+        rings, first, last = self._ring_ranges(center, radius)
+        # RA pixel ranges may wrap around 0h: split those into [first, n_ra) and [0, last]
+        wraps = (first < 0) | (last >= self.n_ra)
+        base = np.concatenate((rings, rings[wraps])) * self.n_ra
+        starts = np.concatenate((np.where(wraps, first % self.n_ra, first), np.zeros(wraps.sum(), dtype=np.intp)))
+        stops = np.concatenate((np.where(wraps, self.n_ra - 1, last), last[wraps] % self.n_ra))
+        return self.order[_concatenated_ranges(self.offsets[base + starts], self.offsets[base + stops + 1])]
+
+    def annulus(self, center_ra, center_dec, inner_radius, outer_radius, antipodal=False):
+        """Sightlines with inner_radius <= separation <= outer_radius from a position.
+
+        Arguments:
+        :param center_ra: RA of the centre in radians (or a sexagesimal string, in hours).
+        :param center_dec: DEC of the centre in radians (or a sexagesimal string, in degrees).
+        :param inner_radius: inner radius in radians.
+        :param outer_radius: outer radius in radians.
+        :param antipodal: also include the same annulus around the antipode (e.g. around the
+            dipole and the anti-dipole).
+        :returns: sorted indices of the sightlines.
+        :rtype: numpy.ndarray
+        """
+        center = dipole_error._unit_vector(*dipole_error.position_radians(center_ra, center_dec))
+        found = []
+        for direction in (center, -center) if antipodal else (center,):
+            candidates = self._candidates(direction, outer_radius)
+            cos_theta = self.vectors[candidates].dot(direction)
+            found.append(candidates[(cos_theta >= np.cos(outer_radius)) & (cos_theta <= np.cos(inner_radius))])
+        return np.unique(np.concatenate(found))
+
+    def cone(self, center_ra, center_dec, radius, antipodal=False):
+        """Sightlines within radius (radians) of a position; see annulus()."""
+        return self.annulus(center_ra, center_dec, 0.0, radius, antipodal)
+
+    def nearest(self, right_ascension, declination, k=1):
+        """The k nearest sightlines to each of a set of positions.
+
+        The queries are handled in groups of nearby positions (pixels of a grid with about
+        QUERIES_PER_GROUP queries or at most SIGHTLINES_PER_GROUP sightlines per pixel, and no
+        finer than the index): the queries of a group share one set of candidates (a cap around
+        them, widened by their spread) and one matrix of separations, and only those without k
+        neighbours yet are retried with a doubled cap.
+
+        Arguments:
+        :param right_ascension: RAs of the query positions in radians (or sexagesimal strings).
+        :param declination: DECs of the query positions in radians (or sexagesimal strings).
+        :param k: number of neighbours.
+        :type k: int
+        :returns: indices of the neighbours and their separations in radians, nearest first.
+        :rtype: tuple of numpy.ndarray (n_queries, k)
+        """
+        if not 0 < k <= len(self):
+            raise dipole_error.DipoleError("k must be between 1 and the number of sightlines (%d)" % len(self))
+        right_ascension, declination = dipole_error._radians(right_ascension, declination)
+        right_ascension = np.atleast_1d(np.asarray(right_ascension, dtype=np.float64))
+        declination = np.atleast_1d(np.asarray(declination, dtype=np.float64))
+        queries = dipole_error._unit_vector(right_ascension, declination)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        cos_nearest = np.empty((len(queries), k))
+        # start with a cap expected to hold about 2k sightlines, and double it until it holds k
+        start_radius = np.arccos(max(-1.0, 1.0 - 4.0 * k / len(self)))
+        n_groups = max(len(queries) // QUERIES_PER_GROUP, len(self) // SIGHTLINES_PER_GROUP)
+        n_dec, n_ra = dipole_skymap.grid_shape(min(self.n_dec * self.n_ra, n_groups))
+        pixels = dipole_skymap.pixel_index(right_ascension, declination, n_dec, n_ra)
+        order = np.argsort(pixels, kind="mergesort")
+        bounds = np.concatenate(([0], np.nonzero(np.diff(pixels[order]))[0] + 1, [len(order)]))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            pending = order[first:last]
+            center = queries[pending].sum(axis=0)
+            center /= np.sqrt(center.dot(center))
+            spread = np.arccos(np.clip(queries[pending].dot(center).min(), -1.0, 1.0))
+            radius = start_radius
+            while len(pending):
+                # every sightline within radius of a query is within radius + spread of the center
+                reach = min(radius + spread, np.pi)
+                candidates = self._candidates(center, reach)
+                cos_theta = queries[pending].dot(self.vectors[candidates].T)
+                if reach < np.pi:
+                    cos_theta[cos_theta < np.cos(radius)] = -2.0
+                found = (cos_theta >= -1.0).sum(axis=1) >= k if reach < np.pi else np.ones(len(pending), dtype=bool)
+                if found.any():
+                    done = cos_theta[found]
+                    # the k largest cosines, nearest first (ties in candidate order)
+                    top = np.argpartition(-done, k - 1, axis=1)[:, :k] if k < done.shape[1] else \
+                          np.tile(np.arange(done.shape[1]), (len(done), 1))
+                    top_cos = np.take_along_axis(done, top, axis=1)
+                    ranked = np.argsort(-top_cos, axis=1, kind="mergesort")
+                    indices[pending[found]] = candidates[np.take_along_axis(top, ranked, axis=1)]
+                    cos_nearest[pending[found]] = np.take_along_axis(top_cos, ranked, axis=1)
+                pending = pending[~found]
+                radius = min(2.0 * radius, np.pi)
+        return indices, np.arccos(np.clip(cos_nearest, -1.0, 1.0))
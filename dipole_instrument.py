@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Opt-in instrumentation of the dipole_error hot paths: wall time, calls and rows per stage.
+
+The stages and the functions counted in them are
+
+    parse        parse_positions, position_radians (sexagesimal strings to radians)
+    grouping     _group_sightlines (rows sharing a sightline)
+    separation   _unit_vector, DipoleModel._project_vectors (cos(theta) and its derivatives)
+    model        the _model methods: model values and their derivatives
+    propagation  _quadratic_form, _linear_ufloat (J C J^T, or the ufloat of one prediction)
+    sampling     DipoleModel.sample (Monte Carlo draws)
+    wrap         the wrap_* helpers (uncertainties.wrap with closed-form derivatives)
+
+Rows are the number of sightlines (or draws times sightlines) a call handled; in the model stage
+they are the number of model evaluations, each of which gives the value and all its derivatives
+at once, so there are no hidden finite-difference evaluations to count.
+
+While an Instrumentation is active (as a context manager) these functions are replaced by timing
+wrappers; outside it the originals are in place, so disabled instrumentation costs nothing. Only
+the current process is instrumented, not dipole_parallel workers. Times are exclusive: a stage does
+not include the time of the instrumented functions it calls.
+
+Examples:
+
+>>> with dipole_instrument.Instrumentation() as instrumentation:
+...     dipole_error.evaluate_models(right_ascension, declination, z_redshift, radial_distance)
+>>> summary = instrumentation.summary()
+>>> summary['parse']['seconds'], summary['model']['rows'] / float(summary['propagation']['rows'])
+>>> pstats.Stats(instrumentation).sort_stats('tottime').print_stats()
+>>> instrumentation.dump_stats("run.prof")     # readable by pstats, snakeviz, ...
+"""
+import collections
+import marshal
+import timeit
+
+import numpy as np
+
+import dipole_error
+
+# Rows handled by a call, from its arguments.
+def _rows_first(args):
+    return np.size(args[0])
+
+def _rows_vectors(args):
+    return np.size(args[1]) // 3
+
+def _rows_model(args):
+    return np.size(args[1])
+
+def _rows_jacobian(args):
+    return np.size(args[0]) // np.shape(args[0])[-1] if np.ndim(args[0]) else 1
+
+def _rows_sample(args):
+    return len(args[1]) * len(args[2])
+
+# stage: (owner, attribute, rows) of the functions counted in it.
+STAGES = collections.OrderedDict((
+    ('parse', [(dipole_error, 'parse_positions', _rows_first), (dipole_error, 'position_radians', lambda args: 1)]),
+    ('grouping', [(dipole_error, '_group_sightlines', _rows_first)]),
+    ('separation', [(dipole_error, '_unit_vector', _rows_first), \
+                    (dipole_error.DipoleModel, '_project_vectors', _rows_vectors)]),
+    ('model', [(dipole_error.DipoleModel, '_model', _rows_model), (dipole_error.ZDipoleModel, '_model', _rows_model), \
+               (dipole_error.RDipoleModel, '_model', _rows_model)]),
+    ('propagation', [(dipole_error, '_quadratic_form', _rows_jacobian), \
+                     (dipole_error, '_linear_ufloat', lambda args: 1)]),
+    ('sampling', [(dipole_error.DipoleModel, 'sample', _rows_sample)]),
+    ('wrap', [(dipole_error._LazyWrap, '__call__', lambda args: 1)]),
+))
+
+def _label(owner, name, function):
+    """(file, line, name) of a function, as cProfile labels them."""
+    code = function.__code__
+    qualified = name if owner is dipole_error else "%s.%s" % (owner.__name__, name)
+    return code.co_filename, code.co_firstlineno, qualified
+
+class Instrumentation(object):
+    """Records calls, rows and time of the dipole_error stages while active.
+
+    Use as a context manager (or call start() and stop()); only one can be active at a time.
+    Recordings add up over several activations.
+    """
+    _active = None
+
+    def __init__(self):
+        self._originals = []
+        self._stack = []
+        self.records = {}
+        self.stages = {}
+        self.stats = {}
+
+    def _wrap(self, stage, label, function, rows):
+        records, stack = self.records, self._stack
+        timer = timeit.default_timer
+        self.stages[label] = stage
+
+        def instrumented(*args, **kwargs):
+            caller = stack[-1][0] if stack else None
+            stack.append([label, 0.0])
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                subcalls = stack.pop()[1]
+                if stack:
+                    stack[-1][1] += elapsed
+                record = records.get(label)
+                if record is None:
+                    record = records[label] = [0, 0, 0.0, 0.0, {}]
+                record[0] += 1
+                record[1] += rows(args)
+                record[2] += elapsed - subcalls
+                record[3] += elapsed
+                if caller is not None:
+                    calls = record[4].setdefault(caller, [0, 0.0, 0.0])
+                    calls[0] += 1
+                    calls[1] += elapsed - subcalls
+                    calls[2] += elapsed
+        instrumented.__name__ = function.__name__
+        instrumented.__doc__ = function.__doc__
+        return instrumented
+
+    def start(self):
+        if Instrumentation._active is not None:
+            raise dipole_error.DipoleError("another Instrumentation is already active")
+        Instrumentation._active = self
+        for stage, targets in STAGES.items():
+            for owner, name, rows in targets:
+                original = owner.__dict__[name]
+                self._originals.append((owner, name, original))
+                setattr(owner, name, self._wrap(stage, _label(owner, name, original), original, rows))
+        return self
+
+    def stop(self):
+        for owner, name, original in reversed(self._originals):
+            setattr(owner, name, original)
+        self._originals = []
+        Instrumentation._active = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def summary(self):
+        """Totals by stage, with the functions of each stage.
+
+        :returns: {stage: {'calls', 'rows', 'seconds', 'functions': {name: {'calls', 'rows', 'seconds'}}}}
+        :rtype: collections.OrderedDict
+        """
+        result = collections.OrderedDict((stage, dict(calls=0, rows=0, seconds=0.0, functions={})) for stage in STAGES)
+        for label, (calls, rows, seconds, _, _) in sorted(self.records.items()):
+            stage = result[self.stages[label]]
+            stage['calls'] += calls
+            stage['rows'] += rows
+            stage['seconds'] += seconds
+            stage['functions'][label[2]] = dict(calls=calls, rows=rows, seconds=seconds)
+        return result
+
+    def create_stats(self):
+        """Fills self.stats in the cProfile format, so that pstats.Stats(instrumentation) works."""
+        self.stats = dict((label, (calls, calls, own, total, \
+                                   dict((caller, (n, n, caller_own, caller_total)) \
+                                        for caller, (n, caller_own, caller_total) in callers.items()))) \
+                          for label, (calls, _, own, total, callers) in self.records.items())
+
+    def dump_stats(self, filename):
+        """Writes the recordings as a cProfile/pstats file."""
+        with open(filename, "wb") as handle:
+            self.create_stats()
+            marshal.dump(self.stats, handle)
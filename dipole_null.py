@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""Isotropy null test of the dipole fit (eq. 15): how often does a sky without a dipole give a
+fitted amplitude as large as the observed one?
+
+Each realization keeps the sightline positions and randomly permutes the measurements (value and
+error together) among them, which removes any relation between da/a and direction while keeping
+the sky coverage and the error distribution. With the design rows x_i = [n_x, n_y, n_z, 1] and
+their products x_i x_i^T computed once, the normal equations of a block of realizations are two
+matrix products of the permuted weights with these arrays.
+
+Note that rotating the sky does not give a null distribution: a rigid rotation of all positions
+rotates the fitted dipole vector with them and leaves its amplitude unchanged.
+
+Realizations are processed in blocks; block i is drawn from RandomState((seed, i)). With a
+checkpoint file the amplitudes are saved every checkpoint_blocks blocks, and a run with the same
+data, seed and chunk size continues from there.
+
+Examples:
+
+>>> result = dipole_null.null_test(right_ascension, declination, da_a, da_a_error, n_realizations=100000,
+...                                seed=1, checkpoint="null.npz", workers=8)
+>>> result.p_value
+"""
+import hashlib
+import os
+
+import numpy as np
+
+import dipole_error
+import dipole_fit
+import dipole_parallel
+import dipole_resample
+
+# Number of elements of the (realizations x sightlines) permutation matrix per block.
+NULL_CHUNK_SIZE = 2 ** 22
+# Blocks between checkpoints.
+CHECKPOINT_BLOCKS = 64
+
+class NullTestResult(object):
+    """Amplitudes of the null realizations next to the observed fit.
+
+    Attributes:
+    fit -- the fit to the measurements (dipole_fit.DipoleFit).
+    observed -- the observed amplitude.
+    amplitudes -- fitted amplitudes of the null realizations.
+    n_exceeding -- number of realizations with an amplitude at least the observed one.
+    p_value -- (n_exceeding + 1) / (n_realizations + 1).
+    seed -- seed of the run.
+    """
+
+    def __init__(self, fit, amplitudes, seed):
+        self.fit = fit
+        self.observed = fit.amplitude.nominal_value
+        self.amplitudes = amplitudes
+        self.n_exceeding = int((amplitudes >= self.observed).sum())
+        self.p_value = (self.n_exceeding + 1.0) / (len(amplitudes) + 1.0)
+        self.seed = seed
+
+def _null_block(design, products, weights, weighted_values, seed, block_index, n_realizations):
+    """Fitted amplitudes of n_realizations permuted skies."""
+    random_state = np.random.RandomState([seed, block_index])
+    permutations = random_state.random_sample((n_realizations, len(design))).argsort(axis=1)
+    components = dipole_resample._solve(np.hstack((weights[permutations].dot(products), \
+                                                   weighted_values[permutations].dot(design))))
+    return np.sqrt((components[:, :3] ** 2).sum(axis=1))
+
+def _null_blocks(arrays, seed, n_realizations, block_size, first_block, last_block):
+    return np.concatenate([_null_block(*(tuple(arrays) + (seed, block, \
+                                                          min(block_size, n_realizations - block * block_size)))) \
+                           for block in range(first_block, last_block)])
+
+def _null_task(directory, layout, seed, n_realizations, block_size, first_block, last_block, offset):
+    arrays = [dipole_parallel.open_shared(directory, layout, name) \
+              for name in ("design", "products", "weights", "weighted_values")]
+    amplitudes = _null_blocks(arrays, seed, n_realizations, block_size, first_block, last_block)
+    output = dipole_parallel.open_shared(directory, layout, "amplitudes", mode="r+")
+    start = first_block * block_size - offset
+    output[start:start + len(amplitudes)] = amplitudes
+    output.flush()
+
+def _fingerprint(arrays, seed, n_sightlines, block_size):
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tostring())
+    digest.update(repr((seed, n_sightlines, block_size)))
+    return digest.hexdigest()
+
+def _load_checkpoint(checkpoint, fingerprint):
+    """Amplitudes saved by an earlier run with the same data and settings."""
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return np.zeros(0)
+    with np.load(checkpoint) as saved:
+        if str(saved["fingerprint"]) != fingerprint:
+            raise dipole_error.DipoleError("checkpoint %s is from a different run" % checkpoint)
+        return saved["amplitudes"]
+
+def _save_checkpoint(checkpoint, fingerprint, amplitudes):
+    temporary = checkpoint + ".tmp"
+    with open(temporary, "wb") as handle:
+        np.savez(handle, fingerprint=np.array(fingerprint), amplitudes=amplitudes)
+    os.rename(temporary, checkpoint)
+
+def null_test(right_ascension, \
+              declination, \
+              values, \
+              errors, \
+              n_realizations=10000, \
+              seed=None, \
+              checkpoint=None, \
+              checkpoint_blocks=CHECKPOINT_BLOCKS, \
+              chunk_size=NULL_CHUNK_SIZE, \
+              workers=1, \
+              executor=None):
+    """Empirical p-value of the fitted dipole amplitude against scrambled skies.
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :param values: measured da/a.
+    :param errors: 1-sigma errors of the measurements.
+    :param n_realizations: number of null realizations.
+    :type n_realizations: int
+    :param seed: seed of the realizations (needed to resume from a checkpoint; random if None).
+    :type seed: int
+    :param checkpoint: .npz file the amplitudes are saved to and resumed from (None: no checkpoints).
+    :type checkpoint: string
+    :param checkpoint_blocks: blocks of realizations between checkpoints.
+    :type checkpoint_blocks: int
+    :param chunk_size: size of the permutation matrix of one block of realizations.
+    :type chunk_size: int
+    :param workers: number of worker processes (see dipole_parallel); 1 runs in this process.
+    :param executor: an existing concurrent.futures executor to reuse.
+    :returns: the null amplitudes and the p-value of the observed amplitude.
+    :rtype: NullTestResult
+    """
+    right_ascension, declination, values, errors, _ = \
+        dipole_fit._fit_columns(right_ascension, declination, values, errors)
+    fit = dipole_fit.fit_dipole(right_ascension, declination, values, errors)
+    design = dipole_fit.design_matrix(right_ascension, declination)
+    products = (design[:, :, np.newaxis] * design[:, np.newaxis, :]).reshape(-1, 16)
+    weights = errors ** -2.0
+    arrays = (design, products, weights, weights * values)
+    if seed is None:
+        if checkpoint is not None:
+            raise dipole_error.DipoleError("a checkpointed run needs a seed")
+        seed = np.random.randint(2 ** 31)
+    n_realizations = int(n_realizations)
+    block_size = max(1, int(chunk_size) // len(design))
+    n_blocks = -(-n_realizations // block_size)
+    fingerprint = _fingerprint(arrays[:1] + arrays[2:], seed, len(design), block_size)
+    amplitudes = [_load_checkpoint(checkpoint, fingerprint)[:n_realizations]]
+    done = len(amplitudes[0]) // block_size if len(amplitudes[0]) < n_realizations else n_blocks
+    amplitudes[0] = amplitudes[0][:done * block_size]
+    step = n_blocks if checkpoint is None else max(1, int(checkpoint_blocks))
+    shared = None
+    try:
+        if workers != 1 or executor is not None:
+            shared = dipole_parallel.SharedArrays()
+            for name, array in zip(("design", "products", "weights", "weighted_values"), arrays):
+                shared.create(name, array.shape, data=array)
+        for first in range(done, n_blocks, step):
+            last = min(first + step, n_blocks)
+            if shared is None:
+                new = _null_blocks(arrays, seed, n_realizations, block_size, first, last)
+            else:
+                new = shared.create("amplitudes", min(last * block_size, n_realizations) - first * block_size)
+                tasks = [(shared.directory, shared.layout, seed, n_realizations, block_size, \
+                          first + start, first + stop, first * block_size) \
+                         for start, stop in dipole_parallel._slices( \
+                             last - first, dipole_parallel.worker_count(workers) * dipole_parallel.TASKS_PER_WORKER)]
+                dipole_parallel._run(tasks, _null_task, workers, executor)
+                new = np.array(new)
+            amplitudes.append(new)
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, fingerprint, np.concatenate(amplitudes))
+    finally:
+        if shared is not None:
+            shared.close()
+    return NullTestResult(fit, np.concatenate(amplitudes), seed)
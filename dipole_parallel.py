@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Process-pool evaluation of the dipole models for large absorber catalogs.
+
+The sightline axis is split across a concurrent.futures process pool. Inputs and outputs live in
+memory-mapped NumPy buffers (in /dev/shm where available) that the workers open by path, so no
+array data is pickled per task; the model itself is written once next to the buffers.
+
+Monte Carlo runs give the same result, bit for bit, as dipole_error.monte_carlo with the same seed:
+every worker regenerates the same parameter draws (chunk i is always drawn from RandomState((seed, i)))
+and the tasks are cut on the same sightline blocks the serial run uses.
+
+Dependencies
+================
+Requires concurrent.futures (part of Python 3, the ''futures'' backport on Python 2).
+"""
+try:
+    from concurrent import futures
+except:
+    print """python package ''futures'' is required. Try running:
+    $ sudo pip install -U futures"""
+    raise ImportError
+import cPickle as pickle
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import dipole_error
+
+# Number of worker processes; None means one per CPU.
+WORKERS = None
+# Tasks per worker, so that uneven tasks still balance.
+TASKS_PER_WORKER = 4
+
+def worker_count(workers=None):
+    """Number of worker processes to use."""
+    if workers is None:
+        workers = WORKERS
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    return max(1, int(workers))
+
+# ==========================
+# = Shared-memory buffers =
+# ==========================
+
+def _shared_directory():
+    """/dev/shm is memory backed on Linux; elsewhere the system temporary directory is used."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+class SharedArrays(object):
+    """A set of named arrays in memory-mapped files that worker processes can open by path.
+
+    Use as a context manager; the files are removed on exit.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="dipole_error_", dir=_shared_directory())
+        self.layout = {}
+
+    def create(self, name, shape, dtype=np.float64, data=None):
+        """Creates (and optionally fills) a shared array."""
+        shape = tuple(int(x) for x in np.atleast_1d(shape))
+        self.layout[name] = (shape, np.dtype(dtype).str)
+        array = open_shared(self.directory, self.layout, name, mode="w+")
+        if data is not None:
+            array[...] = data
+        return array
+
+    def dump(self, name, obj):
+        """Stores a (small) object, such as the model, for the workers to load once."""
+        with open(os.path.join(self.directory, name + ".pickle"), "wb") as handle:
+            pickle.dump(obj, handle, pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_shared(directory, layout, name, mode="r"):
+    """Opens one array of a SharedArrays set (mode "r" or "r+" in the workers)."""
+    shape, dtype = layout[name]
+    if not np.prod(shape):
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(os.path.join(directory, name + ".dat"), dtype=dtype, mode=mode, shape=shape)
+
+_LOADED = {}
+
+def _load(directory, name):
+    """Loads an object stored with SharedArrays.dump, once per worker process."""
+    path = os.path.join(directory, name + ".pickle")
+    if path not in _LOADED:
+        if len(_LOADED) > 8:
+            _LOADED.clear()
+        with open(path, "rb") as handle:
+            _LOADED[path] = pickle.load(handle)
+    return _LOADED[path]
+
+def _slices(n_items, n_tasks, align=1):
+    """Splits range(n_items) into about n_tasks (start, stop) pairs whose boundaries are multiples of align."""
+    step = max(1, -(-n_items // max(1, n_tasks)))
+    step = -(-step // align) * align
+    return [(start, min(start + step, n_items)) for start in range(0, n_items, step)]
+
+def _run(tasks, function, workers, executor):
+    """Runs function(*task) for all tasks on the executor (or a new pool) and re-raises errors."""
+    if executor is None:
+        executor = futures.ProcessPoolExecutor(max_workers=worker_count(workers))
+        with executor:
+            return _run(tasks, function, workers, executor)
+    return [job.result() for job in [executor.submit(function, *task) for task in tasks]]
+
+# ======================
+# = Linear propagation =
+# ======================
+
+def _evaluate_task(directory, layout, n_terms, start, stop):
+    model = _load(directory, "model")
+    terms = [open_shared(directory, layout, "term%d" % i)[start:stop] for i in range(n_terms)]
+    nominal, error = model.evaluate(open_shared(directory, layout, "alpha")[start:stop], \
+                                    open_shared(directory, layout, "delta")[start:stop], *terms)
+    for name, values in (("nominal", nominal), ("error", error)):
+        output = open_shared(directory, layout, name, mode="r+")
+        output[start:stop] = values
+        output.flush()
+
+def parallel_evaluate(model, \
+                      right_ascension, \
+                      declination, \
+                      sightline_terms=(), \
+                      workers=None, \
+                      executor=None, \
+                      subset=None):
+    """Parallel version of model.evaluate over the sightline axis.
+
+    Arguments:
+    :param model: :class:`dipole_error.DipoleModel`, :class:`dipole_error.ZDipoleModel` or
+        :class:`dipole_error.RDipoleModel`.
+    :param right_ascension: right ascensions in radians, or sexagesimal strings.
+    :param declination: declinations in radians, or sexagesimal strings.
+    :param sightline_terms: per sightline terms of the model (z_redshift or radial_distance).
+    :type sightline_terms: tuple
+    :param workers: number of worker processes (default: WORKERS, or one per CPU).
+    :param executor: an existing concurrent.futures executor to reuse.
+    :param subset: indices or boolean mask of the sightlines to evaluate (default: all).
+    :returns: predicted values and their 1-sigma errors.
+    :rtype: tuple of numpy.ndarray
+    """
+    rows = dipole_error._subset(subset, right_ascension, declination, *sightline_terms)
+    right_ascension, declination, sightline_terms = rows[0], rows[1], rows[2:]
+    alpha, delta = dipole_error._radians(right_ascension, declination)
+    alpha = np.atleast_1d(np.asarray(alpha, dtype=np.float64))
+    delta = np.atleast_1d(np.asarray(delta, dtype=np.float64))
+    n_sightlines = len(alpha)
+    with SharedArrays() as shared:
+        shared.dump("model", model)
+        shared.create("alpha", n_sightlines, data=alpha)
+        shared.create("delta", n_sightlines, data=delta)
+        for i, term in enumerate(sightline_terms):
+            shared.create("term%d" % i, n_sightlines, data=np.broadcast_to(term, alpha.shape))
+        nominal = shared.create("nominal", n_sightlines)
+        error = shared.create("error", n_sightlines)
+        tasks = [(shared.directory, shared.layout, len(sightline_terms), start, stop) \
+                 for start, stop in _slices(n_sightlines, worker_count(workers) * TASKS_PER_WORKER)]
+        _run(tasks, _evaluate_task, workers, executor)
+        return np.array(nominal), np.array(error)
+
+# ===============
+# = Monte Carlo =
+# ===============
+
+def _monte_carlo_task(directory, layout, n_terms, start, stop, n_samples, seed, \
+                      samples_per_chunk, chunk_size, bins):
+    model = _load(directory, "model")
+    factor = dipole_error._covariance_factor(model._symmetric_covariance)
+    draw = lambda chunk_index, n_draws: \
+        dipole_error._draw_parameters(model, factor, seed, chunk_index, n_draws)
+    parts = dipole_error._monte_carlo_block( \
+        model, draw, \
+        open_shared(directory, layout, "sightlines")[start:stop], \
+        [open_shared(directory, layout, "term%d" % i)[start:stop] for i in range(n_terms)], \
+        n_samples, samples_per_chunk, chunk_size, bins, \
+        open_shared(directory, layout, "nominal")[start:stop], \
+        open_shared(directory, layout, "error")[start:stop])
+    for name, values in zip(("total", "total_squares", "counts", "low", "width"), parts):
+        output = open_shared(directory, layout, name, mode="r+")
+        output[start:stop] = values
+        output.flush()
+
+def parallel_monte_carlo(model, \
+                         right_ascension, \
+                         declination, \
+                         sightline_terms=(), \
+                         n_samples=100000, \
+                         seed=None, \
+                         percentiles=dipole_error.MC_PERCENTILES, \
+                         chunk_size=dipole_error.MC_CHUNK_SIZE, \
+                         bins=None, \
+                         workers=None, \
+                         executor=None, \
+                         subset=None):
+    """Parallel version of :func:`dipole_error.monte_carlo`; the sightlines are split across workers.
+
+    With the same seed, chunk_size and bins the result is identical to the serial run.
+
+    Arguments:
+    :param workers: number of worker processes (default: WORKERS, or one per CPU).
+    :param executor: an existing concurrent.futures executor to reuse.
+    The other arguments are those of :func:`dipole_error.monte_carlo`.
+    :returns: percentiles, mean and standard deviation next to the linear propagation.
+    :rtype: dipole_error.MonteCarloResult
+    """
+    sightlines, terms, nominal, error, seed, samples_per_chunk, bins = dipole_error._monte_carlo_setup( \
+        model, right_ascension, declination, sightline_terms, seed, chunk_size, bins, subset)
+    n_sightlines = len(sightlines)
+    block_size = max(1, int(chunk_size) // samples_per_chunk)
+    with SharedArrays() as shared:
+        shared.dump("model", model)
+        shared.create("sightlines", (n_sightlines, 3), data=sightlines)
+        for i, term in enumerate(terms):
+            shared.create("term%d" % i, n_sightlines, data=term)
+        shared.create("nominal", n_sightlines, data=nominal)
+        shared.create("error", n_sightlines, data=error)
+        outputs = [shared.create("total", n_sightlines), \
+                   shared.create("total_squares", n_sightlines), \
+                   shared.create("counts", (n_sightlines, bins + 2), dtype=np.int64), \
+                   shared.create("low", n_sightlines), \
+                   shared.create("width", n_sightlines)]
+        tasks = [(shared.directory, shared.layout, len(terms), start, stop, n_samples, seed, \
+                  samples_per_chunk, chunk_size, bins) \
+                 for start, stop in _slices(n_sightlines, worker_count(workers) * TASKS_PER_WORKER, block_size)]
+        _run(tasks, _monte_carlo_task, workers, executor)
+        parts = [np.array(output) for output in outputs]
+    return dipole_error._monte_carlo_result(percentiles, parts, nominal, error, n_samples, seed)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Bootstrap and jackknife errors of a dipole fit (see dipole_fit).
+
+Every sightline contributes w x x^T to the normal matrix and w y x to the right-hand side of the
+fit, where x is its design row [n_x, n_y, n_z, 1] and w = 1 / error^2. These 20 numbers are
+computed once per sightline. A bootstrap resample that draws sightline i c_i times then has the
+normal equations sum_i c_i (w x x^T, w y x)_i: a block of resamples is one matrix product of the
+(resamples x sightlines) count matrix with the (sightlines x 20) features, followed by a batched
+4 x 4 solve.
+
+Resample block i always draws from RandomState((seed, i)), so the result does not depend on how
+the blocks are spread over worker processes.
+
+The leave-one-out jackknife needs no refits: removing sightline i is a rank-one update of the
+normal matrix, so with leverage h_i = w_i x_i^T N^-1 x_i and residual r_i = y_i - x_i . p,
+
+    p_(-i) = p - N^-1 x_i w_i r_i / (1 - h_i).
+
+Examples:
+
+>>> result = dipole_resample.bootstrap(right_ascension, declination, da_a, da_a_error, n_resamples=10000)
+>>> result.errors()['amplitude']
+>>> dipole_resample.jackknife(right_ascension, declination, da_a, da_a_error).covariance
+"""
+import numpy as np
+
+import dipole_error
+import dipole_fit
+import dipole_parallel
+
+# Number of elements of the (resamples x sightlines) count matrix per block.
+BOOTSTRAP_CHUNK_SIZE = 2 ** 22
+
+class ResampleResult(object):
+    """Distributions of the fitted parameters over a set of resamples.
+
+    Attributes:
+    fit -- the fit to all measurements (dipole_fit.DipoleFit).
+    components -- (n_resamples, 4) array of the fitted (D_x, D_y, D_z, monopole).
+    dipole_ra, dipole_dec, amplitude, monopole -- arrays of the fitted parameters, RA in hours
+        (within 12 hours of the full fit) and DEC in degrees.
+    covariance -- estimated 4 x 4 covariance of the components.
+    method -- "bootstrap" or "jackknife".
+    seed -- seed of the bootstrap resamples (None for the jackknife).
+    """
+
+    def __init__(self, fit, components, method, seed=None):
+        self.fit = fit
+        self.components = components
+        self.method = method
+        self.seed = seed
+        self.dipole_ra, self.dipole_dec, self.amplitude, self.monopole = \
+            dipole_fit.spherical_components(components, fit.dipole_ra.nominal_value)
+        deviations = components - components.mean(axis=0)
+        self.covariance = self._scale() * deviations.T.dot(deviations)
+
+    def _scale(self):
+        """Factor of the summed squared deviations in the variance estimate."""
+        n = len(self.components)
+        if self.method == "jackknife":
+            return (n - 1.0) / n
+        return 1.0 / (n - 1.0)
+
+    def errors(self):
+        """1-sigma errors of dipole_ra, dipole_dec, amplitude and monopole.
+
+        :rtype: dict
+        """
+        return dict((name, np.sqrt(self._scale() * ((values - values.mean()) ** 2).sum())) \
+                    for name, values in (("dipole_ra", self.dipole_ra), ("dipole_dec", self.dipole_dec), \
+                                         ("amplitude", self.amplitude), ("monopole", self.monopole)))
+
+def _features(design, weights, values):
+    """Per sightline contributions (w x x^T, w y x) to the normal equations, (n, 20)."""
+    weighted_design = design * weights[:, np.newaxis]
+    return np.hstack(((weighted_design[:, :, np.newaxis] * design[:, np.newaxis, :]).reshape(-1, 16), \
+                      weighted_design * values[:, np.newaxis]))
+
+def _solve(sums):
+    """Solves the normal equations in each row of (n, 20) sums."""
+    try:
+        return np.linalg.solve(sums[:, :16].reshape(-1, 4, 4), sums[:, 16:, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        raise dipole_error.DipoleError("a resample does not constrain the dipole")
+
+def _bootstrap_block(features, seed, block_index, n_resamples):
+    """Fits n_resamples bootstrap resamples; returns their (n_resamples, 4) components."""
+    n_sightlines = len(features)
+    random_state = np.random.RandomState([seed, block_index])
+    draws = random_state.randint(0, n_sightlines, (n_resamples, n_sightlines))
+    draws += n_sightlines * np.arange(n_resamples)[:, np.newaxis]
+    counts = np.bincount(draws.ravel(), minlength=n_resamples * n_sightlines)
+    return _solve(counts.reshape(n_resamples, n_sightlines).astype(np.float64).dot(features))
+
+def _bootstrap_blocks(features, seed, n_resamples, block_size, first_block, last_block):
+    return np.vstack([_bootstrap_block(features, seed, block, min(block_size, n_resamples - block * block_size)) \
+                      for block in range(first_block, last_block)])
+
+def _bootstrap_task(directory, layout, seed, n_resamples, block_size, first_block, last_block):
+    components = _bootstrap_blocks(dipole_parallel.open_shared(directory, layout, "features"), \
+                                   seed, n_resamples, block_size, first_block, last_block)
+    output = dipole_parallel.open_shared(directory, layout, "components", mode="r+")
+    output[first_block * block_size:first_block * block_size + len(components)] = components
+    output.flush()
+
+def bootstrap(right_ascension, \
+              declination, \
+              values, \
+              errors, \
+              n_resamples=1000, \
+              seed=None, \
+              z_redshift=None, \
+              beta=None, \
+              chunk_size=BOOTSTRAP_CHUNK_SIZE, \
+              workers=1, \
+              executor=None):
+    """Bootstrap distribution of the dipole fit (arguments as :func:`dipole_fit.fit_dipole`).
+
+    Arguments:
+    :param n_resamples: number of bootstrap resamples.
+    :type n_resamples: int
+    :param seed: seed of the resamples (a random one is picked, and recorded, if None).
+    :type seed: int
+    :param chunk_size: size of the count matrix of one block of resamples.
+    :type chunk_size: int
+    :param workers: number of worker processes (see dipole_parallel); 1 runs in this process.
+    :param executor: an existing concurrent.futures executor to reuse.
+    :returns: the fitted parameters of every resample.
+    :rtype: ResampleResult
+    """
+    right_ascension, declination, values, errors, scale = \
+        dipole_fit._fit_columns(right_ascension, declination, values, errors, z_redshift, beta)
+    fit = dipole_fit.fit_dipole(right_ascension, declination, values, errors, z_redshift, beta)
+    features = _features(dipole_fit.design_matrix(right_ascension, declination, scale), errors ** -2.0, values)
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    seed = int(seed)
+    block_size = max(1, int(chunk_size) // len(features))
+    n_blocks = -(-int(n_resamples) // block_size)
+    if workers == 1 and executor is None:
+        components = _bootstrap_blocks(features, seed, n_resamples, block_size, 0, n_blocks)
+    else:
+        with dipole_parallel.SharedArrays() as shared:
+            shared.create("features", features.shape, data=features)
+            components = shared.create("components", (n_resamples, 4))
+            tasks = [(shared.directory, shared.layout, seed, n_resamples, block_size, first, last) \
+                     for first, last in dipole_parallel._slices( \
+                         n_blocks, dipole_parallel.worker_count(workers) * dipole_parallel.TASKS_PER_WORKER)]
+            dipole_parallel._run(tasks, _bootstrap_task, workers, executor)
+            components = np.array(components)
+    return ResampleResult(fit, components, "bootstrap", seed)
+
+def jackknife(right_ascension, \
+              declination, \
+              values, \
+              errors, \
+              z_redshift=None, \
+              beta=None):
+    """Leave-one-out jackknife of the dipole fit (arguments as :func:`dipole_fit.fit_dipole`).
+
+    :returns: the fitted parameters with each measurement left out in turn.
+    :rtype: ResampleResult
+    """
+    right_ascension, declination, values, errors, scale = \
+        dipole_fit._fit_columns(right_ascension, declination, values, errors, z_redshift, beta)
+    fit = dipole_fit.fit_dipole(right_ascension, declination, values, errors, z_redshift, beta)
+    design = dipole_fit.design_matrix(right_ascension, declination, scale)
+    weights = errors ** -2.0
+    solved = design.dot(fit.covariance)
+    leverage = weights * (solved * design).sum(axis=1)
+    if np.any(leverage >= 1.0 - 1e-12):
+        raise dipole_error.DipoleError("the dipole is not constrained with some measurement left out")
+    residuals = values - design.dot(fit.components)
+    components = fit.components - solved * (weights * residuals / (1.0 - leverage))[:, np.newaxis]
+    return ResampleResult(fit, components, "jackknife")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Delta chi-squared of the dipole direction, for confidence regions on the sky.
+
+For a fixed dipole direction u the model A (u . n) + m is linear in the amplitude A and the
+monopole m, and their weighted least-squares fit only needs sums that follow from the normal
+equations of the full fit (see dipole_fit): with N and b = X^T W y over [n_x, n_y, n_z, 1],
+
+    sum w (u.n)^2 = u^T N_xyz u,   sum w (u.n) = u . N_xyz,1,   sum w (u.n) y = u . b_xyz, ...
+
+so chi^2(u) costs O(1) per direction, whatever the size of the catalog. The amplitude is kept
+non-negative (u and -u are different directions); Delta chi^2 is taken from the best fit.
+
+The scan starts from a coarse equal-area grid (see dipole_skymap) and splits a pixel into 2 x 2
+equal-area pixels while a contour level may pass through it (judged from its centre and corners),
+so only the pixels along the contours reach the finest resolution.
+
+Examples:
+
+>>> scan = dipole_scan.direction_scan(right_ascension, declination, da_a, da_a_error)
+>>> scan.area(dipole_scan.DELTA_CHI2_LEVELS[0]) * (180 / numpy.pi) ** 2   # 1-sigma region in deg^2
+>>> inside = scan.region(dipole_scan.DELTA_CHI2_LEVELS[1])                 # 2-sigma pixels
+"""
+import numpy as np
+
+import dipole_fit
+
+# Delta chi-squared of the 1, 2 and 3 sigma regions for two parameters (the direction).
+DELTA_CHI2_LEVELS = (2.30, 6.18, 11.83)
+# Number of directions evaluated at once.
+SCAN_CHUNK_SIZE = 2 ** 18
+
+class DirectionScan(object):
+    """Delta chi-squared on an adaptively refined equal-area pixelization.
+
+    Attributes:
+    dipole_ra, dipole_dec -- pixel centres, RA in hours and DEC in degrees.
+    pixel_area -- pixel solid angles in steradians.
+    delta_chi2 -- Delta chi-squared at the pixel centres.
+    levels -- the contour levels the grid was refined on.
+    fit -- the best fit (dipole_fit.DipoleFit).
+    """
+
+    def __init__(self, bounds, delta_chi2, levels, fit):
+        self.bounds = bounds
+        self.dipole_ra = (bounds[:, 2] + bounds[:, 3]) * (6.0 / np.pi)
+        self.dipole_dec = np.degrees(np.arcsin((bounds[:, 0] + bounds[:, 1]) / 2.0))
+        self.pixel_area = (bounds[:, 1] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 2])
+        self.delta_chi2 = delta_chi2
+        self.levels = tuple(levels)
+        self.fit = fit
+
+    def region(self, level):
+        """Mask of the pixels with Delta chi-squared below level."""
+        return self.delta_chi2 <= level
+
+    def area(self, level):
+        """Solid angle (steradians) of the region with Delta chi-squared below level."""
+        return self.pixel_area[self.region(level)].sum()
+
+class _ChiSquared(object):
+    """chi^2 of the best non-negative amplitude and monopole for given dipole directions."""
+
+    def __init__(self, matrix, vector, weighted_squares):
+        self.matrix = matrix
+        self.vector = vector
+        self.weighted_squares = weighted_squares
+        # chi^2 with the monopole alone (A = 0)
+        self.monopole_only = weighted_squares - vector[3] ** 2 / matrix[3, 3]
+
+    def __call__(self, directions):
+        result = np.empty(len(directions))
+        for start in range(0, len(directions), SCAN_CHUNK_SIZE):
+            u = directions[start:start + SCAN_CHUNK_SIZE]
+            a = np.einsum('ki,ij,kj->k', u, self.matrix[:3, :3], u)
+            b = u.dot(self.matrix[:3, 3])
+            c = self.matrix[3, 3]
+            p = u.dot(self.vector[:3])
+            q = self.vector[3]
+            determinant = a * c - b ** 2
+            safe = np.where(determinant > 0, determinant, 1.0)
+            amplitude = (c * p - b * q) / safe
+            monopole = (a * q - b * p) / safe
+            chi2 = self.weighted_squares - (amplitude * p + monopole * q)
+            result[start:start + SCAN_CHUNK_SIZE] = \
+                np.where((amplitude > 0) & (determinant > 0), chi2, self.monopole_only)
+        return result
+
+def _directions(sin_dec, ra):
+    """Unit vectors at sin(DEC), RA (radians)."""
+    cos_dec = np.sqrt(np.clip(1.0 - sin_dec ** 2, 0.0, None))
+    return np.stack((cos_dec * np.cos(ra), cos_dec * np.sin(ra), sin_dec), axis=-1)
+
+def _pixel_chi2(chi_squared, bounds):
+    """chi^2 at the centres and the minimum and maximum over centre and corners of pixels."""
+    sin_dec = np.stack(((bounds[:, 0] + bounds[:, 1]) / 2.0, bounds[:, 0], bounds[:, 0], bounds[:, 1], bounds[:, 1]))
+    ra = np.stack(((bounds[:, 2] + bounds[:, 3]) / 2.0, bounds[:, 2], bounds[:, 3], bounds[:, 2], bounds[:, 3]))
+    values = chi_squared(_directions(sin_dec.ravel(), ra.ravel())).reshape(5, -1)
+    return values[0], values.min(axis=0), values.max(axis=0)
+
+def _split(bounds):
+    """Splits pixels into 2 x 2 equal-area pixels."""
+    sin_middle = (bounds[:, 0] + bounds[:, 1]) / 2.0
+    ra_middle = (bounds[:, 2] + bounds[:, 3]) / 2.0
+    children = []
+    for sin_low, sin_high in ((bounds[:, 0], sin_middle), (sin_middle, bounds[:, 1])):
+        for ra_low, ra_high in ((bounds[:, 2], ra_middle), (ra_middle, bounds[:, 3])):
+            children.append(np.column_stack((sin_low, sin_high, ra_low, ra_high)))
+    return np.vstack(children)
+
+def scan_normal_equations(matrix, \
+                          vector, \
+                          weighted_squares, \
+                          n_measurements, \
+                          beta=None, \
+                          n_dec=16, \
+                          depth=6, \
+                          levels=DELTA_CHI2_LEVELS):
+    """Direction scan from the normal equations of a fit (as from dipole_fit.normal_equations, or
+    the sums of a dipole_fit.DipoleAccumulator).
+
+    Arguments:
+    :param n_dec: number of rings of the coarse grid (which has 2 n_dec pixels per ring).
+    :type n_dec: int
+    :param depth: number of times pixels on a contour are split.
+    :type depth: int
+    :param levels: the Delta chi-squared contour levels to resolve.
+    :returns: the scan.
+    :rtype: DirectionScan
+    """
+    fit = dipole_fit.DipoleFit.from_normal_equations(matrix, vector, weighted_squares, n_measurements, beta)
+    chi_squared = _ChiSquared(matrix, vector, weighted_squares)
+    minimum = fit.chi2
+    sin_edges = np.linspace(-1.0, 1.0, n_dec + 1)
+    ra_edges = np.linspace(0.0, 2.0 * np.pi, 2 * n_dec + 1)
+    sin_low, ra_low = np.meshgrid(np.arange(n_dec), np.arange(2 * n_dec), indexing="ij")
+    bounds = np.column_stack((sin_edges[sin_low.ravel()], sin_edges[sin_low.ravel() + 1], \
+                              ra_edges[ra_low.ravel()], ra_edges[ra_low.ravel() + 1]))
+    levels = np.asarray(levels, dtype=np.float64)
+    # the pixel holding the best fit is always refined
+    best_sin = np.sin(np.radians(fit.dipole_dec.nominal_value))
+    best_ra = np.mod(fit.dipole_ra.nominal_value * (np.pi / 12.0), 2.0 * np.pi)
+    finished_bounds, finished_values = [], []
+    for refinement in range(depth + 1):
+        centre, low, high = _pixel_chi2(chi_squared, bounds)
+        # Delta chi^2 may dip or peak between the sampled points: widen the range by its spread.
+        spread = high - low
+        low, high = low - minimum - spread, high - minimum + spread
+        crossing = ((low[:, np.newaxis] <= levels) & (high[:, np.newaxis] > levels)).any(axis=1)
+        crossing |= (bounds[:, 0] <= best_sin) & (best_sin <= bounds[:, 1]) & \
+                    (bounds[:, 2] <= best_ra) & (best_ra <= bounds[:, 3])
+        if refinement == depth:
+            crossing[:] = False
+        finished_bounds.append(bounds[~crossing])
+        finished_values.append(centre[~crossing] - minimum)
+        bounds = _split(bounds[crossing])
+    return DirectionScan(np.vstack(finished_bounds), np.maximum(np.concatenate(finished_values), 0.0), levels, fit)
+
+def direction_scan(right_ascension, \
+                   declination, \
+                   values, \
+                   errors, \
+                   z_redshift=None, \
+                   beta=None, \
+                   n_dec=16, \
+                   depth=6, \
+                   levels=DELTA_CHI2_LEVELS):
+    """Delta chi-squared of the dipole direction against a catalog of measurements.
+
+    Arguments:
+    :param right_ascension: right ascensions of the sightlines in radians, or sexagesimal strings.
+    :param declination: declinations of the sightlines in radians, or sexagesimal strings.
+    :param values: measured da/a.
+    :param errors: 1-sigma errors of the measurements.
+    :param z_redshift: redshifts of the absorbers (eq. 18 only).
+    :param beta: power law exponent of eq. 18, held fixed; None scans eq. 15.
+    :param n_dec: number of rings of the coarse grid (which has 2 n_dec pixels per ring).
+    :param depth: number of times pixels on a contour are split.
+    :param levels: the Delta chi-squared contour levels to resolve.
+    :returns: the scan.
+    :rtype: DirectionScan
+    """
+    return scan_normal_equations(*dipole_fit.normal_equations(right_ascension, declination, values, errors, \
+                                                              z_redshift, beta), \
+                                 beta=beta, n_dec=n_dec, depth=depth, levels=levels)
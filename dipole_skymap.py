@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Full-sky maps of the predicted da/a and its 1-sigma error.
+
+The sky is cut into an equal-area grid: n_dec rings uniform in sin(DEC), each split into n_ra
+pixels uniform in RA, so every pixel covers 4 pi / (n_dec * n_ra) steradians. Pixel
+i_dec * n_ra + i_ra is centred on
+
+    RA = 2 pi (i_ra + 0.5) / n_ra,   DEC = arcsin(2 (i_dec + 0.5) / n_dec - 1).
+
+A map is a .npy array of shape (2, n_dec, n_ra), holding the predicted values and their errors.
+It is filled a block of rings at a time through a memory map, so the map never has to fit in
+memory, and it can be re-read the same way with load_sky_map().
+
+Examples:
+
+>>> dipole_skymap.sky_map(dipole_error.DipoleModel(), "dipole.npy", n_dec=2048)
+>>> dipole_skymap.sky_map(dipole_error.ZDipoleModel(), "z_dipole.npy", sightline_terms=(1.5,))
+>>> nominal, error = dipole_skymap.load_sky_map("dipole.npy")
+"""
+import numpy as np
+
+import dipole_error
+
+# Number of pixels evaluated at once.
+MAP_CHUNK_SIZE = 2 ** 18
+
+def grid_shape(n_pixels):
+    """(n_dec, n_ra) of the grid with n_ra = 2 n_dec that has about n_pixels pixels."""
+    n_dec = max(1, int(round(np.sqrt(n_pixels / 2.0))))
+    return n_dec, 2 * n_dec
+
+def pixel_area(n_dec, n_ra):
+    """Solid angle of one pixel in steradians."""
+    return 4.0 * np.pi / (n_dec * n_ra)
+
+def ring_declinations(n_dec, start=0, stop=None):
+    """DEC in radians of the centres of rings start to stop."""
+    rings = np.arange(start, n_dec if stop is None else stop, dtype=np.float64)
+    return np.arcsin(2.0 * (rings + 0.5) / n_dec - 1.0)
+
+def ring_right_ascensions(n_ra):
+    """RA in radians of the pixel centres along a ring."""
+    return 2.0 * np.pi * (np.arange(n_ra, dtype=np.float64) + 0.5) / n_ra
+
+def pixel_centers(n_dec, n_ra, start=0, stop=None):
+    """RA and DEC in radians of the pixel centres of rings start to stop, each of shape (rings, n_ra)."""
+    delta = ring_declinations(n_dec, start, stop)
+    alpha = ring_right_ascensions(n_ra)
+    return np.broadcast_to(alpha, (len(delta), n_ra)), np.broadcast_to(delta[:, np.newaxis], (len(delta), n_ra))
+
+def pixel_index(right_ascension, declination, n_dec, n_ra):
+    """Flat pixel index of positions in radians (e.g. to look up sightlines on a map)."""
+    i_ra = np.floor(np.mod(right_ascension, 2.0 * np.pi) * (n_ra / (2.0 * np.pi))).astype(np.int64)
+    i_dec = np.floor((np.sin(declination) + 1.0) * (n_dec / 2.0)).astype(np.int64)
+    return np.clip(i_dec, 0, n_dec - 1) * n_ra + np.clip(i_ra, 0, n_ra - 1)
+
+def sky_map(model, \
+            filename, \
+            n_dec=1024, \
+            n_ra=None, \
+            sightline_terms=(), \
+            chunk_size=MAP_CHUNK_SIZE):
+    """Writes the map of a model's predictions and errors to a .npy file.
+
+    Arguments:
+    :param model: :class:`dipole_error.DipoleModel`, :class:`dipole_error.ZDipoleModel` or
+        :class:`dipole_error.RDipoleModel`.
+    :param filename: the .npy file to write.
+    :type filename: string
+    :param n_dec: number of rings in DEC.
+    :type n_dec: int
+    :param n_ra: number of pixels per ring (default: 2 n_dec).
+    :type n_ra: int
+    :param sightline_terms: sightline terms of the model (z_redshift or radial_distance), the same
+        for every pixel.
+    :type sightline_terms: tuple of numbers
+    :param chunk_size: number of pixels evaluated at once.
+    :type chunk_size: int
+    :returns: the map, opened read-only; map[0] are the predictions and map[1] their errors.
+    :rtype: numpy.memmap (2, n_dec, n_ra)
+    """
+    if n_ra is None:
+        n_ra = 2 * n_dec
+    if len(sightline_terms) != len(model.sightline_names):
+        raise dipole_error.DipoleError("%s needs the sightline terms %s" % \
+                                       (type(model).__name__, ", ".join(model.sightline_names) or "()"))
+    output = np.lib.format.open_memmap(filename, mode="w+", dtype=np.float64, shape=(2, n_dec, n_ra))
+    rings = max(1, int(chunk_size) // n_ra)
+    for start in range(0, n_dec, rings):
+        stop = min(start + rings, n_dec)
+        alpha, delta = pixel_centers(n_dec, n_ra, start, stop)
+        output[0, start:stop], output[1, start:stop] = model.evaluate(alpha, delta, *sightline_terms)
+    output.flush()
+    del output
+    return load_sky_map(filename)
+
+def load_sky_map(filename):
+    """Opens a map written by sky_map without reading it into memory."""
+    return np.load(filename, mmap_mode="r")
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""Arrays of numbers with linear uncertainties, for many predictions at once.
+
+A UArray holds the nominal values and one dense row of derivatives per element with respect to a
+shared tuple of independent uncertainties.Variable objects (the variables every ufloat is built on;
+the published parameters are such variables, and correlated parameters, as from
+uncertainties.correlated_values or a dipole_fit.DipoleFit, are combinations of them). So a million
+predictions are a (10^6,) array and a (10^6, k) array instead of a million ufloats, and
+
+    std_devs = sqrt((derivatives ** 2) . variances)
+
+is one matrix product. Arithmetic and the functions below follow the same first-order rules as
+uncertainties, so correlations between elements (and with ufloats built on the same variables) are
+kept, and converting to ufloats gives exactly what uncertainties would have computed.
+
+Examples:
+
+>>> predictions = dipole_error.DipoleModel().uarray(right_ascension, declination)
+>>> predictions.nominal_values, predictions.std_devs()
+>>> difference = predictions - dipole_uarray.UArray.from_ufloats([measurement_1, measurement_2])
+>>> dipole_uarray.sin(difference).to_ufloats()
+"""
+import numpy as np
+import uncertainties
+
+import dipole_error
+
+def _coefficient(coefficient, derivatives):
+    """Scales derivative rows (..., k) by an array broadcasting against the values."""
+    return np.asarray(coefficient, dtype=np.float64)[..., np.newaxis] * derivatives
+
+def variable_derivatives(values):
+    """Independent variables of a sequence of numbers or ufloats, and the derivatives of the values
+    with respect to them.
+
+    :returns: the variables and the (n_values, n_variables) derivatives.
+    :rtype: tuple
+    """
+    variables, columns = [], {}
+    for value in values:
+        for variable in getattr(value, 'derivatives', {}):
+            if id(variable) not in columns:
+                columns[id(variable)] = len(variables)
+                variables.append(variable)
+    derivatives = np.zeros((len(values), len(variables)))
+    for row, value in enumerate(values):
+        for variable, derivative in getattr(value, 'derivatives', {}).items():
+            derivatives[row, columns[id(variable)]] += derivative
+    return tuple(variables), derivatives
+
+class UArray(object):
+    """Nominal values with first-order derivatives with respect to shared independent variables.
+
+    Arguments:
+    :param nominal_values: the values.
+    :type nominal_values: numpy.ndarray
+    :param derivatives: derivatives of every value with respect to the variables (shape of the
+        values plus one axis), or None for exact values.
+    :param variables: the uncertainties.Variable objects the derivatives refer to.
+    :type variables: tuple
+    """
+    # so that numpy arrays leave the arithmetic with a UArray to it
+    __array_priority__ = 1000
+
+    def __init__(self, nominal_values, derivatives=None, variables=()):
+        self.nominal_values = np.asarray(nominal_values, dtype=np.float64)
+        self.variables = tuple(variables)
+        if derivatives is None:
+            derivatives = np.zeros(self.nominal_values.shape + (len(self.variables),))
+        derivatives = np.asarray(derivatives, dtype=np.float64)
+        if derivatives.shape[-1:] != (len(self.variables),):
+            raise dipole_error.DipoleError("derivatives need one column per variable")
+        if derivatives.shape[:-1] != self.nominal_values.shape:
+            # e.g. a single UArray element combined with an array of numbers
+            try:
+                derivatives = np.array(np.broadcast_to(derivatives, self.nominal_values.shape + derivatives.shape[-1:]))
+            except ValueError:
+                raise dipole_error.DipoleError("derivatives of shape %s do not fit values of shape %s" % \
+                                               (derivatives.shape, self.nominal_values.shape))
+        self.derivatives = derivatives
+
+    # ==============
+    # = Conversion =
+    # ==============
+
+    @classmethod
+    def from_ufloats(cls, values):
+        """A UArray of a sequence of numbers or ufloats."""
+        values = list(values)
+        variables, derivatives = variable_derivatives(values)
+        return cls([uncertainties.nominal_value(x) for x in values], derivatives, variables)
+
+    def to_ufloats(self):
+        """The elements as ufloats (correlated through the shared variables), in an object array."""
+        result = np.empty(self.shape, dtype=object)
+        derivatives = self.derivatives.reshape(-1, len(self.variables))
+        for index, (nominal, row) in enumerate(zip(self.nominal_values.ravel().tolist(), derivatives.tolist())):
+            result.flat[index] = uncertainties.AffineScalarFunc( \
+                nominal, dict((variable, derivative) for variable, derivative in zip(self.variables, row) if derivative))
+        return result
+
+    # =================
+    # = Uncertainties =
+    # =================
+
+    def variances(self):
+        """Variances of the variables (read at call time, as ufloats do)."""
+        return np.array([variable.std_dev ** 2 for variable in self.variables], dtype=np.float64)
+
+    def std_devs(self):
+        """1-sigma errors of the values."""
+        if not self.variables:
+            return np.zeros(self.shape)
+        return np.sqrt((self.derivatives ** 2).dot(self.variances()))
+
+    def covariance_matrix(self):
+        """Covariance matrix of the (flattened) values."""
+        derivatives = self.derivatives.reshape(-1, len(self.variables))
+        return (derivatives * self.variances()).dot(derivatives.T)
+
+    # ==============
+    # = Containers =
+    # ==============
+
+    @property
+    def shape(self):
+        return self.nominal_values.shape
+
+    @property
+    def ndim(self):
+        return self.nominal_values.ndim
+
+    def __len__(self):
+        return len(self.nominal_values)
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        # the derivative axis is always kept whole, after the axes the index selects from
+        if any(item is Ellipsis for item in index):
+            derivative_index = index + (slice(None),)
+        else:
+            derivative_index = index + (Ellipsis, slice(None))
+        return UArray(self.nominal_values[index], self.derivatives[derivative_index], self.variables)
+
+    def __repr__(self):
+        return "UArray(%r, std_devs=%r)" % (self.nominal_values, self.std_devs())
+
+    # ==============
+    # = Arithmetic =
+    # ==============
+
+    def _aligned(self, other):
+        """This and other (UArray or numbers) as UArrays over the same variables."""
+        if not isinstance(other, UArray):
+            return self, UArray(other, None, self.variables)
+        if len(other.variables) == len(self.variables) and \
+                all(a is b for a, b in zip(other.variables, self.variables)):
+            return self, other
+        columns = dict((id(variable), i) for i, variable in enumerate(self.variables))
+        variables = list(self.variables) + [v for v in other.variables if id(v) not in columns]
+        for variable in variables[len(self.variables):]:
+            columns[id(variable)] = len(columns)
+        mine = np.zeros(self.shape + (len(variables),))
+        mine[..., :len(self.variables)] = self.derivatives
+        theirs = np.zeros(other.shape + (len(variables),))
+        theirs[..., [columns[id(v)] for v in other.variables]] = other.derivatives
+        return UArray(self.nominal_values, mine, variables), UArray(other.nominal_values, theirs, variables)
+
+    def _binary(self, other, nominal, d_self, d_other):
+        if not isinstance(other, UArray):
+            return self._unary(nominal, d_self)
+        one, two = self._aligned(other)
+        return UArray(nominal, _coefficient(d_self, one.derivatives) + _coefficient(d_other, two.derivatives), \
+                      one.variables)
+
+    def _unary(self, nominal, derivative):
+        return UArray(nominal, _coefficient(derivative, self.derivatives), self.variables)
+
+    def __add__(self, other):
+        two = other.nominal_values if isinstance(other, UArray) else other
+        return self._binary(other, self.nominal_values + two, 1.0, 1.0)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        two = other.nominal_values if isinstance(other, UArray) else other
+        return self._binary(other, self.nominal_values - two, 1.0, -1.0)
+
+    def __rsub__(self, other):
+        return -(self - other)
+
+    def __mul__(self, other):
+        two = other.nominal_values if isinstance(other, UArray) else np.asarray(other, dtype=np.float64)
+        return self._binary(other, self.nominal_values * two, two, self.nominal_values)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        two = other.nominal_values if isinstance(other, UArray) else np.asarray(other, dtype=np.float64)
+        return self._binary(other, self.nominal_values / two, 1.0 / two, -self.nominal_values / two ** 2)
+
+    def __rtruediv__(self, other):
+        return UArray(other, None, self.variables) / self if not isinstance(other, UArray) else other / self
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, other):
+        if not isinstance(other, UArray):
+            # a fixed exponent needs no logarithm, so negative and zero bases stay valid
+            two = np.asarray(other, dtype=np.float64)
+            return self._unary(self.nominal_values ** two, two * self.nominal_values ** (two - 1.0))
+        two = other.nominal_values
+        nominal = self.nominal_values ** two
+        d_self = two * self.nominal_values ** (two - 1.0)
+        return self._binary(other, nominal, d_self, nominal * np.log(self.nominal_values))
+
+    def __rpow__(self, other):
+        return UArray(other, None, self.variables) ** self
+
+    def __neg__(self):
+        return UArray(-self.nominal_values, -self.derivatives, self.variables)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return self._unary(np.abs(self.nominal_values), np.sign(self.nominal_values))
+
+# =============
+# = Functions =
+# =============
+# Work on UArrays, and on numbers and arrays (then as NumPy).
+
+def _function(value, nominal_function, derivative_function):
+    if not isinstance(value, UArray):
+        return nominal_function(value)
+    return value._unary(nominal_function(value.nominal_values), derivative_function(value.nominal_values))
+
+def sin(x):
+    return _function(x, np.sin, np.cos)
+
+def cos(x):
+    return _function(x, np.cos, lambda v: -np.sin(v))
+
+def tan(x):
+    return _function(x, np.tan, lambda v: 1.0 / np.cos(v) ** 2)
+
+def arcsin(x):
+    return _function(x, np.arcsin, lambda v: 1.0 / np.sqrt(1.0 - v ** 2))
+
+def arccos(x):
+    return _function(x, np.arccos, lambda v: -1.0 / np.sqrt(1.0 - v ** 2))
+
+def arctan(x):
+    return _function(x, np.arctan, lambda v: 1.0 / (1.0 + v ** 2))
+
+def sqrt(x):
+    return _function(x, np.sqrt, lambda v: 0.5 / np.sqrt(v))
+
+def exp(x):
+    return _function(x, np.exp, np.exp)
+
+def log(x):
+    return _function(x, np.log, lambda v: 1.0 / v)
+
+def arctan2(y, x):
+    """arctan2 of UArrays or numbers."""
+    if not isinstance(y, UArray) and not isinstance(x, UArray):
+        return np.arctan2(y, x)
+    y_nominal = y.nominal_values if isinstance(y, UArray) else np.asarray(y, dtype=np.float64)
+    x_nominal = x.nominal_values if isinstance(x, UArray) else np.asarray(x, dtype=np.float64)
+    squared = x_nominal ** 2 + y_nominal ** 2
+    if not isinstance(y, UArray):
+        return x._unary(np.arctan2(y_nominal, x_nominal), -y_nominal / squared)
+    return y._binary(x, np.arctan2(y_nominal, x_nominal), x_nominal / squared, -y_nominal / squared)
@@ -3,7 +3,11 @@ from distutils.core import setup
 setup(name="dipole_error",
       version='2.0.0',
       description="Calculate the predicted dipole value and error for given input.",
-      py_modules=['dipole_error'],
+      py_modules=['dipole_error', 'dipole_parallel', 'dipole_catalog', 'dipole_skymap', 'dipole_fit',
+                  'dipole_resample', 'dipole_null', 'dipole_scan',
+                  'dipole_index', 'dipole_distance', 'dipole_cache',
+                  'dipole_instrument', 'dipole_uarray'],
+      scripts=['dipole_catalog.py'],
       author='Jonathan Whitmore',
       author_email='jbwhit@gmail.com',
       url='https://github.com/jbwhit/dipole_error',
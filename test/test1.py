@@ -1,10 +1,33 @@
 #!/usr/bin/env python
 import angles
+import csv
 import numpy as np
+import benchmark
 import dipole_error
+import dipole_cache
+import dipole_catalog
+import dipole_distance
+import dipole_fit
+import dipole_index
+import dipole_instrument
+import dipole_null
+import dipole_parallel
+import dipole_resample
+import dipole_scan
+import dipole_skymap
+import dipole_uarray
 import uncertainties
 from uncertainties.umath import *
+import multiprocessing
+import os
+import pickle
+import pstats
 import random
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
 import unittest
 
 DIP_RA = 17.3
@@ -86,6 +109,37 @@ class StatisticalSeparationTest(unittest.TestCase):
     # prediction > measurement
     
     
+class StatisticalSeparationArrayTest(unittest.TestCase):
+    """Array versions of the statistical separation."""
+
+    def test_matches_scalar(self):
+        """each row agrees with statistical_difference_systematic, with a per-row systematic error."""
+        state = np.random.RandomState(3)
+        one, two = state.normal(0, 2, 50), state.normal(0, 2, 50)
+        one_error, two_error, systematic = state.uniform(0.5, 2, (3, 50))
+        minimum, maximum, overlap = dipole_error.statistical_difference_systematic_array(one, one_error, \
+                                                                                          two, two_error, systematic)
+        for i in range(50):
+            expected = dipole_error.statistical_difference_systematic(uncertainties.ufloat(one[i], one_error[i]), \
+                                                                       uncertainties.ufloat(two[i], two_error[i]), \
+                                                                       systematic[i])
+            self.assertAlmostEqual(minimum[i], expected[0])
+            self.assertAlmostEqual(maximum[i], expected[1])
+            self.assertEqual(overlap[i], abs(one[i] - two[i]) <= systematic[i])
+        self.assertTrue(np.allclose(dipole_error.statistical_difference_array(one, one_error, two, two_error), \
+                                    dipole_error.statistical_difference_systematic_array(one, one_error, two, two_error)[0]))
+
+    def test_systematic_positive(self):
+        """a negative systematic error in any row raises NegativeError."""
+        self.assertRaises(dipole_error.NegativeError, dipole_error.statistical_difference_systematic_array, \
+                          [1.0, 2.0], [1.0, 1.0], [0.0, 0.0], [1.0, 1.0], [0.5, -0.5])
+
+    def test_report(self):
+        """the batch report writes one line per object."""
+        output = StringIO.StringIO()
+        dipole_error.write_stat_difference_report(output, ["a", "b"], [0.0, 1.25], [2.0, 3.5], round_places=2)
+        self.assertEqual(output.getvalue(), "a: Between 0.00 and 2.00 sigma away.\nb: Between 1.25 and 3.50 sigma away.\n")
+
 class DipoleErrorTest(unittest.TestCase):
     """"""
 #     def test_theta_transpose(self):
@@ -120,7 +174,906 @@ class DipoleErrorTest(unittest.TestCase):
 #     # TODO test QSO RA
 #     # TODO test QSO DEC
 
-    
+
+QSO_POSITIONS = [("22 20 06.757", "-28 03 23.34"), \
+                 ("11 03 25.29", "-26 45 15.8"), \
+                 ("01 00 00.0", "-60 00 00.0")]
+
+def radian_positions(positions=QSO_POSITIONS):
+    """RA and DEC arrays in radians for a list of (RA, DEC) strings."""
+    parsed = [angles.AngularPosition.from_hd(ra + " " + dec) for ra, dec in positions]
+    return np.array([p.alpha.r for p in parsed]), np.array([p.delta.r for p in parsed])
+
+class JacobianTest(unittest.TestCase):
+    """The closed-form derivatives agree with numerical ones."""
+
+    def test_sep_jacobian(self):
+        """sep_jacobian against finite differences of angles.sep."""
+        args = (angles.h2r(DIP_RA), angles.d2r(DIP_DEC), 5.84, -0.49)
+        analytic = dipole_error.sep_jacobian(*args)
+        for index in range(4):
+            numerical = uncertainties.partial_derivative(angles.sep, index)(*args)
+            self.assertAlmostEqual(analytic[index], numerical, places=6)
+
+    def test_model_jacobians(self):
+        """model jacobians against finite differences of the basic model functions."""
+        for basic, jacobian, args in [(dipole_error.basic_dipole_monopole, \
+                                       dipole_error.dipole_monopole_jacobian, (0.97e-5, 1.02, -0.178e-5)), \
+                                      (dipole_error.basic_z_dipole_monopole, \
+                                       dipole_error.z_dipole_monopole_jacobian, (0.81e-5, 1.5, 0.46, 1.02, -0.184e-5)), \
+                                      (dipole_error.basic_r_dipole_monopole, \
+                                       dipole_error.r_dipole_monopole_jacobian, (1.1e-6, 1.3, 1.02, -0.187e-5))]:
+            analytic = jacobian(*args)
+            for index in range(len(args)):
+                numerical = uncertainties.partial_derivative(basic, index)(*args)
+                self.assertTrue(np.allclose(analytic[index], numerical, rtol=1e-6, atol=1e-12))
+
+class BatchModelTest(unittest.TestCase):
+    """The array versions of the models agree with the scalar ones."""
+
+    def assertMatchesScalar(self, batch_result, scalar_results):
+        """compare (nominal, error) arrays with a list of ufloats."""
+        nominal, error = batch_result
+        self.assertTrue(np.allclose(nominal, [x.nominal_value for x in scalar_results], rtol=1e-9, atol=0))
+        self.assertTrue(np.allclose(error, [x.std_dev for x in scalar_results], rtol=1e-9, atol=0))
+
+    def test_dipole_monopole_array(self):
+        """eq. 15 batch against dipole_monopole."""
+        ra, dec = radian_positions()
+        self.assertMatchesScalar(dipole_error.dipole_monopole_array(ra, dec), \
+            [dipole_error.dipole_monopole(r, d) for r, d in QSO_POSITIONS])
+
+    def test_z_dipole_monopole_array(self):
+        """eq. 18 batch against z_dipole_monopole."""
+        ra, dec = radian_positions()
+        redshifts = np.array([1.5, 2.0, 0.5])
+        beta = uncertainties.ufloat(dipole_error.Z_DIP_BETA, dipole_error.Z_DIP_BETA_ERR)
+        self.assertMatchesScalar(dipole_error.z_dipole_monopole_array(ra, dec, z_redshift=redshifts, beta=beta), \
+            [dipole_error.z_dipole_monopole(r, d, z_redshift=z, beta=beta) \
+             for (r, d), z in zip(QSO_POSITIONS, redshifts)])
+
+    def test_r_dipole_monopole_array(self):
+        """eq. 19 batch against r_dipole_monopole."""
+        ra, dec = radian_positions()
+        distances = np.array([1.3, 9.0, 5.0])
+        self.assertMatchesScalar(dipole_error.r_dipole_monopole_array(ra, dec, radial_distance=distances), \
+            [dipole_error.r_dipole_monopole(r, d, radial_distance=x) \
+             for (r, d), x in zip(QSO_POSITIONS, distances)])
+
+class DipoleModelTest(unittest.TestCase):
+    """The precompiled models."""
+
+    def test_direction(self):
+        """the cached unit vector points at the dipole."""
+        model = dipole_error.DipoleModel()
+        self.assertAlmostEqual(np.dot(model.direction, model.direction), 1.0)
+        self.assertAlmostEqual(model.direction[2], np.sin(angles.d2r(DIP_DEC)))
+
+    def test_correlated_parameters(self):
+        """covariance between the parameters is carried into the batch error."""
+        amplitude, monopole = uncertainties.correlated_values([0.97e-5, -0.178e-5], \
+            [[(0.21e-5) ** 2, -0.5 * 0.21e-5 * 0.084e-5], [-0.5 * 0.21e-5 * 0.084e-5, (0.084e-5) ** 2]])
+        model = dipole_error.DipoleModel(DIP_RA, DIP_DEC, amplitude, monopole)
+        ra, dec = radian_positions()
+        nominal, error = model.evaluate(ra, dec)
+        expected = [model.ufloat(r, d) for r, d in zip(ra, dec)]
+        self.assertTrue(np.allclose(error, [x.std_dev for x in expected], rtol=1e-9, atol=0))
+        self.assertTrue(np.allclose(error, [(amplitude * np.cos(angles.sep(angles.h2r(DIP_RA), angles.d2r(DIP_DEC), r, d)) \
+                                             + monopole).std_dev for r, d in zip(ra, dec)], rtol=1e-9, atol=0))
+
+    def test_z_dipole_defaults_agree(self):
+        """the scalar, array and model entry points share the published z-dipole errors."""
+        ra, dec = radian_positions()
+        redshifts = np.array([1.6919, 2.0, 0.5])
+        nominal, error = dipole_error.ZDipoleModel().evaluate(ra, dec, redshifts)
+        array_nominal, array_error = dipole_error.z_dipole_monopole_array(ra, dec, z_redshift=redshifts)
+        self.assertTrue(np.allclose(array_nominal, nominal, rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(array_error, error, rtol=1e-12, atol=0))
+        scalar = [dipole_error.z_dipole_monopole(r, d, z_redshift=z) for r, d, z in zip(ra, dec, redshifts)]
+        self.assertTrue(np.allclose([x.std_dev for x in scalar], error, rtol=1e-9, atol=0))
+
+    def test_z_dipole_needs_positive_redshifts(self):
+        """a single redshift <= 0 raises ValueError, in arrays those predictions are NaN."""
+        ra, dec = radian_positions()
+        model = dipole_error.ZDipoleModel()
+        for z in [0.0, -1.0]:
+            self.assertRaises(ValueError, dipole_error.z_dipole_monopole, ra[0], dec[0], z_redshift=z)
+            self.assertRaises(ValueError, dipole_error.basic_z_dipole_monopole, z_redshift=z)
+            self.assertRaises(ValueError, dipole_error.z_dipole_monopole_jacobian, z_redshift=z)
+            self.assertRaises(ValueError, model.evaluate, ra, dec, z)
+        redshifts = np.array([1.5, 0.0, -1.0])
+        with np.errstate(all="raise"):
+            nominal, error = model.evaluate(ra, dec, redshifts)
+            result = dipole_error.monte_carlo(model, ra, dec, (redshifts,), n_samples=100, seed=1)
+            jacobian = dipole_error.z_dipole_monopole_jacobian(z_redshift=redshifts)
+        for values in [nominal, error, result.mean, result.percentile(50), jacobian[2]]:
+            self.assertTrue(np.isfinite(values[0]))
+            self.assertTrue(np.isnan(values[1:]).all())
+
+class ParsePositionsTest(unittest.TestCase):
+    """Bulk and cached parsing of sexagesimal positions."""
+
+    def test_formats_agree_with_angles(self):
+        """hms/dms, space and colon separated strings all give the angles package result."""
+        ra, dec = radian_positions()
+        for ra_format, dec_format in [("%sh%sm%s", "%sd%sm%s"), ("%s %s %s", "%s %s %s"), ("%s:%s:%s", "%s:%s:%s")]:
+            alpha, delta = dipole_error.parse_positions([ra_format % tuple(r.split()) for r, d in QSO_POSITIONS], \
+                                                        [dec_format % tuple(d.split()) for r, d in QSO_POSITIONS])
+            self.assertTrue(np.allclose(alpha, ra, rtol=1e-12, atol=0))
+            self.assertTrue(np.allclose(delta, dec, rtol=1e-12, atol=0))
+
+    def test_negative_zero_degrees(self):
+        """the sign of "-00 30 00" is kept."""
+        alpha, delta = dipole_error.parse_positions(["00 00 00"], ["-00 30 00"])
+        self.assertAlmostEqual(delta[0], -angles.d2r(0.5))
+
+    def test_bad_position(self):
+        """unparseable strings raise DipoleError."""
+        self.assertRaises(dipole_error.DipoleError, dipole_error.parse_positions, ["22 20 06.757"], ["south"])
+
+    def test_radians_skip_parsing(self):
+        """scalar model functions accept positions already in radians."""
+        ra, dec = radian_positions()
+        from_strings = dipole_error.dipole_monopole(*QSO_POSITIONS[0])
+        from_radians = dipole_error.dipole_monopole(ra[0], dec[0])
+        self.assertAlmostEqual(from_strings.nominal_value, from_radians.nominal_value, places=15)
+        self.assertTrue(np.allclose(dipole_error.position_radians(*QSO_POSITIONS[0]), (ra[0], dec[0]), rtol=1e-12, atol=0))
+
+class MonteCarloTest(unittest.TestCase):
+    """Monte Carlo verification of the linear propagation."""
+
+    def test_linear_model_agrees(self):
+        """with a fixed direction the model is linear, so MC and linear errors agree."""
+        model = dipole_error.DipoleModel(DIP_RA, DIP_DEC, dipole_error.DIPOLE_AMPLITUDE, dipole_error.MONOPOLE)
+        ra, dec = radian_positions()
+        result = dipole_error.monte_carlo(model, ra, dec, n_samples=200000, seed=7)
+        self.assertTrue(np.allclose(result.std, result.error, rtol=0.01, atol=0))
+        self.assertTrue(np.allclose(result.percentile(50.0), result.nominal, rtol=0, atol=0.01 * result.error.max()))
+        self.assertTrue(np.allclose(result.percentile(84.135) - result.percentile(15.865), 2 * result.error, rtol=0.02))
+
+    def test_seed_reproducible(self):
+        """the same seed gives the same result."""
+        ra, dec = radian_positions()
+        first = dipole_error.monte_carlo(dipole_error.ZDipoleModel(), ra, dec, ([1.5, 2.0, 0.5],), n_samples=5000, seed=3)
+        second = dipole_error.monte_carlo(dipole_error.ZDipoleModel(), ra, dec, ([1.5, 2.0, 0.5],), n_samples=5000, seed=3)
+        self.assertTrue(np.array_equal(first.values, second.values))
+        self.assertTrue(np.array_equal(first.mean, second.mean))
+
+class AsymmetricErrorTest(unittest.TestCase):
+    """Split normal sampling of the asymmetric published errors."""
+
+    def test_split_normal(self):
+        """the probability above the mode is upper / (lower + upper)."""
+        draws = dipole_error.split_normal(1.0, 1.0, 3.0, 400000, np.random.RandomState(5))
+        self.assertAlmostEqual((draws > 1.0).mean(), 0.75, places=2)
+        self.assertAlmostEqual(np.median(draws[draws > 1.0]) - 1.0, 3.0 * 0.6745, places=1)
+
+    def test_symmetric_limit(self):
+        """equal lower and upper errors reproduce the symmetric propagation."""
+        ra, dec = radian_positions()
+        symmetric = dipole_error.DipoleModel()
+        asymmetric = dipole_error.DipoleModel(asymmetric_errors={'amplitude': (dipole_error.DIP_AMPLITUDE_ERR, \
+                                                                               dipole_error.DIP_AMPLITUDE_ERR)})
+        nominal, error = symmetric.evaluate(ra, dec)
+        nominal_asymmetric, lower, upper = asymmetric.evaluate_asymmetric(ra, dec)
+        self.assertTrue(np.allclose(lower, error, rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(upper, error, rtol=1e-12, atol=0))
+
+    def test_unknown_parameter(self):
+        """asymmetric errors for a parameter the model does not have raise DipoleError."""
+        self.assertRaises(dipole_error.DipoleError, dipole_error.DipoleModel, asymmetric_errors={'beta': (0.4, 0.5)})
+
+class ParallelTest(unittest.TestCase):
+    """Process-pool evaluation matches the serial run."""
+
+    def test_parallel_evaluate(self):
+        """the linear propagation is identical."""
+        ra, dec = radian_positions()
+        serial = dipole_error.RDipoleModel().evaluate(ra, dec, [1.3, 9.0, 5.0])
+        parallel = dipole_parallel.parallel_evaluate(dipole_error.RDipoleModel(), ra, dec, ([1.3, 9.0, 5.0],), workers=2)
+        self.assertTrue(np.array_equal(serial[0], parallel[0]))
+        self.assertTrue(np.array_equal(serial[1], parallel[1]))
+
+    def test_parallel_monte_carlo(self):
+        """the Monte Carlo percentiles are identical for the same seed."""
+        state = np.random.RandomState(2)
+        ra, dec = state.uniform(0, 2 * np.pi, 500), np.arcsin(state.uniform(-1, 1, 500))
+        model = dipole_error.DipoleModel(asymmetric_errors=dipole_error.DIPOLE_ASYMMETRIC_ERRORS)
+        serial = dipole_error.monte_carlo(model, ra, dec, n_samples=4000, seed=11, chunk_size=2 ** 16)
+        parallel = dipole_parallel.parallel_monte_carlo(model, ra, dec, n_samples=4000, seed=11, \
+                                                        chunk_size=2 ** 16, workers=3)
+        self.assertTrue(np.array_equal(serial.values, parallel.values))
+        self.assertTrue(np.array_equal(serial.std, parallel.std))
+
+class CatalogTest(unittest.TestCase):
+    """The streaming catalog command line tool."""
+
+    TABLE = ["# name RA DEC z da/a stat sys r", \
+             "HE2217-2818, 22 20 06.757, -28 03 23.34, 1.6919, -1.09e-6, 2.35e-6, 1.65e-6, 9.757", \
+             "", \
+             "J0000, 00:10:00, +10:00:00, 1.0, 1e-6, 1e-6, 0.5e-6, 8.0"]
+
+    def test_matches_scalar_functions(self):
+        """predictions and the sigma range agree with the scalar functions, across chunk boundaries."""
+        output = StringIO.StringIO()
+        self.assertEqual(dipole_catalog.process(self.TABLE, output, chunk_rows=1), 2)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0].split(","), list(dipole_catalog.OUTPUT_COLUMNS))
+        row = dict(zip(dipole_catalog.OUTPUT_COLUMNS, lines[1].split(",")))
+        prediction = dipole_error.dipole_monopole("22 20 06.757", "-28 03 23.34")
+        r_prediction = dipole_error.r_dipole_monopole("22 20 06.757", "-28 03 23.34", radial_distance=9.757)
+        sigma = dipole_error.statistical_difference_systematic(prediction, uncertainties.ufloat(-1.09e-6, 2.35e-6), 1.65e-6)
+        self.assertAlmostEqual(float(row["dipole"]) / prediction.nominal_value, 1.0, places=5)
+        self.assertAlmostEqual(float(row["r_dipole_err"]) / r_prediction.std_dev, 1.0, places=5)
+        self.assertAlmostEqual(float(row["sigma_min"]), sigma[0], places=5)
+        self.assertAlmostEqual(float(row["sigma_max"]), sigma[1], places=5)
+
+    def test_compare_z_dipole(self):
+        """the command line z-dipole errors and sigma range use the errors of every z-dipole parameter."""
+        directory = tempfile.mkdtemp()
+        try:
+            table, predictions = os.path.join(directory, "table.csv"), os.path.join(directory, "predictions.csv")
+            with open(table, "w") as handle:
+                handle.write("\n".join(self.TABLE) + "\n")
+            self.assertEqual(dipole_catalog.main(["--compare", "z_dipole", "--precision", "12", table, predictions]), 0)
+            with open(predictions) as handle:
+                row = dict(zip(dipole_catalog.OUTPUT_COLUMNS, handle.read().splitlines()[1].split(",")))
+        finally:
+            shutil.rmtree(directory)
+        ra, dec = dipole_error.parse_positions(["22 20 06.757"], ["-28 03 23.34"])
+        nominal, error = dipole_error.ZDipoleModel().evaluate(ra, dec, 1.6919)
+        sigma = dipole_error.statistical_difference_systematic( \
+            uncertainties.ufloat(nominal[0], error[0]), uncertainties.ufloat(-1.09e-6, 2.35e-6), 1.65e-6)
+        self.assertAlmostEqual(float(row["z_dipole_err"]) / error[0], 1.0, places=9)
+        self.assertAlmostEqual(float(row["sigma_min"]), sigma[0], places=9)
+        self.assertAlmostEqual(float(row["sigma_max"]), sigma[1], places=9)
+
+    def test_names_with_commas_and_quotes(self):
+        """names holding delimiters or quotes are quoted, so the columns stay aligned."""
+        table = ['"Q 0000-26, comp. ""a""", 00:10:00, +10:00:00, 1.0, 1e-6, 1e-6, 0.5e-6, 8.0', \
+                 "J0001, 00:20:00, +11:00:00, 1.2, 1e-6, 1e-6, 0.5e-6, 8.0"]
+        output = StringIO.StringIO()
+        self.assertEqual(dipole_catalog.process(table, output), 2)
+        rows = list(csv.reader(StringIO.StringIO(output.getvalue())))
+        self.assertEqual([len(row) for row in rows], [len(dipole_catalog.OUTPUT_COLUMNS)] * 3)
+        self.assertEqual([row[0] for row in rows[1:]], ['Q 0000-26, comp. "a"', "J0001"])
+        self.assertEqual(rows[1][1], "1")
+
+    def test_bad_row(self):
+        """rows with missing columns raise DipoleError."""
+        self.assertRaises(dipole_error.DipoleError, dipole_catalog.process, ["a 22h20m -28d03m 1.5 0"], StringIO.StringIO())
+
+class SkyMapTest(unittest.TestCase):
+    """Equal-area prediction maps."""
+
+    def test_map_matches_model(self):
+        """every pixel holds the model prediction at its centre, and pixel_index finds it again."""
+        directory = tempfile.mkdtemp()
+        try:
+            model = dipole_error.RDipoleModel()
+            filename = os.path.join(directory, "r_dipole.npy")
+            sky_map = dipole_skymap.sky_map(model, filename, n_dec=20, sightline_terms=(5.0,), chunk_size=100)
+            ra, dec = dipole_skymap.pixel_centers(20, 40)
+            nominal, error = model.evaluate(ra, dec, 5.0)
+            self.assertEqual(sky_map.shape, (2, 20, 40))
+            self.assertTrue(np.array_equal(sky_map[0], nominal))
+            self.assertTrue(np.array_equal(dipole_skymap.load_sky_map(filename)[1], error))
+            self.assertTrue(np.array_equal(dipole_skymap.pixel_index(ra, dec, 20, 40).ravel(), np.arange(800)))
+            del sky_map
+        finally:
+            shutil.rmtree(directory)
+
+    def test_equal_area(self):
+        """the rings are uniform in sin(DEC)."""
+        self.assertTrue(np.allclose(np.diff(np.sin(dipole_skymap.ring_declinations(50))), 2.0 / 50))
+
+class DipoleFitTest(unittest.TestCase):
+    """Linear least-squares fit of eq. 15."""
+
+    def setUp(self):
+        state = np.random.RandomState(8)
+        self.ra, self.dec = state.uniform(0, 2 * np.pi, 2000), np.arcsin(state.uniform(-1, 1, 2000))
+        self.errors = state.uniform(1e-6, 3e-6, 2000)
+        nominal, _ = dipole_error.DipoleModel().evaluate(self.ra, self.dec)
+        self.values = nominal + state.normal(0, 1, 2000) * self.errors
+
+    def test_matches_lstsq(self):
+        """the solution and covariance equal those of a generic weighted least-squares solve."""
+        fit = dipole_fit.fit_dipole(self.ra, self.dec, self.values, self.errors, chunk_size=300)
+        design = dipole_fit.design_matrix(self.ra, self.dec) / self.errors[:, np.newaxis]
+        components = np.linalg.lstsq(design, self.values / self.errors, rcond=None)[0]
+        self.assertTrue(np.allclose(fit.components, components, rtol=1e-8, atol=1e-14))
+        self.assertTrue(np.allclose(fit.covariance, np.linalg.inv(design.T.dot(design)), rtol=1e-8, atol=0))
+        self.assertAlmostEqual(fit.chi2, ((design.dot(components) - self.values / self.errors) ** 2).sum(), places=6)
+
+    def test_recovers_published_dipole(self):
+        """the fit recovers the parameters the data were drawn from, as ufloats dipole_monopole accepts."""
+        fit = dipole_fit.fit_dipole(self.ra, self.dec, self.values, self.errors)
+        for fitted, true in zip(fit.parameters(), (dipole_error.DIP_RA, dipole_error.DIP_DEC, \
+                                                   dipole_error.DIP_AMPLITUDE, dipole_error.DIP_MONOPOLE)):
+            self.assertTrue(abs(fitted.nominal_value - true) < 4 * fitted.std_dev)
+        prediction = dipole_error.dipole_monopole(*(QSO_POSITIONS[0] + fit.parameters()))
+        self.assertTrue(prediction.std_dev > 0)
+
+    def test_unconstrained(self):
+        """too few sightlines raise DipoleError."""
+        self.assertRaises(dipole_error.DipoleError, dipole_fit.fit_dipole, self.ra[:3], self.dec[:3], \
+                          self.values[:3], self.errors[:3])
+
+class DipoleAccumulatorTest(unittest.TestCase):
+    """Incremental fits from the running normal equations."""
+
+    def setUp(self):
+        state = np.random.RandomState(9)
+        self.ra, self.dec = state.uniform(0, 2 * np.pi, 3000), np.arcsin(state.uniform(-1, 1, 3000))
+        self.redshifts = state.uniform(0.5, 3.0, 3000)
+        self.errors = state.uniform(1e-6, 3e-6, 3000)
+        nominal, _ = dipole_error.ZDipoleModel().evaluate(self.ra, self.dec, self.redshifts)
+        self.values = nominal + state.normal(0, 1, 3000) * self.errors
+
+    def batch(self, start, stop):
+        return (self.ra[start:stop], self.dec[start:stop], self.values[start:stop], \
+                self.errors[start:stop], self.redshifts[start:stop])
+
+    def test_batches_merge_and_remove(self):
+        """adding batches, merging accumulators and removing a batch give the direct fits."""
+        beta = dipole_error.Z_DIP_BETA
+        full = dipole_fit.fit_dipole(*self.batch(0, 3000), beta=beta)
+        first = dipole_fit.DipoleAccumulator(beta).add(*self.batch(0, 1000)).add(*self.batch(1000, 2000))
+        second = pickle.loads(pickle.dumps(dipole_fit.DipoleAccumulator(beta).add(*self.batch(2000, 3000))))
+        merged = first + second
+        self.assertEqual(merged.n_measurements, 3000)
+        self.assertTrue(np.allclose(merged.fit().components, full.components, rtol=1e-9, atol=1e-16))
+        self.assertTrue(np.allclose(merged.fit().covariance, full.covariance, rtol=1e-9, atol=0))
+        partial = dipole_fit.fit_dipole(*self.batch(0, 2000), beta=beta)
+        merged.remove(*self.batch(2000, 3000))
+        self.assertTrue(np.allclose(merged.fit().components, partial.components, rtol=1e-6, atol=1e-14))
+
+    def test_z_dipole_fit(self):
+        """the eq. 18 fit recovers the prefactor and returns a ZDipoleModel."""
+        fit = dipole_fit.DipoleAccumulator(dipole_error.Z_DIP_BETA).add(*self.batch(0, 3000)).fit()
+        self.assertTrue(abs(fit.amplitude.nominal_value - dipole_error.Z_DIP_PREFACTOR) < 4 * fit.amplitude.std_dev)
+        self.assertTrue(isinstance(fit.model(), dipole_error.ZDipoleModel))
+        self.assertRaises(dipole_error.DipoleError, dipole_fit.DipoleAccumulator().merge, dipole_fit.DipoleAccumulator(0.5))
+
+class ResampleTest(unittest.TestCase):
+    """Bootstrap and jackknife of the dipole fit."""
+
+    def setUp(self):
+        state = np.random.RandomState(10)
+        self.ra, self.dec = state.uniform(0, 2 * np.pi, 400), np.arcsin(state.uniform(-1, 1, 400))
+        self.errors = state.uniform(1e-6, 3e-6, 400)
+        nominal, _ = dipole_error.DipoleModel().evaluate(self.ra, self.dec)
+        self.values = nominal + state.normal(0, 1, 400) * self.errors
+
+    def test_bootstrap(self):
+        """resamples are reproducible, the same across workers, and scatter like the fit errors."""
+        serial = dipole_resample.bootstrap(self.ra, self.dec, self.values, self.errors, n_resamples=600, \
+                                           seed=1, chunk_size=400 * 70)
+        parallel = dipole_resample.bootstrap(self.ra, self.dec, self.values, self.errors, n_resamples=600, \
+                                             seed=1, chunk_size=400 * 70, workers=2)
+        self.assertTrue(np.array_equal(serial.components, parallel.components))
+        ratio = np.sqrt(np.diag(serial.covariance) / np.diag(serial.fit.covariance))
+        self.assertTrue(np.all(abs(ratio - 1.0) < 0.2))
+
+    def test_bootstrap_records_seed(self):
+        """a run with a random seed records it, and the recorded seed reproduces the run."""
+        first = dipole_resample.bootstrap(self.ra, self.dec, self.values, self.errors, n_resamples=50)
+        self.assertTrue(isinstance(first.seed, int))
+        again = dipole_resample.bootstrap(self.ra, self.dec, self.values, self.errors, n_resamples=50, seed=first.seed)
+        self.assertTrue(np.array_equal(first.components, again.components))
+        self.assertEqual(again.seed, first.seed)
+
+    def test_jackknife_matches_refits(self):
+        """the rank-one updates equal refitting without each measurement."""
+        result = dipole_resample.jackknife(self.ra, self.dec, self.values, self.errors)
+        for i in (0, 123, 399):
+            keep = np.arange(400) != i
+            refit = dipole_fit.fit_dipole(self.ra[keep], self.dec[keep], self.values[keep], self.errors[keep])
+            self.assertTrue(np.allclose(result.components[i], refit.components, rtol=1e-8, atol=1e-16))
+        self.assertAlmostEqual(result.errors()['amplitude'] / result.fit.amplitude.std_dev, 1.0, places=0)
+
+class NullTestTest(unittest.TestCase):
+    """Isotropy null test by scrambled skies."""
+
+    def setUp(self):
+        state = np.random.RandomState(11)
+        self.ra, self.dec = state.uniform(0, 2 * np.pi, 200), np.arcsin(state.uniform(-1, 1, 200))
+        self.errors = state.uniform(3e-6, 9e-6, 200)
+        nominal, _ = dipole_error.DipoleModel().evaluate(self.ra, self.dec)
+        self.values = nominal + state.normal(0, 1, 200) * self.errors
+        self.noise = state.normal(0, 1, 200) * self.errors
+
+    def test_checkpoint_resume(self):
+        """a run resumed from a checkpoint, on worker processes, equals an uninterrupted run."""
+        directory = tempfile.mkdtemp()
+        try:
+            checkpoint = os.path.join(directory, "null.npz")
+            full = dipole_null.null_test(self.ra, self.dec, self.values, self.errors, n_realizations=1500, \
+                                         seed=2, chunk_size=200 * 100)
+            dipole_null.null_test(self.ra, self.dec, self.values, self.errors, n_realizations=450, seed=2, \
+                                  chunk_size=200 * 100, checkpoint=checkpoint, checkpoint_blocks=2)
+            resumed = dipole_null.null_test(self.ra, self.dec, self.values, self.errors, n_realizations=1500, \
+                                            seed=2, chunk_size=200 * 100, checkpoint=checkpoint, workers=2)
+            self.assertTrue(np.array_equal(full.amplitudes, resumed.amplitudes))
+            self.assertRaises(dipole_error.DipoleError, dipole_null.null_test, self.ra, self.dec, self.values, \
+                              self.errors, n_realizations=10, seed=3, chunk_size=200 * 100, checkpoint=checkpoint)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_p_values(self):
+        """the published dipole is significant here, and pure noise is not."""
+        self.assertTrue(dipole_null.null_test(self.ra, self.dec, self.values, self.errors, 1000, seed=4).p_value < 0.01)
+        self.assertTrue(dipole_null.null_test(self.ra, self.dec, self.noise, self.errors, 1000, seed=4).p_value > 0.01)
+
+class DirectionScanTest(unittest.TestCase):
+    """Adaptive Delta chi-squared scan of the dipole direction."""
+
+    def test_matches_uniform_grid(self):
+        """the refined scan has the contour areas of the uniform grid at its finest resolution."""
+        state = np.random.RandomState(12)
+        ra, dec = state.uniform(0, 2 * np.pi, 300), np.arcsin(state.uniform(-1, 1, 300))
+        errors = state.uniform(2e-6, 6e-6, 300)
+        nominal, _ = dipole_error.DipoleModel().evaluate(ra, dec)
+        values = nominal + state.normal(0, 1, 300) * errors
+        scan = dipole_scan.direction_scan(ra, dec, values, errors, n_dec=8, depth=4)
+        self.assertTrue(len(scan.delta_chi2) < 128 * 256 / 4)
+        grid_ra, grid_dec = dipole_skymap.pixel_centers(128, 256)
+        normal_equations = dipole_fit.normal_equations(ra, dec, values, errors)
+        delta_chi2 = dipole_scan._ChiSquared(*normal_equations[:3])( \
+            dipole_error._unit_vector(grid_ra, grid_dec).reshape(-1, 3)) - scan.fit.chi2
+        for level in dipole_scan.DELTA_CHI2_LEVELS:
+            self.assertAlmostEqual(scan.area(level), (delta_chi2 <= level).sum() * dipole_skymap.pixel_area(128, 256))
+        self.assertAlmostEqual(scan.pixel_area.sum(), 4 * np.pi)
+        self.assertTrue(delta_chi2.min() >= -1e-9)
+
+class SightlineIndexTest(unittest.TestCase):
+    """Cone, annulus and nearest-neighbour queries."""
+
+    def setUp(self):
+        state = np.random.RandomState(13)
+        self.ra, self.dec = state.uniform(0, 2 * np.pi, 5000), np.arcsin(state.uniform(-1, 1, 5000))
+        self.vectors = dipole_error._unit_vector(self.ra, self.dec)
+        self.index = dipole_index.SightlineIndex(self.ra, self.dec)
+        self.state = state
+
+    def test_annulus_matches_linear_scan(self):
+        """queries anywhere on the sky, of any size, find exactly the sightlines a full scan finds."""
+        for trial in range(60):
+            center_ra, center_dec = self.state.uniform(0, 2 * np.pi), np.arcsin(self.state.uniform(-1, 1))
+            outer = self.state.uniform(0, np.pi) if trial % 2 else self.state.uniform(0, 0.2)
+            cos_theta = self.vectors.dot(dipole_error._unit_vector(center_ra, center_dec))
+            found = self.index.annulus(center_ra, center_dec, outer / 3, outer, antipodal=trial % 3 == 0)
+            inside = (cos_theta >= np.cos(outer)) & (cos_theta <= np.cos(outer / 3))
+            if trial % 3 == 0:
+                inside |= (-cos_theta >= np.cos(outer)) & (-cos_theta <= np.cos(outer / 3))
+            self.assertTrue(np.array_equal(found, np.nonzero(inside)[0]))
+
+    def test_nearest(self):
+        """the k nearest neighbours agree with a full sort."""
+        query_ra, query_dec = self.state.uniform(0, 2 * np.pi, 20), np.arcsin(self.state.uniform(-1, 1, 20))
+        indices, separations = self.index.nearest(query_ra, query_dec, k=4)
+        cos_theta = dipole_error._unit_vector(query_ra, query_dec).dot(self.vectors.T)
+        self.assertTrue(np.array_equal(indices, np.argsort(-cos_theta, axis=1)[:, :4]))
+        self.assertTrue(np.all(np.diff(separations, axis=1) >= 0))
+
+    def test_nearest_batched(self):
+        """many queries, grouped by position and including the poles, find the same neighbours as a full sort."""
+        query_ra = np.concatenate((self.state.uniform(0, 2 * np.pi, 800), self.ra[:100], [0.0, 1.0]))
+        query_dec = np.concatenate((np.arcsin(self.state.uniform(-1, 1, 800)), self.dec[:100], [np.pi / 2, -np.pi / 2]))
+        cos_theta = dipole_error._unit_vector(query_ra, query_dec).dot(self.vectors.T)
+        ranked = np.argsort(-cos_theta, axis=1)
+        for k in (1, 7):
+            indices, separations = self.index.nearest(query_ra, query_dec, k=k)
+            self.assertTrue(np.array_equal(indices, ranked[:, :k]))
+            self.assertTrue(np.allclose(np.cos(separations), np.take_along_axis(cos_theta, indices, axis=1), \
+                                        rtol=0, atol=1e-12))
+
+    def test_subset(self):
+        """the array functions evaluate only the queried sightlines."""
+        near_axis = self.index.cone("17 18 00", "-61 00 00", np.radians(30), antipodal=True)
+        nominal, error = dipole_error.z_dipole_monopole_array(self.ra, self.dec, z_redshift=np.linspace(0.5, 3, 5000), \
+                                                              subset=near_axis)
+        expected = dipole_error.z_dipole_monopole_array(self.ra[near_axis], self.dec[near_axis], \
+                                                        z_redshift=np.linspace(0.5, 3, 5000)[near_axis])
+        self.assertTrue(np.array_equal(nominal, expected[0]))
+        measured = self.state.normal(0, 1e-5, 5000)
+        minimum = dipole_error.statistical_difference_systematic_array(measured, 1e-6, 0.0, 1e-6, 1e-6, subset=near_axis)[0]
+        expected = dipole_error.statistical_difference_systematic_array(measured[near_axis], 1e-6, 0.0, 1e-6, 1e-6)[0]
+        self.assertTrue(np.array_equal(minimum, expected))
+
+    def test_subset_models_and_sampling(self):
+        """model methods, Monte Carlo and the parallel paths take the same subset= as the array functions."""
+        near_axis = self.index.cone("17 18 00", "-61 00 00", np.radians(10))
+        redshifts = np.linspace(0.5, 3, 5000)
+        model = dipole_error.ZDipoleModel()
+        expected = model.evaluate(self.ra[near_axis], self.dec[near_axis], redshifts[near_axis])
+        for result in (model.evaluate(self.ra, self.dec, redshifts, subset=near_axis), \
+                       dipole_parallel.parallel_evaluate(model, self.ra, self.dec, (redshifts,), workers=1, \
+                                                         subset=near_axis)):
+            self.assertTrue(np.array_equal(result[0], expected[0]) and np.array_equal(result[1], expected[1]))
+        self.assertEqual(len(model.evaluate_asymmetric(self.ra, self.dec, 1.5, subset=near_axis)[0]), len(near_axis))
+        self.assertRaises(TypeError, model.evaluate, self.ra, self.dec, redshifts, subst=near_axis)
+        sampled = dipole_error.monte_carlo(model, self.ra, self.dec, (redshifts,), n_samples=500, seed=2, subset=near_axis)
+        reference = dipole_error.monte_carlo(model, self.ra[near_axis], self.dec[near_axis], (redshifts[near_axis],), \
+                                             n_samples=500, seed=2)
+        self.assertTrue(np.array_equal(sampled.mean, reference.mean))
+        parallel = dipole_parallel.parallel_monte_carlo(model, self.ra, self.dec, (redshifts,), n_samples=500, seed=2, \
+                                                        workers=1, subset=near_axis)
+        self.assertTrue(np.allclose(parallel.mean, reference.mean, rtol=1e-12, atol=0))
+
+class EvaluateModelsTest(unittest.TestCase):
+    """Several models evaluated together."""
+
+    def test_matches_array_functions(self):
+        """every column equals the separate array function, for a chosen subset of models."""
+        ra, dec = radian_positions()
+        redshifts, distances = np.array([1.5, 2.0, 0.7]), np.array([9.0, 10.0, 6.0])
+        result = dipole_error.evaluate_models(ra, dec, redshifts, distances)
+        self.assertEqual(result.dtype.names, ('dipole', 'dipole_err', 'z_dipole', 'z_dipole_err', 'r_dipole', 'r_dipole_err'))
+        for name, expected in (('dipole', dipole_error.dipole_monopole_array(ra, dec)), \
+                               ('z_dipole', dipole_error.z_dipole_monopole_array(ra, dec, z_redshift=redshifts)), \
+                               ('r_dipole', dipole_error.r_dipole_monopole_array(ra, dec, radial_distance=distances))):
+            self.assertTrue(np.array_equal(result[name], expected[0]))
+            self.assertTrue(np.array_equal(result[name + '_err'], expected[1]))
+        fitted = {'mine': dipole_error.ZDipoleModel(prefactor=1e-5)}
+        self.assertTrue(np.allclose(dipole_error.evaluate_models(ra, dec, redshifts, models=fitted)['mine'], \
+                                    fitted['mine'].evaluate(ra, dec, redshifts)[0], rtol=1e-14, atol=0))
+        self.assertRaises(dipole_error.DipoleError, dipole_error.evaluate_models, ra, dec, models=('q_dipole',))
+
+    def test_published_models_propagate_every_error(self):
+        """the published models carry the errors of all their parameters, as the model classes do."""
+        ra, dec = radian_positions()
+        redshifts, distances = np.array([1.6919, 2.0, 0.7]), np.array([9.757, 10.0, 6.0])
+        result = dipole_error.evaluate_models(ra, dec, redshifts, distances)
+        for name, model, terms in (('dipole', dipole_error.DipoleModel(), ()), \
+                                   ('z_dipole', dipole_error.ZDipoleModel(), (redshifts,)), \
+                                   ('r_dipole', dipole_error.RDipoleModel(), (distances,))):
+            nominal, error = model.evaluate(ra, dec, *terms)
+            self.assertTrue(np.allclose(result[name], nominal, rtol=1e-12, atol=0))
+            self.assertTrue(np.allclose(result[name + '_err'], error, rtol=1e-12, atol=0))
+
+class SightlineGroupingTest(unittest.TestCase):
+    """Rows on the same sightline share the direction-dependent work."""
+
+    def test_group_sightlines(self):
+        """text positions are fully deduplicated, positions in radians by runs."""
+        ra = np.array(["22 20 06.757", "00 10 00", "22 20 06.757", "22 20 06.757"])
+        dec = np.array(["-28 03 23.34", "+10 00 00", "-28 03 23.34", "+10 00 00"])
+        unique_ra, unique_dec, inverse = dipole_error._group_sightlines(ra, dec)
+        self.assertEqual(len(unique_ra), 3)
+        self.assertTrue(np.array_equal(unique_ra[inverse], ra) and np.array_equal(unique_dec[inverse], dec))
+        unique_ra, unique_dec, inverse = dipole_error._group_sightlines([1.0, 1.0, 2.0, 1.0], [0.5, 0.5, 0.5, 0.5])
+        self.assertTrue(np.array_equal(unique_ra, [1.0, 2.0, 1.0]) and np.array_equal(inverse, [0, 0, 1, 2]))
+        self.assertTrue(dipole_error._group_sightlines([1.0, 2.0], [0.5, 0.5])[2] is None)
+
+    def test_multi_absorber_catalog(self):
+        """predictions for repeated sightlines equal those computed row by row."""
+        positions = [QSO_POSITIONS[i] for i in (0, 0, 0, 1, 2, 2, 1, 0)]
+        ra, dec = np.array([p[0] for p in positions]), np.array([p[1] for p in positions])
+        redshifts = np.linspace(0.5, 3.0, len(positions))
+        grouped = dipole_error.evaluate_models(ra, dec, redshifts, 2 * redshifts)
+        for i, (r, d) in enumerate(positions):
+            single = dipole_error.evaluate_models(np.array([r]), np.array([d]), redshifts[i:i + 1], 2 * redshifts[i:i + 1])
+            for name in grouped.dtype.names:
+                self.assertEqual(grouped[name][i], single[name][0])
+
+class DistanceTest(unittest.TestCase):
+    """Redshift to distance tables."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved = dipole_distance.DISTANCE_CACHE, dict(dipole_distance._TABLES)
+        dipole_distance.DISTANCE_CACHE = self.directory
+        dipole_distance._TABLES.clear()
+
+    def tearDown(self):
+        dipole_distance.DISTANCE_CACHE = self.saved[0]
+        dipole_distance._TABLES.clear()
+        dipole_distance._TABLES.update(self.saved[1])
+        shutil.rmtree(self.directory)
+
+    def test_published_distance(self):
+        """the default cosmology gives the light-travel distance of HE2217-2818 in King et al. 2012."""
+        self.assertAlmostEqual(dipole_distance.radial_distance(1.6919), 9.757, places=3)
+
+    def test_against_direct_integration(self):
+        """interpolated distances and derivatives agree with the integral and its finite differences."""
+        cosmology = dipole_distance.Cosmology(67.0, 0.32, 0.6)
+        z = np.linspace(0.0, 6.0, 600001)
+        slope = dipole_distance._integrand(cosmology, "comoving", z)
+        direct = np.concatenate(([0.0], np.cumsum((slope[1:] + slope[:-1]) / 2.0 * np.diff(z))))
+        table = dipole_distance.distance_table(cosmology, "comoving")
+        self.assertTrue(np.allclose(table(z[::997]), direct[::997], rtol=1e-9, atol=1e-9))
+        step = 1e-5
+        points = np.array([0.01, 0.7, 2.5, 5.9])
+        self.assertTrue(np.allclose((table(points + step) - table(points - step)) / (2 * step), \
+                                    table.derivative(points), rtol=1e-7))
+        self.assertTrue(np.isnan(table(np.array([np.nan, 1.0]))[0]))
+        self.assertRaises(dipole_error.NegativeError, table, -0.1)
+        self.assertRaises(dipole_error.DipoleError, table, 25.0)
+
+    def test_disk_cache(self):
+        """a table is saved once and loaded by later sessions."""
+        table = dipole_distance.distance_table()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        dipole_distance._TABLES.clear()
+        loaded = dipole_distance.distance_table()
+        self.assertTrue(loaded is not table and np.array_equal(loaded.distances, table.distances))
+
+    def test_r_dipole_from_redshift(self):
+        """the r-dipole driven from redshifts, also in the catalog tool."""
+        ra, dec, z = np.array([0.3, 4.0]), np.array([-0.5, 0.2]), np.array([1.6919, 0.8])
+        values, errors = dipole_distance.r_dipole_monopole_redshift_array(ra, dec, z)
+        expected = dipole_error.r_dipole_monopole_array(ra, dec, radial_distance=dipole_distance.radial_distance(z))
+        self.assertTrue(np.array_equal(values, expected[0]) and np.array_equal(errors, expected[1]))
+        table = [row.rsplit(",", 1)[0] for row in CatalogTest.TABLE]
+        for distance, filled in ((None, False), ("light_travel", True)):
+            output = StringIO.StringIO()
+            dipole_catalog.process(table, output, distance=distance)
+            row = dict(zip(dipole_catalog.OUTPUT_COLUMNS, output.getvalue().splitlines()[1].split(",")))
+            self.assertEqual(np.isfinite(float(row["r_dipole"])), filled)
+        r_prediction = dipole_error.r_dipole_monopole("22 20 06.757", "-28 03 23.34", radial_distance=9.757)
+        self.assertAlmostEqual(float(row["r_dipole"]) / r_prediction.nominal_value, 1.0, places=3)
+
+def _cache_worker(arguments):
+    directory, seed = arguments
+    cache = dipole_cache.PredictionCache(directory, max_bytes=5000)
+    ra = np.random.RandomState(seed % 3).uniform(0, 6, 100)
+    for _ in range(20):
+        values, errors = cache.evaluate(dipole_error.DipoleModel(), ra, ra / 7)
+    return float(values.sum())
+
+class PredictionCacheTest(unittest.TestCase):
+    """The on-disk prediction cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        state = np.random.RandomState(4)
+        self.ra, self.dec = state.uniform(0, 2 * np.pi, 300), np.arcsin(state.uniform(-1, 1, 300))
+        self.z = state.uniform(0.5, 3.0, 300)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hits_and_misses(self):
+        """hits are memory-mapped copies of the predictions; other parameters or positions miss."""
+        cache = dipole_cache.PredictionCache(self.directory)
+        expected = dipole_error.evaluate_models(self.ra, self.dec, self.z, 2 * self.z)
+        for _ in range(2):
+            result = cache.evaluate_models(self.ra, self.dec, self.z, 2 * self.z)
+            for name in expected.dtype.names:
+                self.assertTrue(np.array_equal(result[name], expected[name]))
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        values, errors = cache.evaluate(dipole_error.DipoleModel(), self.ra, self.dec)
+        self.assertFalse(isinstance(values, np.memmap))
+        values, errors = cache.evaluate(dipole_error.DipoleModel(), self.ra, self.dec)
+        self.assertTrue(isinstance(values, np.memmap) and np.array_equal(values, expected["dipole"]))
+        cache.evaluate(dipole_error.DipoleModel(amplitude=uncertainties.ufloat(1e-5, 3e-6)), self.ra, self.dec)
+        cache.evaluate(dipole_error.DipoleModel(), self.ra[::-1], self.dec[::-1])
+        self.assertEqual(cache.misses, 6)
+
+    def test_stored_shapes(self):
+        """values and errors of any shape, scalars included, come back with their shape."""
+        cache = dipole_cache.PredictionCache(self.directory)
+        values, errors = np.arange(6.0).reshape(3, 2), 2 * np.ones((3, 2))
+        for result in (cache.put("matrix", values, errors), cache.get("matrix")):
+            self.assertTrue(np.array_equal(result[0], values) and np.array_equal(result[1], errors))
+        for result in (cache.put("scalar", 1.5, 0.25), cache.get("scalar")):
+            self.assertEqual((np.shape(result[0]), np.shape(result[1])), ((), ()))
+            self.assertEqual((float(result[0]), float(result[1])), (1.5, 0.25))
+        broadcast = cache.put("broadcast", np.ones((2, 3)), 0.5)
+        self.assertTrue(np.array_equal(broadcast[1], 0.5 * np.ones((2, 3))))
+
+    def test_object_arrays_hash_content(self):
+        """object arrays of strings are keyed on the strings, not on the addresses of the objects."""
+        one = np.array(["22 20 06.757", "00 10 00"], dtype=object)
+        two = np.array(["22 20 0" + "6.757", "".join(["00 ", "10 00"])], dtype=object)
+        self.assertFalse(one[0] is two[0])
+        self.assertEqual(dipole_cache.array_digest(one), dipole_cache.array_digest(two))
+        self.assertEqual(dipole_cache.array_digest(one), dipole_cache.array_digest(np.array(list(one))))
+        self.assertNotEqual(dipole_cache.array_digest(one), dipole_cache.array_digest(one[::-1]))
+        cache = dipole_cache.PredictionCache(self.directory)
+        dec = np.array(["-28 03 23.34", "+10 00 00"], dtype=object)
+        first = cache.evaluate(dipole_error.DipoleModel(), one, dec)
+        second = cache.evaluate(dipole_error.DipoleModel(), two, np.array([str(x) for x in dec], dtype=object))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertTrue(np.array_equal(first[0], second[0]))
+
+    def test_lru_eviction(self):
+        """the least recently used entries go first when the cache is full."""
+        entry = 2 * 8 * len(self.ra) + 128
+        cache = dipole_cache.PredictionCache(self.directory, max_bytes=2 * entry)
+        model = dipole_error.DipoleModel()
+        for i in range(2):
+            cache.evaluate(model, self.ra + i, self.dec)
+            os.utime(cache._path(dipole_cache.prediction_key(model, self.ra + i, self.dec)), (i, i))
+        cache.evaluate(model, self.ra + 0, self.dec)
+        cache.evaluate(model, self.ra + 2, self.dec)
+        self.assertTrue(cache.size() <= 2 * entry)
+        cache.evaluate(model, self.ra + 0, self.dec)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        cache.evaluate(model, self.ra + 1, self.dec)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_concurrent_processes(self):
+        """processes sharing a small cache always read complete entries."""
+        pool = multiprocessing.Pool(4)
+        try:
+            sums = pool.map(_cache_worker, [(self.directory, seed) for seed in range(8)])
+        finally:
+            pool.terminate()
+        self.assertEqual(sums, [_cache_worker((tempfile.mkdtemp(dir=self.directory), seed)) for seed in range(8)])
+
+class ImportTest(unittest.TestCase):
+    """Importing dipole_error does no model work and leaves optional packages unimported."""
+
+    def test_import_is_cheap(self):
+        """a fresh interpreter imports dipole_error without angles, model builds or wraps."""
+        script = "import time; start = time.time(); import dipole_error, sys; " \
+                 "print time.time() - start, 'angles' in sys.modules, len(dipole_error._MODEL_CACHE), " \
+                 "dipole_error.wrap_sep._wrapped is None"
+        output = subprocess.check_output([sys.executable, "-c", script], \
+                                         cwd=os.path.dirname(os.path.abspath(dipole_error.__file__)))
+        seconds, angles_imported, models, lazy = output.split()
+        self.assertEqual((angles_imported, models, lazy), ("False", "0", "True"))
+        # numpy and uncertainties are most of this; loose enough for a loaded machine
+        self.assertTrue(float(seconds) < 5.0)
+        uncertain = dipole_error.wrap_sep(uncertainties.ufloat(1.0, 0.1), 0.3, 2.0, -0.2)
+        self.assertAlmostEqual(uncertain.nominal_value, angles.sep(1.0, 0.3, 2.0, -0.2))
+
+class BenchmarkTest(unittest.TestCase):
+    """The benchmark suite and its baseline comparison."""
+
+    def test_run_and_compare(self):
+        """results cover every size, and slower runs are flagged against the baseline."""
+        results = benchmark.run(max_size=100, only=["dipole_monopole", "fit_dipole"])
+        self.assertEqual([(r["name"], r["size"]) for r in results], \
+                         [("import", 1)] + [(name, size) for name in ("dipole_monopole", "fit_dipole") \
+                                            for size in (1, 10, 100)])
+        baseline = dict(metadata=benchmark.metadata(), results=results)
+        slower = [dict(entry, seconds=entry["seconds"] * (2.0 if entry["name"] == "fit_dipole" else 1.0)) \
+                  for entry in results]
+        flagged = [(name, size) for name, size, _, regressed in benchmark.compare(slower, baseline) if regressed]
+        self.assertEqual(flagged, [("fit_dipole", 1), ("fit_dipole", 10), ("fit_dipole", 100)])
+
+class InstrumentationTest(unittest.TestCase):
+    """Stage timers and counters of the hot paths."""
+
+    def test_counts_and_export(self):
+        """rows are counted per stage, the originals come back, and pstats reads the export."""
+        positions = [QSO_POSITIONS[i] for i in (0, 0, 1, 2, 2, 2)]
+        ra, dec = np.array([p[0] for p in positions]), np.array([p[1] for p in positions])
+        originals = dipole_error._unit_vector, dipole_error.DipoleModel.__dict__['_model']
+        with dipole_instrument.Instrumentation() as instrumentation:
+            dipole_error.evaluate_models(ra, dec, 1.5, 2.0)
+            self.assertRaises(dipole_error.DipoleError, dipole_instrument.Instrumentation().start)
+        self.assertTrue(dipole_error._unit_vector is originals[0])
+        self.assertTrue(dipole_error.DipoleModel.__dict__['_model'] is originals[1])
+        summary = instrumentation.summary()
+        self.assertEqual(summary['parse']['rows'], 3)
+        self.assertEqual(summary['grouping']['rows'], 6)
+        self.assertEqual((summary['model']['calls'], summary['model']['rows']), (3, 18))
+        self.assertEqual(summary['propagation']['rows'], 18)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "run.prof")
+            instrumentation.dump_stats(filename)
+            labels = [label[2] for label in pstats.Stats(filename).stats]
+        finally:
+            shutil.rmtree(directory)
+        self.assertTrue('ZDipoleModel._model' in labels and 'parse_positions' in labels)
+
+class UArrayTest(unittest.TestCase):
+    """Array-backed linear error propagation."""
+
+    def test_model_predictions(self):
+        """model.uarray() agrees with evaluate() and with the ufloats of the scalar path."""
+        ra, dec = radian_positions()
+        z = np.array([1.6919, 0.9, 2.4])
+        model = dipole_error.ZDipoleModel()
+        predictions = model.uarray(ra, dec, z)
+        values, errors = model.evaluate(ra, dec, z)
+        self.assertTrue(np.allclose(predictions.nominal_values, values) and np.allclose(predictions.std_devs(), errors))
+        scalar = [model.ufloat(r, d, uncertainties.ufloat(x, 0.01)) for r, d, x in zip(ra, dec, z)]
+        with_z = model.uarray(ra, dec, dipole_uarray.UArray.from_ufloats([uncertainties.ufloat(x, 0.01) for x in z]))
+        self.assertTrue(np.allclose(with_z.std_devs(), [x.std_dev for x in scalar]))
+        self.assertTrue(np.allclose(predictions.covariance_matrix(), \
+                                    uncertainties.covariance_matrix(list(predictions.to_ufloats()))))
+
+    def test_arithmetic_matches_uncertainties(self):
+        """arithmetic and functions propagate as uncertainties does, across different variables."""
+        one = [uncertainties.ufloat(0.3, 0.02), uncertainties.ufloat(-1.2, 0.1)]
+        two = [uncertainties.ufloat(2.0, 0.3), 0.5]
+        a, b = dipole_uarray.UArray.from_ufloats(one), dipole_uarray.UArray.from_ufloats(two)
+        result = dipole_uarray.sin(a) / (b + 1.0) - dipole_uarray.arctan2(a, b) + \
+                 dipole_uarray.sqrt(abs(b)) ** 1.5 + 2 ** a - np.array([1.0, 2.0]) * dipole_uarray.exp(a * b)
+        expected = [sin(x) / (y + 1.0) - atan2(x, y) + sqrt(abs(y)) ** 1.5 + 2 ** x - k * exp(x * y) \
+                    for x, y, k in zip(one, two, (1.0, 2.0))]
+        self.assertTrue(np.allclose(result.nominal_values, [x.nominal_value for x in expected]))
+        self.assertTrue(np.allclose(result.std_devs(), [x.std_dev for x in expected]))
+        converted = result.to_ufloats()
+        self.assertAlmostEqual(uncertainties.covariance_matrix(list(converted))[0][1], \
+                               uncertainties.covariance_matrix(expected)[0][1])
+
+    def test_power_of_negative_and_zero_bases(self):
+        """a number as exponent takes no logarithm of the base, so no invalid values arise."""
+        values = [uncertainties.ufloat(-2.0, 0.1), uncertainties.ufloat(0.0, 0.2), uncertainties.ufloat(3.0, 0.3)]
+        with np.errstate(all="raise"):
+            result = dipole_uarray.UArray.from_ufloats(values) ** 2
+        self.assertTrue(np.allclose(result.nominal_values, [4.0, 0.0, 9.0]))
+        self.assertTrue(np.allclose(result.std_devs(), [(x ** 2).std_dev for x in values]))
+
+    def test_broadcasting_with_arrays(self):
+        """a one-element UArray combined with an array of numbers broadcasts its derivatives too."""
+        x = uncertainties.ufloat(1.0, 0.1)
+        one = dipole_uarray.UArray.from_ufloats([x])
+        offsets = np.arange(3.0)
+        for result, expected in ((one + offsets, [x + k for k in offsets]), (offsets * one, [k * x for k in offsets]), \
+                                 (dipole_uarray.sin(one) - offsets, [sin(x) - k for k in offsets])):
+            self.assertEqual((result.shape, result.derivatives.shape), ((3,), (3, 1)))
+            self.assertTrue(np.allclose(result.std_devs(), [y.std_dev for y in expected]))
+            self.assertEqual(len(result.to_ufloats()), 3)
+            self.assertAlmostEqual(result[2].std_devs()[()], expected[2].std_dev)
+        self.assertRaises(dipole_error.DipoleError, dipole_uarray.UArray, np.zeros(3), np.zeros((2, 1)), (x,))
+
+    def test_indexing(self):
+        """indices with or without an Ellipsis select the same elements from values and derivatives."""
+        ra, dec = radian_positions()
+        predictions = dipole_error.DipoleModel().uarray(np.vstack((ra, ra)), np.vstack((dec, dec[::-1])))
+        for index in ((Ellipsis, 1), (0, Ellipsis), (1, Ellipsis, 2), Ellipsis, (slice(None), 0), 1, (0, 2)):
+            selected = predictions[index]
+            self.assertTrue(np.array_equal(selected.nominal_values, predictions.nominal_values[index]))
+            self.assertTrue(np.array_equal(selected.std_devs(), predictions.std_devs()[index]))
+        self.assertEqual(predictions[..., 1].shape, (2,))
+
+class ParameterCovarianceTest(unittest.TestCase):
+    """Full parameter covariance matrices in place of independent ufloats."""
+
+    def setUp(self):
+        correlation = np.eye(4)
+        correlation[0, 1] = correlation[1, 0] = 0.3
+        correlation[2, 3] = correlation[3, 2] = -0.6
+        self.covariance = dipole_error.correlation_covariance([1.0, 10.0, 0.21e-5, 0.084e-5], correlation)
+        self.correlated = uncertainties.correlated_values([17.3, -61.0, 0.97e-5, -0.178e-5], self.covariance)
+
+    def test_matches_correlated_values(self):
+        """a covariance matrix gives the errors of uncertainties.correlated_values, on every path."""
+        ra, dec = radian_positions()
+        reference = dipole_error.DipoleModel(*self.correlated)
+        model = dipole_error.DipoleModel(covariance=self.covariance)
+        values, errors = reference.evaluate(ra, dec)
+        self.assertTrue(np.allclose(model.evaluate(ra, dec)[1], errors, rtol=1e-10, atol=0))
+        self.assertFalse(np.allclose(dipole_error.DipoleModel().evaluate(ra, dec)[1], errors))
+        array_values, array_errors = dipole_error.dipole_monopole_array(ra, dec, covariance=self.covariance)
+        self.assertTrue(np.allclose(array_errors, errors, rtol=1e-10, atol=0))
+        predictions = dipole_error.evaluate_models(ra, dec, covariances={'dipole': self.covariance})
+        self.assertTrue(np.allclose(predictions['dipole_err'], errors, rtol=1e-10, atol=0))
+        scalar = dipole_error.dipole_monopole(ra[0], dec[0], covariance=self.covariance)
+        self.assertAlmostEqual(scalar.std_dev, errors[0], delta=1e-10 * errors[0])
+        self.assertTrue(np.allclose(model.uarray(ra, dec).std_devs(), errors, rtol=1e-10, atol=0))
+
+    def test_monte_carlo_samples_correlations(self):
+        """Monte Carlo draws from the full matrix; with a fixed direction it agrees with J C J^T."""
+        covariance = self.covariance.copy()
+        covariance[:2, :] = covariance[:, :2] = 0.0
+        model = dipole_error.DipoleModel(covariance=covariance)
+        ra, dec = radian_positions()
+        result = dipole_error.monte_carlo(model, ra, dec, n_samples=200000, seed=11)
+        self.assertTrue(np.allclose(result.std, result.error, rtol=0.01, atol=0))
+
+    def test_invalid_covariance(self):
+        """wrong shapes, asymmetric and indefinite matrices are rejected."""
+        self.assertRaises(dipole_error.DipoleError, dipole_error.DipoleModel, covariance=np.eye(3))
+        asymmetric = self.covariance.copy()
+        asymmetric[0, 2] = 1e-6
+        self.assertRaises(dipole_error.DipoleError, dipole_error.DipoleModel, covariance=asymmetric)
+        indefinite = self.covariance.copy()
+        indefinite[0, 3] = indefinite[3, 0] = 5.0
+        self.assertRaises(dipole_error.NegativeError, dipole_error.DipoleModel, covariance=indefinite)
+        self.assertRaises(dipole_error.DipoleError, dipole_error.evaluate_models, 0.1, 0.2, \
+                          covariances={'quadrupole': self.covariance})
+
 if __name__ == "__main__":
     unittest.main()
     